@@ -11,7 +11,11 @@ import time
 load_dotenv()
 
 # --- IMPORT AGENT SAU KHI LOAD ENV ---
-from core.router import create_router
+from core.warmup import FAILED, READY, get_router, start_warmup
+from core.streaming import stream_events
+from core.tools.nmap_tool import extract_structured_result
+from core.tracing import get_trace, stage_rows
+from core.chains.full_plan_chain import FULL_PLAN_MODE
 
 # --- CẤU HÌNH TRANG WEB ---
 st.set_page_config(
@@ -21,6 +25,8 @@ st.set_page_config(
 )
 
 # --- KHỞI TẠO AGENT ---
+# Router (model embedding, FAISS, LLM, Agent) được khởi động ở luồng nền (core/warmup.py), dùng chung cho
+# mọi phiên: giao diện hiện ngay, trạng thái khởi động hiển thị ở sidebar.
 @st.cache_resource
 def load_agent():
     try:
@@ -36,16 +42,147 @@ def load_agent():
         # else:
         #     st.success(f"Đã kết nối với Kali Listener tại: {kali_url}")
 
-        print("--- Đang khởi tạo Agent Router 3 Luồng... ---")
-        agent = create_router()
-        print("--- Agent Router 3 Luồng đã sẵn sàng! ---")
-        return agent
+        print("--- Đang khởi động nền Agent Router 3 Luồng... ---")
+        return start_warmup()
     except Exception as e:
         st.error(f"Lỗi khi khởi tạo Agent: {e}")
         st.exception(e)
         st.stop()
 
-agent_chain = load_agent()
+readiness = load_agent()
+
+@st.fragment(run_every=2)
+def render_readiness():
+    """Trạng thái khởi động của Agent (tự cập nhật mỗi 2 giây)."""
+    snapshot = readiness.snapshot()
+    if snapshot["state"] == READY:
+        st.caption(f"🟢 Agent sẵn sàng (khởi động {snapshot['elapsed']:.1f}s)")
+    elif snapshot["state"] == FAILED:
+        st.error(f"🔴 Khởi động thất bại: {snapshot['error']}")
+    else:
+        st.info(f"⏳ Đang khởi động: {snapshot['stage'] or '...'} ({snapshot['elapsed']:.0f}s)")
+
+# --- HIỂN THỊ KẾT QUẢ THEO DẠNG STREAM ---
+NO_RAG_CONTEXT = "Không tìm thấy thông tin liên quan trong cơ sở tri thức."
+
+# Các bước của Luồng 2 được hiển thị trong expander "Chuỗi tư duy" (tiêu đề -> tên bước)
+PLAN_STEPS = {
+    "Bước 1: Thu thập thông tin": "recon_results",
+    "Bước 2: Phân tích lỗ hổng": "analysis_results",
+    "Bước 3: Lên kế hoạch khai thác": "exploitation_results",
+    "Bước 4: Tạo Payload (từ RAG)": "actionable_intelligence",
+}
+PLAN_FINAL_STEP = "actionable_intelligence"
+# Các bước mà câu trả lời được stream thẳng vào khung chat (Luồng 1 và Luồng 3)
+ANSWER_STEPS = {"rag_answer", "agent"}
+
+def content_text(content) -> str:
+    """Nội dung hiển thị của kết quả một bước (AIMessage, dict của Agent hoặc chuỗi)."""
+    if isinstance(content, AIMessage):
+        return content.content
+    if isinstance(content, dict) and "output" in content:
+        return str(content["output"])
+    if content is None:
+        return ""
+    return content if isinstance(content, str) else str(content)
+
+class StreamingView:
+    """Vẽ các sự kiện của core.streaming vào khung chat ngay khi chúng đến (token, output tool, từng bước)."""
+
+    def __init__(self, max_tool_lines: int = 30):
+        self.tool_placeholder = st.empty()
+        self.answer_placeholder = st.empty()
+        self.max_tool_lines = max_tool_lines
+        self.tool_lines = []
+        self.texts = {}
+        self.ended = set()
+        self.plan_placeholders = None
+        self.rag_container = None
+
+    def _plan_placeholders(self):
+        """Tạo expander của Luồng 2 (một lần) khi bước đầu tiên của kế hoạch bắt đầu có dữ liệu."""
+        if self.plan_placeholders is None:
+            st.markdown("### 🤖 Phản hồi (Luồng 2: Lên Kế hoạch)")
+            with st.expander("🔎 Xem Chuỗi tư duy (Luồng 2: Payload và Hướng dẫn Chi tiết)", expanded=True):
+                self.rag_container = st.container()
+                self.plan_placeholders = {}
+                for display_title, step in PLAN_STEPS.items():
+                    st.subheader(f"📝 {display_title}")
+                    self.plan_placeholders[step] = st.empty()
+                    if step != PLAN_FINAL_STEP:
+                        st.divider()
+        return self.plan_placeholders
+
+    def handle(self, event: dict):
+        kind = event["type"]
+        step = event.get("step")
+        if kind == "tool_output":
+            self.tool_lines.append(f"[{event.get('tool')}] {event.get('line', '')}")
+            self.tool_placeholder.code("\n".join(self.tool_lines[-self.max_tool_lines:]), language="bash")
+        elif kind == "token":
+            self.texts[step] = self.texts.get(step, "") + event["text"]
+            if step in PLAN_STEPS.values():
+                self._plan_placeholders()[step].markdown(self.texts[step] + "▌")
+            elif step in ANSWER_STEPS:
+                self.answer_placeholder.markdown(self.texts[step] + "▌")
+        elif kind == "step_end":
+            self.ended.add(step)
+            if step in PLAN_STEPS.values():
+                self._plan_placeholders()[step].markdown(content_text(event["output"]))
+            elif step == "rag_context":
+                rag_context_str = event["output"]
+                if isinstance(rag_context_str, str) and rag_context_str != NO_RAG_CONTEXT:
+                    self._plan_placeholders()
+                    with self.rag_container:
+                        st.subheader("📚 Thông tin tham khảo từ RAG:")
+                        with st.container(border=True):
+                            st.markdown(rag_context_str)
+                        st.divider()
+
+    def finish_plan(self, response: dict):
+        """Vẽ các bước của Luồng 2 chưa được stream (vd: câu trả lời lấy từ cache ngữ nghĩa)."""
+        for step in ["rag_context", *PLAN_STEPS.values()]:
+            if step not in self.ended:
+                self.handle({"type": "step_end", "step": step, "output": response.get(step)})
+
+    def clear(self):
+        """Xóa phần hiển thị tạm (output tool, câu trả lời đang stream) trước khi vẽ kết quả cuối cùng."""
+        self.tool_placeholder.empty()
+        self.answer_placeholder.empty()
+
+def render_nmap_results(intermediate_steps):
+    """Hiển thị kết quả Nmap có cấu trúc (từ các bước gọi tool của Agent) thành bảng cổng."""
+    for action, observation in intermediate_steps or []:
+        model = extract_structured_result(observation)
+        if model is None:
+            continue
+        for host in model.get("hosts", []):
+            name = ", ".join(host.get("hostnames", [])) or host.get("address")
+            with st.expander(f"🛰️ Nmap: {name} ({host.get('address')}) - {host.get('status', 'unknown')}"):
+                if host.get("os"):
+                    st.caption(f"OS: {host['os']['name']} ({host['os']['accuracy']}%)")
+                rows = [{
+                    "Cổng": f"{p['port']}/{p.get('protocol')}",
+                    "Trạng thái": p.get("state"),
+                    "Dịch vụ": p.get("service", ""),
+                    "Phiên bản": " ".join(filter(None, [p.get("product"), p.get("version"), p.get("extrainfo")])),
+                } for p in host.get("ports", [])]
+                if rows:
+                    st.dataframe(rows, use_container_width=True, hide_index=True)
+                for port in host.get("ports", []):
+                    for script_id, script_output in port.get("scripts", {}).items():
+                        st.markdown(f"**{port['port']}/{script_id}**")
+                        st.code(script_output)
+
+def render_trace(trace):
+    """Bảng thời gian xử lý theo từng bước của request (core/tracing.py)."""
+    if not trace:
+        return
+    with st.expander(f"⏱️ Thời gian xử lý: {trace['total_seconds']:.2f}s"):
+        st.dataframe(stage_rows(trace), use_container_width=True, hide_index=True)
+        tools = [span for span in trace["spans"] if span["kind"] == "tool"]
+        if tools:
+            st.caption("Tool: " + ", ".join(f"{span['name']} {span['duration']:.2f}s" for span in tools))
 
 # --- QUẢN LÝ SESSION STATE (NÂNG CẤP) ---
 def get_current_chat_history():
@@ -78,6 +215,7 @@ if not st.session_state.conversations:
 
 # --- SIDEBAR ---
 with st.sidebar:
+    render_readiness()
     st.title("📝 Lịch sử Chat")
     
     if st.button("➕ Trò chuyện mới", use_container_width=True):
@@ -90,6 +228,10 @@ with st.sidebar:
         st.session_state.active_chat_id = new_chat_id
         st.rerun()
 
+    # Kế hoạch nhanh: Luồng 2 chỉ gọi LLM một lần (core/chains/full_plan_chain.py)
+    fast_plan = st.toggle("⚡ Kế hoạch nhanh", value=FULL_PLAN_MODE == "fast",
+                          help="Lập kế hoạch pentest bằng một lần gọi LLM thay vì 4 bước nối tiếp.")
+
     st.divider()
 
     # Sắp xếp các chat theo thời gian, mới nhất lên trên
@@ -149,15 +291,25 @@ if prompt_to_run:
 
     # Chạy Agent và hiển thị kết quả
     with st.chat_message("assistant"):
+        view = StreamingView()
+        response = None
+        run_id = None
         with st.spinner("Cyber-Mentor đang phân tích..."):
             try:
+                # Chờ khởi động nền xong nếu prompt đến sớm (lỗi khởi động được hiển thị bên dưới)
+                agent_chain = get_router()
                 print(f"--- Đang gọi Agent 3 Luồng với input: {prompt_to_run} ---")
-                # Lấy history của chat hiện tại để đưa vào agent
-                current_history = get_current_chat_history()
-                response = agent_chain.invoke({
+                # Lấy history của chat hiện tại để đưa vào agent (không gồm prompt vừa thêm ở trên)
+                current_history = get_current_chat_history()[:-1]
+                # Stream: token của từng bước và output của tool được vẽ ngay khi đến
+                for event in stream_events(agent_chain, {
                     "user_input": prompt_to_run,
                     "chat_history": current_history # Thêm history vào
-                })
+                }, {"configurable": {"plan_mode": "fast" if fast_plan else "chain"}}):
+                    if event["type"] == "final":
+                        response, run_id = event["output"], event["run_id"]
+                    else:
+                        view.handle(event)
                 print(f"--- Agent đã trả về response type: {type(response)} ---")
                 if isinstance(response, dict):
                     print(f"--- Keys: {response.keys()} ---")
@@ -166,54 +318,23 @@ if prompt_to_run:
                 st.exception(e)
                 st.stop()
 
+        # Phần stream tạm chỉ dùng khi đang chạy, kết quả cuối cùng được hiển thị bên dưới
+        view.clear()
+
         # --- Xử lý và Phân tích Response ---
         full_response_text = ""
         new_recommendation = None
 
         # --- XỬ LÝ KẾT QUẢ TỪ LUỒNG 2 (full_plan_chain) ---
-        if isinstance(response, dict) and 'actionable_intelligence' in response:
-            st.markdown("### 🤖 Phản hồi (Luồng 2: Lên Kế hoạch)")
-            
-            final_step_key = 'actionable_intelligence'
-            final_step_title = "Payload và Hướng dẫn Chi tiết"
-            expander_title = f"🔎 Xem Chuỗi tư duy (Luồng 2: {final_step_title})"
-
-            with st.expander(expander_title, expanded=True):
-                steps_to_display = {
-                    "Bước 1: Thu thập thông tin": "recon_results",
-                    "Bước 2: Phân tích lỗ hổng": "analysis_results",
-                    "Bước 3: Lên kế hoạch khai thác": "exploitation_results",
-                    "Bước 4: Tạo Payload (từ RAG)": "actionable_intelligence",
-                }
-                
-                rag_context_str = response.get("rag_context")
-                if isinstance(rag_context_str, str) and rag_context_str != "Không tìm thấy thông tin liên quan trong cơ sở tri thức.":
-                        st.subheader("📚 Thông tin tham khảo từ RAG:")
-                        with st.container(border=True):
-                            st.markdown(rag_context_str)
-                        st.divider()
-
-                for display_title, response_key in steps_to_display.items():
-                    content = response.get(response_key)
-                    content_text = ""
-                    if isinstance(content, AIMessage):
-                        content_text = content.content
-                    elif isinstance(content, str):
-                        content_text = content
-                    elif content is not None:
-                        content_text = str(content)
-
-                    if content_text:
-                        st.subheader(f"📝 {display_title}")
-                        st.markdown(content_text)
-                        if response_key != final_step_key:
-                            st.divider()
-                        else:
-                            full_response_text = content_text
+        # Các bước đã được vẽ vào expander trong lúc stream
+        if isinstance(response, dict) and PLAN_FINAL_STEP in response:
+            view.finish_plan(response)
+            full_response_text = content_text(response.get(PLAN_FINAL_STEP))
 
         # --- XỬ LÝ KẾT QUẢ TỪ LUỒNG 3 (agent_executor) ---
         elif isinstance(response, dict) and 'output' in response:
             st.markdown("### 🤖 Phản hồi (Luồng 3: Thực thi Tool)")
+            render_nmap_results(response.get("intermediate_steps"))
             full_response_text = response['output']
 
         # --- XỬ LÝ KẾT QUẢ TỪ LUỒNG 1 (RAG Trực tiếp) ---
@@ -248,6 +369,8 @@ if prompt_to_run:
              st.code(display_text, language="bash")
         else:
              st.markdown(display_text)
+
+        render_trace(get_trace(run_id))
         
         # LƯU VÀO HISTORY
         get_current_chat_history().append({"role": "assistant", "content": display_text})
@@ -0,0 +1,230 @@
+# File: batch.py
+# Chạy hàng loạt prompt (JSONL) qua router với số request đồng thời giới hạn, dùng cho kiểm thử hồi quy
+# và tạo báo cáo. Mỗi dòng input: {"id": "...", "user_input": "...", "chat_history": [...]} ("id" và
+# "chat_history" không bắt buộc, "prompt" được chấp nhận thay cho "user_input").
+# Mỗi dòng output: nhánh router đã chọn, thời gian từng bước, câu trả lời (hoặc lỗi).
+#
+#     python batch.py prompts.jsonl -o results.jsonl -c 8
+#
+# Chạy lại cùng lệnh sau khi bị gián đoạn sẽ bỏ qua các prompt đã có kết quả thành công trong file output;
+# các prompt lỗi được chạy lại và bản ghi lỗi cũ bị xóa khỏi file, nên mỗi id chỉ có một bản ghi.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Số prompt chạy đồng thời mặc định (quota Gemini vẫn do core/rate_limiter.py kiểm soát)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# Các run không phải "bước" (as_step) nhưng vẫn cần đo thời gian
+TIMED_RUNS = {"intent_classifier", "rag_retrieval"}
+# Các bước của full_plan_chain (cả hai plan_mode): request chỉ được tính là nhánh full_plan khi một trong
+# các bước này đã bắt đầu. Lỗi trước khi chọn nhánh (classifier, LLM router...) được ghi là "unknown".
+FULL_PLAN_STAGES = {"recon_results", "analysis_results", "exploitation_results", "rag_context",
+                    "actionable_intelligence", "fast_plan"}
+
+
+# langchain / core.streaming (kéo theo httpx, requests...) chỉ được import khi thật sự có prompt phải chạy,
+# sau khi đã đọc tham số và prepare_resume: --help hay chạy lại một batch đã xong không phải trả giá import
+_stage_timer_class = None
+
+
+def new_stage_timer():
+    """StageTimer mới cho một request (lớp được tạo ở lần gọi đầu để import langchain lười)."""
+    global _stage_timer_class
+    if _stage_timer_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        from core.streaming import STEP_TAG_PREFIX
+
+        class StageTimer(BaseCallbackHandler):
+            """Đo thời gian từng bước của router trong một request, và ghi lại topic mà classifier trả về."""
+
+            run_inline = True
+
+            def __init__(self):
+                self.running = {}  # run_id -> (tên bước, thời điểm bắt đầu)
+                self.started = set()
+                self.stages = {}
+                self.topic = None
+
+            def on_chain_start(self, serialized, inputs, *, run_id, tags=None, name=None, **kwargs):
+                if name in TIMED_RUNS or (name and STEP_TAG_PREFIX + name in (tags or [])):
+                    self.running[run_id] = (name, time.perf_counter())
+                    self.started.add(name)
+
+            def _finish(self, run_id) -> str | None:
+                if run_id not in self.running:
+                    return None
+                name, start = self.running.pop(run_id)
+                self.stages[name] = round(self.stages.get(name, 0) + time.perf_counter() - start, 3)
+                return name
+
+            def on_chain_end(self, outputs, *, run_id, **kwargs):
+                if self._finish(run_id) == "intent_classifier":
+                    self.topic = str(outputs).strip()
+
+            def on_chain_error(self, error, *, run_id, **kwargs):
+                # Bước lỗi vẫn được tính thời gian (và xác định nhánh đã chọn)
+                self._finish(run_id)
+
+            @property
+            def branch(self) -> str:
+                if "agent" in self.started:
+                    return "agent"
+                if "rag_answer" in self.started:
+                    return "rag_answer"
+                if self.started & FULL_PLAN_STAGES:
+                    return "full_plan"
+                return "unknown"
+
+        _stage_timer_class = StageTimer
+    return _stage_timer_class()
+
+
+def to_jsonable(value):
+    """Kết quả của router (AIMessage, dict của Agent/full_plan_chain, chuỗi) -> dữ liệu JSON."""
+    from langchain_core.agents import AgentAction
+    from langchain_core.messages import BaseMessage
+
+    if isinstance(value, BaseMessage):
+        return value.content
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and isinstance(value[0], AgentAction):
+            return {"tool": value[0].tool, "tool_input": to_jsonable(value[0].tool_input),
+                    "observation": to_jsonable(value[1])}
+        return [to_jsonable(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def load_prompts(path: str) -> list[dict]:
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            user_input = item.get("user_input") or item.get("prompt")
+            if not user_input:
+                raise ValueError(f"{path}:{number}: thiếu 'user_input'")
+            prompts.append({"id": str(item.get("id", number)), "user_input": user_input,
+                            "chat_history": item.get("chat_history") or []})
+    return prompts
+
+
+def prepare_resume(path: str) -> set[str]:
+    """
+    Chuẩn bị chạy tiếp sau khi bị gián đoạn: trả về các id đã chạy thành công, và ghi lại file output chỉ
+    với các bản ghi thành công (mỗi id một bản ghi). Bản ghi lỗi bị bỏ vì prompt đó sẽ được chạy lại
+    và ghi bản ghi mới; dòng ghi dở khi bị ngắt cũng bị bỏ.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    kept = []
+    dropped = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                dropped += 1  # dòng ghi dở khi bị ngắt
+                continue
+            if record.get("error") is not None or record["id"] in done:
+                dropped += 1
+                continue
+            done.add(record["id"])
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        # Ghi ra file tạm rồi đổi tên, để bị ngắt giữa chừng cũng không mất kết quả đã có
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(path + ".tmp", path)
+        print(f"--- [Batch] Bỏ {dropped} bản ghi lỗi/dở dang khỏi {path} (các prompt đó sẽ được chạy lại) ---")
+    return done
+
+
+async def run_one(chain, prompt: dict) -> dict:
+    timer = new_stage_timer()
+    start = time.perf_counter()
+    record = {"id": prompt["id"], "user_input": prompt["user_input"]}
+    try:
+        output = await chain.ainvoke({"user_input": prompt["user_input"], "chat_history": prompt["chat_history"]},
+                                     config={"callbacks": [timer], "metadata": {"batch_id": prompt["id"]}})
+        record.update(output=to_jsonable(output), error=None)
+    except Exception as e:
+        record.update(output=None, error=f"{type(e).__name__}: {e}")
+    record.update(topic=timer.topic, branch=timer.branch, stages=timer.stages,
+                  total=round(time.perf_counter() - start, 3))
+    return record
+
+
+async def run_batch(chain, prompts: list[dict], output_path: str, concurrency: int) -> list[dict]:
+    """Chạy các prompt với tối đa `concurrency` request cùng lúc, ghi mỗi kết quả ngay khi xong."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(prompt):
+        async with semaphore:
+            return await run_one(chain, prompt)
+
+    records = []
+    with open(output_path, "a", encoding="utf-8") as out:
+        for finished in asyncio.as_completed([bounded(p) for p in prompts]):
+            record = await finished
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            records.append(record)
+            status = "LỖI" if record["error"] else record["branch"]
+            print(f"--- [Batch] {len(records)}/{len(prompts)} xong: id={record['id']} ({status}, {record['total']}s) ---")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy hàng loạt prompt JSONL qua router của Cyber-Mentor.")
+    parser.add_argument("input", help="File JSONL các prompt ({'id', 'user_input', 'chat_history'}).")
+    parser.add_argument("-o", "--output", help="File JSONL kết quả (mặc định: <input>.results.jsonl).")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help=f"Số prompt chạy đồng thời (mặc định {BATCH_CONCURRENCY}).")
+    parser.add_argument("--no-resume", action="store_true", help="Chạy lại tất cả, kể cả prompt đã có kết quả.")
+    args = parser.parse_args(argv)
+
+    output_path = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+    prompts = load_prompts(args.input)
+    if args.no_resume and os.path.exists(output_path):
+        os.remove(output_path)
+    done = prepare_resume(output_path)
+    pending = [p for p in prompts if p["id"] not in done]
+    print(f"--- [Batch] {len(prompts)} prompt, {len(prompts) - len(pending)} đã xong, "
+          f"chạy {len(pending)} với {args.concurrency} luồng đồng thời -> {output_path} ---")
+    if not pending:
+        return 0
+
+    # Import sau khi đọc tham số: khởi tạo router (model embedding, FAISS, LLM) mất vài giây
+    from core.warmup import get_router
+    chain = get_router()
+
+    start = time.perf_counter()
+    records = asyncio.run(run_batch(chain, pending, output_path, max(1, args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    branches = {}
+    for record in records:
+        branches[record["branch"]] = branches.get(record["branch"], 0) + 1
+    errors = sum(1 for record in records if record["error"])
+    print(f"--- [Batch] Xong {len(records)} prompt trong {elapsed:.1f}s "
+          f"({len(records) / elapsed * 60:.1f} prompt/phút), nhánh: {branches}, lỗi: {errors} ---")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# File: benchmarks/replay_tool.py
+# "Tool" giả cho Listener stub: được gọi qua symlink tên nmap / sqlmap / dirsearch và phát lại output đã ghi
+# sẵn trong benchmarks/fixtures/<tool>.txt, rải đều trong BENCH_TOOL_DELAY giây.
+# Với nmap, file XML (fixtures/nmap.xml) được chép ra đường dẫn sau cờ -oX như nmap thật.
+
+import os
+import shutil
+import sys
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    delay = float(os.getenv("BENCH_TOOL_DELAY", "0.5"))
+
+    with open(os.path.join(FIXTURES, f"{tool}.txt"), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    pause = delay / max(1, len(lines))
+    for line in lines:
+        print(line, flush=True)
+        time.sleep(pause)
+
+    if "-oX" in args:
+        shutil.copyfile(os.path.join(FIXTURES, f"{tool}.xml"), args[args.index("-oX") + 1])
+
+
+if __name__ == "__main__":
+    main()
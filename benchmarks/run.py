@@ -0,0 +1,182 @@
+# File: benchmarks/run.py
+# Benchmark độ trễ offline cho từng nhánh của create_router(): RAG (rag_answer), lập kế hoạch (full_plan)
+# và Agent thực thi tool (agent). Không cần mạng:
+#   - LLM Gemini được thay bằng BenchmarkChatModel (benchmarks/fake_llm.py) với độ trễ cố định mỗi lần gọi,
+#   - máy Kali được thay bằng kali_listener.py chạy local với tool giả (benchmarks/stub_listener.py),
+#   - embedding MiniLM được thay bằng embedding giả và một FAISS index tổng hợp (trừ khi --real-embeddings).
+# Kết quả (p50/p95/p99, throughput, thời gian từng bước) được ghi ra JSON để so sánh giữa các lần chạy.
+#
+#     python -m benchmarks.run -n 30 -c 1 4 --llm-latency 0.2 --tool-delay 0.5
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+BRANCHES = ["rag_answer", "full_plan", "agent"]
+
+
+def branch_prompt(branch: str, i: int) -> str:
+    """Câu hỏi thứ i cho một nhánh (mục tiêu khác nhau để không trúng cache kết quả của Listener)."""
+    if branch == "rag_answer":
+        return f"SQL Injection loại {i} là gì?"
+    if branch == "full_plan":
+        return f"Lên kế hoạch pentest cho ứng dụng web số {i}"
+    return f"Quét nmap 10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def build_synthetic_index(embeddings, docs: int) -> str:
+    """FAISS index gồm `docs` đoạn văn tổng hợp, lưu ra thư mục tạm (để retrieval có chi phí thật)."""
+    from langchain_community.vectorstores import FAISS
+
+    topics = ["SQL Injection", "XSS", "SSRF", "IDOR", "LFI", "XXE", "CSRF", "nmap", "sqlmap", "dirsearch"]
+    texts = [f"{topics[i % len(topics)]} - ghi chú số {i}: cách phát hiện, payload mẫu và cách khắc phục." * 4
+             for i in range(docs)]
+    path = tempfile.mkdtemp(prefix="bench-index-")
+    FAISS.from_texts(texts, embeddings, metadatas=[{"source": f"synthetic-{i}"} for i in range(docs)]).save_local(path)
+    return path
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    return {"p50": round(float(np.percentile(values, 50)), 4), "p95": round(float(np.percentile(values, 95)), 4),
+            "p99": round(float(np.percentile(values, 99)), 4), "mean": round(float(np.mean(values)), 4)}
+
+
+async def measure(chain, branch: str, requests: int, concurrency: int, offset: int) -> dict:
+    from batch import run_one
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            return await run_one(chain, {"id": f"{branch}-{i}", "user_input": branch_prompt(branch, i),
+                                         "chat_history": []})
+
+    from core.tools.kali_client import close_async_kali_client
+
+    start = time.perf_counter()
+    try:
+        records = await asyncio.gather(*(bounded(offset + i) for i in range(requests)))
+    finally:
+        # Mỗi lần đo là một asyncio.run riêng: đóng AsyncKaliClient của loop này để không rò pool httpx
+        await close_async_kali_client()
+    wall = time.perf_counter() - start
+
+    ok = [r for r in records if not r["error"] and r["branch"] == branch]
+    stages = {}
+    for record in ok:
+        for name, seconds in record["stages"].items():
+            stages.setdefault(name, []).append(seconds)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 3),
+        "latency": percentiles([r["total"] for r in ok]),
+        "stages": {name: percentiles(values) for name, values in stages.items()},
+        "errors": sum(1 for r in records if r["error"]),
+        "wrong_branch": sum(1 for r in records if not r["error"] and r["branch"] != branch),
+        "sample_error": next((r["error"] for r in records if r["error"]), None),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ offline cho các nhánh của router.")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="Số request đo cho mỗi nhánh và mức đồng thời.")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 4], help="Các mức đồng thời cần đo.")
+    parser.add_argument("--branches", nargs="+", choices=BRANCHES, default=BRANCHES)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Độ trễ mỗi lần gọi LLM giả (giây).")
+    parser.add_argument("--response-words", type=int, default=150, help="Độ dài câu trả lời của LLM giả (từ).")
+    parser.add_argument("--tool-delay", type=float, default=0.5, help="Thời gian chạy mỗi tool giả trên Listener stub (giây).")
+    parser.add_argument("--index-docs", type=int, default=2000, help="Số đoạn văn trong FAISS index tổng hợp.")
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Dùng MiniLM và index thật (RAG_INDEX_DIR) thay cho embedding giả.")
+    parser.add_argument("--plan-mode", choices=["chain", "fast"], default="chain",
+                        help="Chế độ lập kế hoạch của nhánh full_plan (FULL_PLAN_MODE).")
+    parser.add_argument("--no-local-classifier", action="store_true", help="Luôn phân loại bằng router LLM.")
+    parser.add_argument("-o", "--output", help="File JSON kết quả (mặc định: benchmarks/results/bench-<thời gian>.json).")
+    args = parser.parse_args(argv)
+
+    # --- Cấu hình môi trường TRƯỚC khi import core (các module đọc biến môi trường lúc import) ---
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-offline")
+    os.environ["SEMANTIC_CACHE"] = "0"
+    os.environ["FULL_PLAN_MODE"] = args.plan_mode
+    if args.no_local_classifier:
+        os.environ["LOCAL_INTENT_CLASSIFIER"] = "0"
+    from benchmarks.stub_listener import start_stub_listener
+    url, server = start_stub_listener(args.tool_delay)
+    os.environ["KALI_LISTENER_URL"] = url
+    if not args.real_embeddings:
+        os.environ["RAG_FAKE_EMBEDDINGS"] = "1"
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        # Cùng loại/số chiều với embedding giả của core/chains/retriever.py (chưa import được: retriever
+        # đọc RAG_INDEX_DIR lúc import, nên nó phải được đặt trước)
+        os.environ["RAG_INDEX_DIR"] = build_synthetic_index(DeterministicFakeEmbedding(size=384), args.index_docs)
+
+    # Mọi LLM của repo được tạo qua core.llm.create_gemini_llm: thay nó trước khi các chain được import
+    import core.llm
+    from benchmarks.fake_llm import BenchmarkChatModel
+    core.llm.create_gemini_llm = lambda model=None, **kwargs: BenchmarkChatModel(
+        latency=args.llm_latency, response_words=args.response_words)
+
+    from core.router import create_router
+    chain = create_router()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "branches": {},
+    }
+    offset = 0
+    try:
+        for branch in args.branches:
+            # Khởi động nóng (import lười, kết nối, centroid của bộ phân loại...) không tính vào kết quả
+            asyncio.run(measure(chain, branch, 1, 1, offset))
+            offset += 1
+            results["branches"][branch] = []
+            for concurrency in args.concurrency:
+                result = asyncio.run(measure(chain, branch, args.requests, concurrency, offset))
+                offset += args.requests
+                results["branches"][branch].append(result)
+                latency = result["latency"]
+                print(f"--- [Benchmark] {branch:<10} c={concurrency:<3} p50={latency.get('p50')}s "
+                      f"p95={latency.get('p95')}s p99={latency.get('p99')}s "
+                      f"{result['throughput_rps']} req/s, lỗi: {result['errors']} ---")
+    finally:
+        server.shutdown()
+
+    # Thống kê thực thi suy đoán (đoán đúng/sai, thời gian lãng phí) trên toàn bộ lần chạy
+    from core.speculation import get_speculator
+    results["speculation"] = get_speculator().stats()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"--- [Benchmark] Đã ghi kết quả vào {output} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# File: benchmarks/stub_listener.py
+# Chạy kali_listener.py thật (job manager, SSE, spool, parse XML...) trên localhost, nhưng các tool
+# được thay bằng benchmarks/replay_tool.py: không cần máy Kali, không gửi gói tin nào ra mạng.
+
+import logging
+import os
+import tempfile
+import threading
+
+from werkzeug.serving import make_server
+
+REPLAY_TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replay_tool.py")
+
+
+def start_stub_listener(tool_delay: float = 0.5, port: int = 0):
+    """Khởi động Listener stub trong thread nền. Trả về (URL, server) - gọi server.shutdown() để dừng."""
+    import kali_listener
+
+    # Mỗi tool là một symlink tới replay_tool.py, replay_tool.py dựa vào tên symlink để chọn fixture
+    bin_dir = tempfile.mkdtemp(prefix="bench-tools-")
+    for tool in kali_listener.ALLOWED_TOOLS:
+        path = os.path.join(bin_dir, tool)
+        os.symlink(REPLAY_TOOL, path)
+        kali_listener.ALLOWED_TOOLS[tool] = path
+    # Tiến trình tool kế thừa biến môi trường của Listener
+    os.environ["BENCH_TOOL_DELAY"] = str(tool_delay)
+
+    # Bỏ log từng request của werkzeug để không lẫn với kết quả benchmark
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", port, kali_listener.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="stub-listener", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    print(f"--- [Benchmark] Listener stub chạy tại {url} (tool giả, {tool_delay}s mỗi lần chạy) ---")
+    return url, server
@@ -1,44 +1,51 @@
 # File: core/agents/executor.py (Đã cập nhật Burp Tool)
 
 import os
-from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+import asyncio
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 
 # Import các prompt của Agent
 from ..chains.prompts import agent_system_prompt_template
 
 # <<< BƯỚC QUAN TRỌNG: IMPORT CÁC TOOL "NÃO-TAY" CỦA BẠN >>>
-from ..tools.nmap_tool import run_nmap_scan
+from ..tools.nmap_tool import run_nmap_scan, run_nmap_batch_scan
 from ..tools.sqlmap_tool import run_sqlmap_scan
+from ..tools.kali_client import close_async_kali_client
+from ..llm import create_gemini_llm
+from ..context_manager import ContextManager
 
+# Model cho Agent (Nên dùng model mạnh một chút)
+AGENT_MODEL = "gemini-2.0-flash"  # Nâng cấp lên Pro nếu cần
 
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-
-# Khởi tạo LLM cho Agent (Nên dùng model mạnh một chút)
-agent_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", # Nâng cấp lên Pro nếu cần
-                                 google_api_key=api_key,
-                                 temperature=0)
+# Giữ chat_history và observation của tool trong ngân sách token của model Agent
+context_manager = ContextManager(model=AGENT_MODEL)
 
 # --- ĐỊNH NGHĨA AGENT EXECUTOR ---
 
 def create_agent_executor():
     """
-    Tạo một Agent Executor có khả năng gọi các tool pentest.
+    Tạo một Agent Executor có khả năng gọi các tool pentest (gọi từ create_router, không phải lúc import).
     """
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+
+    # Khởi tạo LLM cho Agent
+    agent_llm = create_gemini_llm(model=AGENT_MODEL,
+                                  temperature=0)
     
     # 1. Danh sách các tool mà Agent này có thể sử dụng
     tools = [
         run_nmap_scan,
+        run_nmap_batch_scan,
         run_sqlmap_scan,
     ]
     
     # 2. Prompt cho Agent
-    # Chúng ta dùng prompt từ file prompts.py
-    agent_prompt = ChatPromptTemplate.from_template(agent_system_prompt_template)
+    # Chúng ta dùng prompt từ file prompts.py, đặt sau lịch sử hội thoại (đã tóm tắt/cắt theo ngân sách)
+    agent_prompt = ChatPromptTemplate.from_messages([
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", agent_system_prompt_template),
+    ])
     
     # 3. Tạo Agent
     # bind_tools sẽ tự động "dạy" LLM cách sử dụng các tool của bạn
@@ -50,24 +57,51 @@ def create_agent_executor():
         agent=agent, 
         tools=tools, 
         verbose=True, # Đặt là True để xem log suy nghĩ của AI
-        handle_parsing_errors=True # Xử lý lỗi nếu AI trả về sai định dạng
+        handle_parsing_errors=True, # Xử lý lỗi nếu AI trả về sai định dạng
+        return_intermediate_steps=True, # Trả về các bước gọi tool để UI hiển thị kết quả có cấu trúc
+        # Agent chỉ thấy phần liên quan của output tool (cổng mở, điểm injection...) trong ngân sách token;
+        # intermediate_steps trả về cho UI vẫn là output đầy đủ
+        trim_intermediate_steps=context_manager.trim_intermediate_steps,
     )
     
+    # 5. Chạy AgentExecutor qua đường async (ainvoke), kể cả khi chain được gọi bằng invoke đồng bộ.
+    # Ở đường async, các tool call độc lập trong cùng một lượt (vd: nmap 2 host + sqlmap) được chạy
+    # đồng thời bằng asyncio.gather trên bản async của tool, nên một lượt chỉ tốn thời gian bằng tool chậm nhất.
+    # Mỗi lượt đồng bộ chạy trong một event loop tạm (asyncio.run); AsyncKaliClient của loop đó được đóng
+    # trước khi loop kết thúc, để connection pool httpx không bị rò qua từng lượt.
+    async def ainvoke_in_temporary_loop(inputs, config):
+        try:
+            return await agent_executor_obj.ainvoke(inputs, config)
+        finally:
+            await close_async_kali_client()
+
+    def invoke_concurrently(inputs, config):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(ainvoke_in_temporary_loop(inputs, config))
+        # Đang ở trong một event loop (vd: Jupyter) -> không thể asyncio.run, chạy tuần tự như cũ
+        return agent_executor_obj.invoke(inputs, config)
+
+    async def ainvoke_concurrently(inputs, config):
+        return await agent_executor_obj.ainvoke(inputs, config)
+
+    concurrent_agent_executor = RunnableLambda(invoke_concurrently, afunc=ainvoke_concurrently,
+                                               name="AgentExecutor")
+
     # Chúng ta bọc nó trong một chain để chuẩn hóa input/output
     # Nó sẽ nhận {"user_input": "..."}
     # Và trả về {"output": "..."}
     agent_executor_chain = (
         RunnablePassthrough.assign(
            # AgentExecutor cần input là "input" và "chat_history"
-           # Chúng ta sẽ lấy chat_history từ input
+           # chat_history lấy từ input (mảng rỗng nếu không có): giữ nguyên văn các tin gần nhất,
+           # các tin cũ hơn được thay bằng bản tóm tắt cuốn chiếu (core/context_manager.py)
            input=lambda x: x["user_input"],
-           chat_history=lambda x: x.get("chat_history", []) # Lấy history, nếu không có thì dùng mảng rỗng
+           chat_history=context_manager.history_runnable(),
         )
-        | agent_executor_obj # Dùng biến đã đổi tên
+        | concurrent_agent_executor
     )
     
     print("--- [Agent Executor] Đã khởi tạo Luồng 3 (Thực thi Tool) ---")
     return agent_executor_chain
-
-# Khởi tạo agent executor ngay khi load module
-agent_executor = create_agent_executor()
\ No newline at end of file
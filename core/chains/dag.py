@@ -0,0 +1,90 @@
+# File: core/chains/dag.py
+# Dựng một chain LCEL từ đồ thị phụ thuộc giữa các bước, để các bước độc lập chạy song song.
+
+import asyncio
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from ..streaming import as_step
+
+
+def _ancestors(stages: dict[str, tuple[list[str], Runnable]]) -> dict[str, list[str]]:
+    """Tất cả các bước mà mỗi bước phụ thuộc (trực tiếp hoặc gián tiếp), theo thứ tự tô-pô; lỗi nếu có vòng."""
+    ancestors: dict[str, list[str]] = {}
+    remaining = dict(stages)
+    while remaining:
+        ready = [name for name, (deps, _) in remaining.items()
+                 if all(dep in ancestors or dep not in stages for dep in deps)]
+        if not ready:
+            raise ValueError(f"Các bước có phụ thuộc vòng: {sorted(remaining)}")
+        for name in ready:
+            found = []
+            for dep in remaining.pop(name)[0]:
+                if dep in stages:
+                    found += [a for a in ancestors[dep] + [dep] if a not in found]
+            ancestors[name] = found
+    return ancestors
+
+
+def build_dag_chain(stages: dict[str, tuple[list[str], Runnable]], inputs: list[str]) -> Runnable:
+    """
+    stages: {tên_bước: ([các khóa mà bước cần], runnable)}. Mỗi runnable nhận dict chứa input gốc
+    và kết quả các bước mà nó phụ thuộc (kể cả gián tiếp), kết quả của nó được gán vào khóa tên_bước.
+    inputs: các khóa có sẵn trong input (vd: ["user_input"]).
+
+    Mỗi bước là một task (async) / future (sync) riêng, chỉ chờ các bước cha của chính nó: bước bắt đầu
+    ngay khi đủ phụ thuộc, không phải chờ các bước không liên quan. Output là input gốc cộng kết quả
+    của mọi bước (giống chuỗi .assign tuần tự). Một bước lỗi thì các bước còn lại bị hủy.
+    Mỗi bước được đặt tên/tag theo tên_bước (as_step) để UI stream được tiến trình của từng bước.
+    """
+    missing = {dep for deps, _ in stages.values() for dep in deps if dep not in stages and dep not in inputs}
+    if missing:
+        raise ValueError(f"Các bước cần khóa không có trong input: {sorted(missing)}")
+    ancestors = _ancestors(stages)
+    steps = {name: as_step(runnable, name) for name, (_, runnable) in stages.items()}
+    parents = {name: [dep for dep in deps if dep in stages] for name, (deps, _) in stages.items()}
+
+    def stage_input(x: dict, name: str, done: dict) -> dict:
+        # Các bước tổ tiên đều đã xong khi mọi bước cha đã xong
+        return {**x, **{dep: done[dep].result() for dep in ancestors[name]}}
+
+    def invoke(x: dict, config: RunnableConfig) -> dict:
+        futures = {}
+        with ContextThreadPoolExecutor(max_workers=len(stages)) as executor:
+            def run(name):
+                for parent in parents[name]:
+                    futures[parent].result()
+                return steps[name].invoke(stage_input(x, name, futures), config)
+
+            # Thứ tự tô-pô (thứ tự của `ancestors`): future của bước cha luôn được tạo trước bước con
+            for name in ancestors:
+                futures[name] = executor.submit(run, name)
+            try:
+                return {**x, **{name: future.result() for name, future in futures.items()}}
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+    async def ainvoke(x: dict, config: RunnableConfig) -> dict:
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run(name):
+            for parent in parents[name]:
+                await tasks[parent]
+            return await steps[name].ainvoke(stage_input(x, name, tasks), config)
+
+        for name in ancestors:
+            tasks[name] = asyncio.ensure_future(run(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {**x, **{name: task.result() for name, task in tasks.items()}}
+
+    # with_config trả về RunnableBinding (RunnableSerializable), nên vẫn dùng được configurable_alternatives
+    # và with_fallbacks như chuỗi .assign trước đây
+    return RunnableLambda(invoke, afunc=ainvoke).with_config(run_name="dag")
@@ -1,8 +1,10 @@
 # File: core/chains/full_plan_chain.py (Phiên bản Tạo PoC, dùng retriever chung)
+# Chain được dựng trong create_full_plan_chain() (gọi từ create_router), không phải lúc import module.
 
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.runnables import ConfigurableField, Runnable, RunnableLambda, RunnablePassthrough
 from langchain_core.documents import Document # Import Document
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel, Field, ValidationError
 import os
 from dotenv import load_dotenv
 
@@ -12,20 +14,25 @@ from .prompts import (
     analysis_prompt,
     exploitation_prompt,
     rag_enhanced_prompt,
-
+    fast_plan_prompt,
 )
-# <<< IMPORT retriever ĐÃ KHỞI TẠO SẴN >>>
+# <<< IMPORT retriever DÙNG CHUNG (index được tải lười) >>>
 from .retriever import retriever
+from .retrieval_context import shared_retrieval
+from .dag import build_dag_chain
+from ..llm import create_gemini_llm
+from ..streaming import as_step
+from ..speculation import speculative_stage
 
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY không được tìm thấy")
+# GEMINI_API_KEY được kiểm tra khi tạo LLM (create_gemini_llm), không phải lúc import
 
-# LLM dùng cho các bước của dây chuyền này
-llm_plan = ChatGoogleGenerativeAI(model="gemini-2.0-flash", # Hoặc model bạn đang dùng
-                           google_api_key=api_key,
-                           temperature=0.3) # Giảm temperature
+# Chế độ lập kế hoạch mặc định: "chain" (4 lần gọi LLM nối tiếp) hoặc "fast" (1 lần gọi, output JSON).
+# Chọn cho từng request bằng config={"configurable": {"plan_mode": "fast"}}.
+PLAN_MODES = ("chain", "fast")
+FULL_PLAN_MODE = os.getenv("FULL_PLAN_MODE", "chain")
+if FULL_PLAN_MODE not in PLAN_MODES:
+    raise ValueError(f"FULL_PLAN_MODE phải là một trong {PLAN_MODES}, nhận được: {FULL_PLAN_MODE!r}")
 
 # Hàm helper để định dạng context từ retriever
 def format_docs(docs: list[Document]) -> str:
@@ -36,36 +43,73 @@ def format_docs(docs: list[Document]) -> str:
         for doc in docs
     )
 
-# --- Xây dựng các trạm ---
-chain_step1_recon = recon_prompt | llm_plan
-chain_step2_analysis = analysis_prompt | llm_plan
-chain_step3_exploit_plan = exploitation_prompt | llm_plan
-# Bước RAG Context: Lấy input -> Retriever -> Format Docs (Sử dụng retriever chung)
-chain_rag_context = retriever | RunnableLambda(format_docs)
-chain_step4_rag_payloads = rag_enhanced_prompt | llm_plan
 
+# --- Chế độ kế hoạch nhanh ---
+class FastPlan(BaseModel):
+    """Kế hoạch pentest hoàn chỉnh (4 phần của dây chuyền trên) trong một lần gọi LLM."""
+    recon_results: str = Field(description="Bước 1: Thu thập thông tin - phân tích công nghệ/mục tiêu (Markdown).")
+    analysis_results: str = Field(description="Bước 2: Danh sách lỗ hổng tiềm tàng theo OWASP Top 10 (Markdown).")
+    exploitation_results: str = Field(description="Bước 3: Kế hoạch khai thác chi tiết, công cụ và payload (Markdown).")
+    actionable_intelligence: str = Field(description="Bước 4: Payload cụ thể và hướng dẫn sử dụng, dựa trên Kiến thức RAG (Markdown).")
 
-# --- Lắp ráp dây chuyền sản xuất PoC ---
-full_plan_chain = (
-    RunnablePassthrough.assign(
-        recon_results=chain_step1_recon # Input mặc định là {"user_input": "..."}
-    )
-    .assign(
-        analysis_results=lambda x: chain_step2_analysis.invoke({"recon_results": x["recon_results"]})
-    )
-    .assign(
-        exploitation_results=lambda x: chain_step3_exploit_plan.invoke({"analysis_results": x["analysis_results"]})
-    )
-    .assign( # Chạy bước lấy context RAG, sử dụng input gốc user_input
-        rag_context= (lambda x: x["user_input"]) | chain_rag_context
-    )
-    .assign(
-        actionable_intelligence=lambda x: chain_step4_rag_payloads.invoke(
-            {
-                "exploitation_results": x["exploitation_results"],
-                "rag_context": x["rag_context"]
-            }
-        )
+
+def unpack_fast_plan(x: dict) -> dict:
+    # Cùng các khóa kết quả với plan_dag_chain, để app.py và main.py hiển thị như nhau
+    if x["fast_plan"] is None:
+        raise OutputParserException("LLM không trả về kế hoạch dạng JSON")
+    return {"user_input": x["user_input"], "rag_context": x["rag_context"], **x["fast_plan"].model_dump()}
+
+
+def create_full_plan_chain() -> tuple[Runnable, Runnable]:
+    """
+    Dựng Luồng 2 (lập kế hoạch). Trả về (full_plan_chain, chain_step1_recon); bước 1 được trả riêng
+    để router chạy trước nó khi đoán nhánh (core/speculation.py).
+    """
+    # LLM dùng cho các bước của dây chuyền này
+    llm_plan = create_gemini_llm(model="gemini-2.0-flash", # Hoặc model bạn đang dùng
+                                 temperature=0.3) # Giảm temperature
+
+    # --- Xây dựng các trạm ---
+    chain_step1_recon = recon_prompt | llm_plan
+    chain_step2_analysis = analysis_prompt | llm_plan
+    chain_step3_exploit_plan = exploitation_prompt | llm_plan
+    # Bước RAG Context: Lấy input -> Retriever -> Format Docs (Sử dụng retriever chung).
+    # Khi chạy trong router, dùng lại kết quả retrieval của request thay vì query lại.
+    chain_rag_context = shared_retrieval(retriever) | RunnableLambda(format_docs)
+    chain_step4_rag_payloads = rag_enhanced_prompt | llm_plan
+
+    # --- Lắp ráp dây chuyền sản xuất PoC ---
+    # Dây chuyền được khai báo dưới dạng đồ thị phụ thuộc: mỗi bước chỉ chờ các khóa mà nó cần,
+    # nên bước lấy context RAG (chỉ cần user_input) chạy song song với bước 1 thay vì chờ bước 3.
+    # Thêm bước mới (vd: poc_generation_prompt) chỉ cần khai báo phụ thuộc của nó ở đây.
+    plan_dag_chain = build_dag_chain(
+        {
+            # Input mặc định là {"user_input": "..."}
+            # Bước 1 có thể đã được router chạy trước trong lúc phân loại (core/speculation.py)
+            "recon_results": (["user_input"], speculative_stage(chain_step1_recon, "recon_results")),
+            "analysis_results": (["recon_results"], chain_step2_analysis),
+            "exploitation_results": (["analysis_results"], chain_step3_exploit_plan),
+            # Chạy bước lấy context RAG, sử dụng input gốc user_input
+            "rag_context": (["user_input"], chain_rag_context),
+            "actionable_intelligence": (["exploitation_results", "rag_context"], chain_step4_rag_payloads),
+        },
+        inputs=["user_input"],
     )
 
-)
\ No newline at end of file
+    # --- Chế độ kế hoạch nhanh ---
+    # Chỉ một round-trip LLM: lấy context RAG (thường đã có sẵn từ retrieval của request) rồi sinh cả 4 phần.
+    # Nếu LLM không trả về JSON hợp lệ, chạy lại bằng dây chuyền 4 bước.
+    fast_plan_chain = (
+        RunnablePassthrough.assign(rag_context=as_step(chain_rag_context, "rag_context"))
+        | RunnablePassthrough.assign(fast_plan=as_step(fast_plan_prompt | llm_plan.with_structured_output(FastPlan), "fast_plan"))
+        | RunnableLambda(unpack_fast_plan)
+    ).with_fallbacks([plan_dag_chain], exceptions_to_handle=(OutputParserException, ValidationError))
+
+    plans = {"chain": plan_dag_chain, "fast": fast_plan_chain}
+    full_plan_chain = plans[FULL_PLAN_MODE].configurable_alternatives(
+        ConfigurableField(id="plan_mode", name="Chế độ lập kế hoạch",
+                          description="'chain': 4 bước LLM nối tiếp, 'fast': 1 lần gọi LLM với output JSON."),
+        default_key=FULL_PLAN_MODE,
+        **{mode: chain for mode, chain in plans.items() if mode != FULL_PLAN_MODE},
+    )
+    return full_plan_chain, chain_step1_recon
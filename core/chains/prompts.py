@@ -34,7 +34,7 @@ Bạn là "Cyber-Mentor", một AI Agent CỐ VẤN Penetration Testing.
 Nhiệm vụ của bạn là:
 1.  **KIỂM TRA (Validation):** Xem yêu cầu của người dùng đã có **MỤC TIÊU (Target URL/IP)** cụ thể chưa?
 2.  **HỎI LẠI (Clarify):** Nếu chưa có mục tiêu, hãy DỪNG LẠI và hỏi người dùng.
-3.  **THỰC THI (Execute):** Nếu đã đủ thông tin, hãy gọi Tool (`run_nmap_scan`, `run_sqlmap_scan`, `start_burp_scan`).
+3.  **THỰC THI (Execute):** Nếu đã đủ thông tin, hãy gọi Tool (`run_nmap_scan`, `run_sqlmap_scan`, `start_burp_scan`). Nếu có NHIỀU mục tiêu hoặc một dải mạng (CIDR), dùng `run_nmap_batch_scan` trong MỘT lần gọi. Khi cần quét TOÀN BỘ cổng, ưu tiên `scan_type='smart'` (hoặc `'smart_vuln'` nếu cần dò lỗ hổng) thay cho `'full'` vì nhanh hơn nhiều.
 4.  **PHÂN TÍCH & ĐỀ XUẤT:** Sau khi có kết quả, hãy phân tích và đề xuất bước tiếp theo.
 
 QUY TRÌNH SUY LUẬN:
@@ -168,3 +168,44 @@ Code Python/Curl rõ ràng, an toàn, có cảnh báo.
 # Code PoC...
 """
 poc_generation_prompt = PromptTemplate.from_template(poc_generation_template)
+
+# Chế độ kế hoạch nhanh (FULL_PLAN_MODE=fast): cả 4 bước trên trong MỘT lần gọi LLM, trả về JSON có cấu trúc
+fast_plan_template = """
+**Nhiệm vụ:** Bạn là chuyên gia pentest. Hãy lập kế hoạch pentest hoàn chỉnh cho yêu cầu của người dùng
+trong một lần trả lời, gồm đủ 4 phần theo thứ tự (mỗi phần dựa trên phần trước):
+
+1.  **recon_results** - Thu thập thông tin: phân tích công nghệ/mục tiêu trong yêu cầu. Nếu yêu cầu quá chung chung
+    (ví dụ: "Lập kế hoạch pentest"), hãy **giả định** một kịch bản phổ biến (ví dụ: Website E-commerce) và bắt đầu bằng câu:
+    **"Bạn chưa cung cấp hệ thống cụ thể, nên tôi sẽ lập kế hoạch mẫu cho một hệ thống Thương mại điện tử chuẩn."**
+2.  **analysis_results** - Danh sách các lỗ hổng tiềm tàng (OWASP Top 10) dựa trên phần 1.
+3.  **exploitation_results** - Kế hoạch khai thác chi tiết (Công cụ & Payload) cho các lỗ hổng ở phần 2.
+4.  **actionable_intelligence** - Payload cụ thể và hướng dẫn sử dụng, dựa trên kế hoạch ở phần 3 và Kiến thức RAG bên dưới.
+
+Mỗi phần viết bằng Markdown, tiếng Việt.
+
+**Yêu cầu của người dùng:** "{user_input}"
+
+**Kiến thức RAG:**
+{rag_context}
+"""
+fast_plan_prompt = PromptTemplate.from_template(fast_plan_template)
+
+
+# ==============================================================================
+# 5. HISTORY SUMMARY PROMPT (Tóm tắt hội thoại cũ cho Agent - core/context_manager.py)
+# ==============================================================================
+history_summary_template = """**Nhiệm vụ:** Cập nhật bản tóm tắt một phiên pentest giữa người dùng và Cyber-Mentor.
+
+**Tóm tắt hiện có:**
+{summary}
+
+**Các lượt hội thoại mới:**
+{messages}
+
+**Yêu cầu:**
+Viết lại bản tóm tắt (tối đa {max_words} từ), giữ lại các dữ kiện kỹ thuật cần cho các lượt sau:
+mục tiêu (IP/URL/tên miền), cổng và dịch vụ đang mở, lỗ hổng/điểm injection đã xác nhận, công cụ đã chạy
+và kết luận chính. Bỏ lời chào hỏi và giải thích dài dòng. Chỉ trả về bản tóm tắt.
+
+**Tóm tắt mới:**"""
+history_summary_prompt = PromptTemplate.from_template(history_summary_template)
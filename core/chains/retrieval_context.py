@@ -0,0 +1,111 @@
+# File: core/chains/retrieval_context.py
+# Retrieval theo từng request: mỗi lần gọi router có một RetrievalContext duy nhất (truyền qua
+# config["configurable"]), nên:
+#   - nhánh không cần RAG (thực thi tool) không tốn embedding + tìm kiếm FAISS,
+#   - retrieval có thể bắt đầu sớm (trong lúc router LLM phân loại) và bị hủy nếu không cần,
+#   - các chain con (full_plan_chain) dùng lại kết quả thay vì query retriever lần nữa.
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+RETRIEVAL_CONTEXT_KEY = "retrieval_context"
+# Số retrieval chạy song song tối đa (embedding + FAISS chạy trên CPU)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="rag-retrieval")
+
+
+class RetrievalContext:
+    """Kết quả retrieval của một câu hỏi: chạy tối đa một lần, bắt đầu sớm được, hủy được."""
+
+    def __init__(self, retriever: Runnable, query: str, config: RunnableConfig | None = None):
+        self.retriever = retriever
+        self.query = query
+        # Callback của request (tracing, stream) để retrieval chạy nền vẫn được ghi nhận
+        self.config: RunnableConfig = {"callbacks": (config or {}).get("callbacks"), "run_name": "rag_retriever"}
+        self.future: Future | None = None
+        self.lock = threading.Lock()
+
+    def start(self) -> "RetrievalContext":
+        """Bắt đầu retrieval trong thread nền (không làm gì nếu đã bắt đầu)."""
+        with self.lock:
+            if self.future is None:
+                self.future = _executor.submit(self.retriever.invoke, self.query, self.config)
+        return self
+
+    def get(self) -> list[Document]:
+        return self.start().future.result()
+
+    async def aget(self) -> list[Document]:
+        return await asyncio.wrap_future(self.start().future)
+
+    def cancel(self, reason: str):
+        """Bỏ retrieval không còn cần: hủy nếu chưa chạy, nếu đang chạy thì bỏ qua kết quả."""
+        with self.lock:
+            future = self.future
+            if future is None:
+                # Đánh dấu để start() về sau không chạy nữa
+                self.future = Future()
+                self.future.cancel()
+                print(f"--- [RAG] Bỏ qua retrieval ({reason}) ---")
+            elif not future.done():
+                state = "đã hủy" if future.cancel() else "bỏ qua kết quả"
+                print(f"--- [RAG] Retrieval sớm không cần dùng ({reason}), {state} ---")
+
+
+def get_retrieval_context(config: RunnableConfig | None) -> RetrievalContext | None:
+    return ((config or {}).get("configurable") or {}).get(RETRIEVAL_CONTEXT_KEY)
+
+
+def with_retrieval_context(runnable: Runnable, retriever: Runnable, query_key: str = "user_input") -> Runnable:
+    """
+    Bọc chain của router: tạo RetrievalContext cho câu hỏi hiện tại (chưa chạy retrieval) và truyền nó
+    cho mọi bước con qua config. Retrieval chưa dùng đến khi chain kết thúc sẽ bị hủy.
+    """
+
+    def scoped_config(x, config: RunnableConfig) -> tuple[RetrievalContext, RunnableConfig]:
+        context = RetrievalContext(retriever, x[query_key], config)
+        configurable = {**(config.get("configurable") or {}), RETRIEVAL_CONTEXT_KEY: context}
+        return context, {**config, "configurable": configurable}
+
+    def invoke(x, config):
+        context, config = scoped_config(x, config)
+        try:
+            return runnable.invoke(x, config)
+        finally:
+            context.cancel("request kết thúc")
+
+    async def ainvoke(x, config):
+        context, config = scoped_config(x, config)
+        try:
+            return await runnable.ainvoke(x, config)
+        finally:
+            context.cancel("request kết thúc")
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="retrieval_context")
+
+
+def shared_retrieval(retriever: Runnable, query_key: str = "user_input") -> Runnable:
+    """
+    Runnable trả về list[Document] cho x[query_key]: dùng RetrievalContext của request nếu cùng câu hỏi,
+    nếu không (chain được gọi riêng) thì query retriever như bình thường.
+    """
+
+    def context_for(x, config) -> RetrievalContext | None:
+        context = get_retrieval_context(config)
+        return context if context is not None and context.query == x[query_key] else None
+
+    def invoke(x, config):
+        context = context_for(x, config)
+        return context.get() if context else retriever.invoke(x[query_key], config)
+
+    async def ainvoke(x, config):
+        context = context_for(x, config)
+        return await context.aget() if context else await retriever.ainvoke(x[query_key], config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="shared_retrieval")
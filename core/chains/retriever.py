@@ -1,38 +1,67 @@
-# File: core/chains/retriever.py (Phiên bản tải Index có sẵn)
+# File: core/chains/retriever.py (Phiên bản tải Index có sẵn, khởi tạo lười)
+# Model embedding và FAISS index chỉ được tải khi cần lần đầu (get_embeddings / get_retriever),
+# hoặc sớm hơn bởi luồng khởi động nền (core/warmup.py), nên import module này gần như không tốn gì.
 
+import asyncio
 import os
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+import threading
 
-# Đường dẫn tới thư mục chứa index đã lưu trên máy local
-INDEX_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', '..', 'my_faiss_index')
+from langchain_core.runnables import RunnableLambda
+
+# Đường dẫn tới thư mục chứa index đã lưu trên máy local (đổi được bằng RAG_INDEX_DIR)
+INDEX_DIRECTORY = os.getenv("RAG_INDEX_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'my_faiss_index'))
+# RAG_FAKE_EMBEDDINGS=1: dùng embedding giả (cùng số chiều với MiniLM, không cần tải model),
+# chỉ dành cho benchmark/chạy offline - kết quả tìm kiếm không có ý nghĩa
+FAKE_EMBEDDINGS = os.getenv("RAG_FAKE_EMBEDDINGS", "0") == "1"
+EMBEDDING_DIMENSIONS = 384
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+_embeddings = None
+_retriever = None
+_lock = threading.RLock()
+
+
+def create_embeddings():
+    if FAKE_EMBEDDINGS:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=EMBEDDING_DIMENSIONS)
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def get_embeddings():
+    """Model embedding dùng chung (tải một lần duy nhất, lần gọi đầu tiên; None nếu tải lỗi)."""
+    global _embeddings
+    with _lock:
+        if _embeddings is None:
+            try:
+                print("--- [RAG Global] Đang khởi tạo model embedding (chỉ một lần)... ---")
+                _embeddings = create_embeddings()
+                print("--- [RAG Global] Model embedding đã sẵn sàng! ---")
+            except Exception as e:
+                print(f"--- [RAG Error] Lỗi nghiêm trọng khi khởi tạo embedding model: {e} ---")
+        return _embeddings
 
-# Khởi tạo embedding model một lần duy nhất khi module được load
-try:
-    print("--- [RAG Global] Đang khởi tạo model embedding (chỉ một lần)... ---")
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    print("--- [RAG Global] Model embedding đã sẵn sàng! ---")
-except Exception as e:
-    print(f"--- [RAG Error] Lỗi nghiêm trọng khi khởi tạo embedding model: {e} ---")
-    embeddings = None
 
 def create_retriever():
     """
     Hàm này tải một FAISS index đã được xây dựng sẵn từ Colab.
-    Sử dụng embedding model đã được khởi tạo sẵn.
+    Sử dụng embedding model dùng chung (get_embeddings).
     """
-    global embeddings
+    global _embeddings
+    from langchain_community.vectorstores import FAISS
 
+    embeddings = get_embeddings()
     if embeddings is None:
         print("--- [RAG Error] Embedding model chưa được khởi tạo thành công. Không thể tải index. ---")
         try:
-             embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+             embeddings = _embeddings = create_embeddings()
              print("--- [RAG Retry] Khởi tạo lại embedding model thành công. ---")
         except Exception as retry_e:
              print(f"--- [RAG Error] Khởi tạo lại embedding model thất bại: {retry_e} ---")
              # Cố gắng tạo retriever rỗng nếu không thể load model
              try:
-                 temp_embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2") # Tạo lại instance tạm
+                 temp_embeddings = create_embeddings() # Tạo lại instance tạm
                  vectorstore = FAISS.from_texts(["Lỗi embedding model"], temp_embeddings)
                  return vectorstore.as_retriever()
              except Exception: # Nếu vẫn lỗi thì chịu
@@ -65,5 +94,25 @@ def create_retriever():
     vectorstore = FAISS.from_texts(["Lỗi tải index"], embeddings)
     return vectorstore.as_retriever()
 
-# Khởi tạo retriever ngay khi module được import để cache lại
-retriever = create_retriever()
\ No newline at end of file
+def get_retriever():
+    """Retriever FAISS dùng chung (tải index một lần duy nhất, lần gọi đầu tiên)."""
+    global _retriever
+    with _lock:
+        if _retriever is None:
+            _retriever = create_retriever()
+        return _retriever
+
+
+# Runnable đại diện cho retriever dùng chung, để các chain được dựng mà chưa cần tải index:
+# index được tải ở lần query đầu tiên (nếu luồng khởi động nền chưa tải xong).
+def _invoke(query: str, config) -> list:
+    return get_retriever().invoke(query, config)
+
+
+async def _ainvoke(query: str, config) -> list:
+    # Tải model/index chạy trên CPU và đọc đĩa: không chặn event loop
+    loaded = _retriever if _retriever is not None else await asyncio.to_thread(get_retriever)
+    return await loaded.ainvoke(query, config)
+
+
+retriever = RunnableLambda(_invoke, afunc=_ainvoke, name="retriever")
@@ -1,13 +1,13 @@
 # File: core/chains/tool_agent.py
 
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.prompts import PromptTemplate
 from core.tools import all_tools
+from core.llm import create_gemini_llm
 
 # 1. Khởi tạo LLM
-llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.2)
+llm = create_gemini_llm(model="gemini-pro", temperature=0.2)
 
 # 2. Lấy danh sách các công cụ từ __init__.py
 tools = all_tools
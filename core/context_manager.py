@@ -0,0 +1,267 @@
+# File: core/context_manager.py
+# Giữ context của Agent (Luồng 3) trong một ngân sách token cố định, để độ dài prompt (và độ trễ)
+# không tăng theo độ dài phiên pentest:
+#   - chat_history: giữ nguyên văn vài tin nhắn gần nhất, các tin cũ hơn được thay bằng bản tóm tắt
+#     cuốn chiếu (tóm tắt theo từng khối tin nhắn và cache lại, nên mỗi khối chỉ tốn một lần gọi LLM),
+#   - observation của tool trong scratchpad: chỉ giữ phần liên quan (cổng mở, điểm injection đã xác nhận,
+#     đường dẫn tìm thấy...) và cắt theo ngân sách, kết quả cũ bị cắt mạnh hơn kết quả mới.
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from .chains.prompts import history_summary_prompt
+from .llm import DEFAULT_GEMINI_MODEL, create_gemini_llm
+from .tools.nmap_tool import extract_structured_result, format_structured_result
+
+load_dotenv()
+
+# Ngân sách token của chat_history (gồm cả bản tóm tắt)
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "2000"))
+# Số tin nhắn gần nhất luôn được giữ nguyên văn
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "4"))
+# Tin nhắn cũ được tóm tắt theo từng khối bằng này tin nhắn
+CONTEXT_SUMMARY_CHUNK = int(os.getenv("CONTEXT_SUMMARY_CHUNK", "6"))
+CONTEXT_SUMMARY_WORDS = 200
+# Ngân sách token cho một observation và cho toàn bộ scratchpad của Agent
+OBSERVATION_TOKENS = int(os.getenv("OBSERVATION_TOKENS", "1500"))
+SCRATCHPAD_TOKENS = int(os.getenv("SCRATCHPAD_TOKENS", "6000"))
+# Số bản tóm tắt giữ trong cache (LRU)
+SUMMARY_CACHE_SIZE = 256
+
+# Số ký tự ASCII trung bình trên một token theo họ model (ước lượng offline, không gọi API đếm token).
+# Ký tự ngoài ASCII (tiếng Việt có dấu) được tính gấp đôi vì tokenizer tách chúng nhỏ hơn.
+CHARS_PER_TOKEN = {"gemini": 4.0}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Các dòng đáng giữ trong output thô của tool (nmap, sqlmap, dirsearch)
+RELEVANT_LINE_RE = re.compile(
+    r"(\d+/(tcp|udp)\s+open"                                    # nmap: cổng mở
+    r"|Nmap scan report|OS details|Service Info"
+    r"|VULNERABLE|CVE-\d{4}-\d+"
+    r"|Parameter: |Type: |Title: |Payload: "                     # sqlmap: điểm injection đã xác nhận
+    r"|is vulnerable|appears to be .*injectable|back-end DBMS|available databases|\[CRITICAL\]"
+    r"|\]\s+(200|301|302|401|403|500)\s+-"                       # dirsearch: đường dẫn tìm thấy
+    r"|^Kết quả quét|^Máy Kali báo lỗi|^Lỗi"                     # dòng đầu do core/tools thêm vào
+    r"|job_id)", re.IGNORECASE
+)
+# Các dòng trong output script Nmap đáng giữ lại
+RELEVANT_SCRIPT_RE = re.compile(r"(VULNERABLE|CVE-\d{4}-\d+|State:|Risk factor|IDs:)", re.IGNORECASE)
+
+
+def count_tokens(text: str, model: str = DEFAULT_GEMINI_MODEL) -> int:
+    """Ước lượng số token của text cho model (theo CHARS_PER_TOKEN của họ model)."""
+    if not text:
+        return 0
+    ratio = next((value for family, value in CHARS_PER_TOKEN.items() if model.startswith(family)),
+                 DEFAULT_CHARS_PER_TOKEN)
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return int((len(text) + non_ascii) / ratio) + 1
+
+
+def _to_message(message) -> BaseMessage:
+    """Tin nhắn từ UI ({"role", "content"}) hoặc BaseMessage -> BaseMessage."""
+    if isinstance(message, BaseMessage):
+        return message
+    content = str(message.get("content", ""))
+    return HumanMessage(content=content) if message.get("role") == "user" else AIMessage(content=content)
+
+
+def _message_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+class ContextManager:
+    """Ngân sách token cho chat_history và scratchpad của Agent, theo cách đếm token của một model."""
+
+    def __init__(self, model: str = DEFAULT_GEMINI_MODEL,
+                 history_tokens: int = CONTEXT_HISTORY_TOKENS,
+                 recent_messages: int = CONTEXT_RECENT_MESSAGES,
+                 summary_chunk: int = CONTEXT_SUMMARY_CHUNK,
+                 observation_tokens: int = OBSERVATION_TOKENS,
+                 scratchpad_tokens: int = SCRATCHPAD_TOKENS,
+                 summarizer: Runnable | None = None):
+        self.model = model
+        self.history_tokens = history_tokens
+        self.recent_messages = recent_messages
+        self.summary_chunk = max(1, summary_chunk)
+        self.observation_tokens = observation_tokens
+        self.scratchpad_tokens = scratchpad_tokens
+        self._summarizer = summarizer
+        # digest của một đoạn đầu hội thoại -> bản tóm tắt của đoạn đó
+        self.summaries: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def clip(self, text: str, tokens: int) -> str:
+        """Cắt text về khoảng `tokens` token, giữ phần đầu và phần cuối."""
+        if self.count(text) <= tokens:
+            return text
+        chars = max(0, int(len(text) * tokens / self.count(text)))
+        head, tail = text[:chars * 2 // 3], text[len(text) - chars // 3:] if chars >= 3 else ""
+        return f"{head}\n...(đã lược bớt {len(text) - len(head) - len(tail)} ký tự)...\n{tail}"
+
+    # --- chat_history ---
+
+    @property
+    def summarizer(self) -> Runnable:
+        if self._summarizer is None:
+            self._summarizer = history_summary_prompt | create_gemini_llm(model=self.model, temperature=0) | StrOutputParser()
+        return self._summarizer
+
+    def _plan(self, messages: list[BaseMessage]) -> tuple[int, int, str, list[str]]:
+        """
+        (số tin nhắn được tóm tắt, số tin nhắn đã có tóm tắt trong cache, tóm tắt đó, digest các đoạn đầu).
+        Ranh giới tóm tắt được làm tròn xuống theo summary_chunk nên chỉ dịch chuyển mỗi summary_chunk tin nhắn.
+        """
+        boundary = max(0, len(messages) - self.recent_messages) // self.summary_chunk * self.summary_chunk
+        digests, digest = [""], ""
+        for message in messages[:boundary]:
+            digest = hashlib.sha1(f"{digest}\x00{message.type}\x00{_message_text(message)}".encode("utf-8")).hexdigest()
+            digests.append(digest)
+        with self.lock:
+            for done in range(boundary, 0, -self.summary_chunk):
+                if digests[done] in self.summaries:
+                    self.summaries.move_to_end(digests[done])
+                    return boundary, done, self.summaries[digests[done]], digests
+        return boundary, 0, "", digests
+
+    def _summary_inputs(self, summary: str, chunk: list[BaseMessage]) -> dict:
+        lines = [f"{'Người dùng' if m.type == 'human' else 'Cyber-Mentor'}: "
+                 f"{self.clip(_message_text(m), self.observation_tokens)}" for m in chunk]
+        return {"summary": summary or "(chưa có)", "messages": "\n\n".join(lines),
+                "max_words": CONTEXT_SUMMARY_WORDS}
+
+    def _fallback_summary(self, summary: str, chunk: list[BaseMessage], error: Exception) -> str:
+        print(f"--- [Context] Không tóm tắt được bằng LLM ({error}), dùng bản rút gọn ---")
+        lines = [f"- {m.type}: {self.clip(_message_text(m), 60)}" for m in chunk]
+        return self.clip("\n".join(filter(None, [summary, *lines])), self.history_tokens // 2)
+
+    def _remember(self, digest: str, summary: str):
+        with self.lock:
+            self.summaries[digest] = summary
+            while len(self.summaries) > SUMMARY_CACHE_SIZE:
+                self.summaries.popitem(last=False)
+
+    def _assemble(self, messages: list[BaseMessage], boundary: int, summary: str) -> list[BaseMessage]:
+        """Bản tóm tắt + các tin nhắn nguyên văn, ưu tiên tin nhắn mới nhất khi vượt ngân sách."""
+        budget = self.history_tokens
+        header = []
+        if summary:
+            summary = self.clip(summary, budget // 2)
+            header = [HumanMessage(content=f"[Tóm tắt các lượt hội thoại trước]\n{summary}")]
+            budget -= self.count(header[0].content)
+        kept = []
+        for message in reversed(messages[boundary:]):
+            if budget < 50:
+                break
+            text = _message_text(message)
+            clipped = self.clip(text, budget)
+            kept.append(message if clipped == text else message.model_copy(update={"content": clipped}))
+            budget -= self.count(clipped)
+        return header + kept[::-1]
+
+    def build_history(self, messages: list) -> list[BaseMessage]:
+        messages = [_to_message(m) for m in messages or []]
+        boundary, done, summary, digests = self._plan(messages)
+        for start in range(done, boundary, self.summary_chunk):
+            chunk = messages[start:start + self.summary_chunk]
+            try:
+                summary = self.summarizer.invoke(self._summary_inputs(summary, chunk),
+                                                 # Không kế thừa callback của bước đang chạy: token của
+                                                 # bản tóm tắt không được stream ra UI như câu trả lời
+                                                 {"callbacks": [], "run_name": "history_summary"}).strip()
+            except Exception as e:
+                summary = self._fallback_summary(summary, chunk, e)
+            self._remember(digests[start + len(chunk)], summary)
+        return self._assemble(messages, boundary, summary)
+
+    async def abuild_history(self, messages: list) -> list[BaseMessage]:
+        messages = [_to_message(m) for m in messages or []]
+        boundary, done, summary, digests = self._plan(messages)
+        for start in range(done, boundary, self.summary_chunk):
+            chunk = messages[start:start + self.summary_chunk]
+            try:
+                summary = (await self.summarizer.ainvoke(self._summary_inputs(summary, chunk),
+                                                         {"callbacks": [], "run_name": "history_summary"})).strip()
+            except Exception as e:
+                summary = self._fallback_summary(summary, chunk, e)
+            self._remember(digests[start + len(chunk)], summary)
+        return self._assemble(messages, boundary, summary)
+
+    def history_runnable(self, history_key: str = "chat_history") -> Runnable:
+        """Runnable: dict input -> chat_history đã nằm trong ngân sách (dùng trong RunnablePassthrough.assign)."""
+        def build(x):
+            return self.build_history(x.get(history_key))
+
+        async def abuild(x):
+            return await self.abuild_history(x.get(history_key))
+
+        return RunnableLambda(build, afunc=abuild, name="managed_chat_history")
+
+    # --- Observation của tool ---
+
+    def _compact_nmap(self, model: dict) -> dict:
+        """Mô hình JSON Nmap chỉ còn cổng mở và các dòng script đáng chú ý."""
+        hosts = []
+        for host in model.get("hosts", []):
+            host = dict(host)
+            ports = []
+            for port in host.get("ports", []):
+                if port.get("state") != "open":
+                    continue
+                port = dict(port)
+                if port.get("scripts"):
+                    port["scripts"] = {
+                        name: "\n".join(line for line in output.splitlines() if RELEVANT_SCRIPT_RE.search(line))
+                        or output[:120]
+                        for name, output in port["scripts"].items()
+                    }
+                ports.append(port)
+            host["ports"] = ports
+            hosts.append(host)
+        return {**model, "hosts": hosts}
+
+    def compact_observation(self, observation, budget: int | None = None) -> str:
+        """Observation của tool trong `budget` token, chỉ giữ các phần liên quan nếu phải cắt."""
+        budget = self.observation_tokens if budget is None else budget
+        text = observation if isinstance(observation, str) else json.dumps(observation, ensure_ascii=False, default=str)
+        if self.count(text) <= budget:
+            return text
+
+        model = extract_structured_result(text)
+        if model is not None:
+            text = format_structured_result(self._compact_nmap(model))
+        else:
+            lines = text.splitlines()
+            relevant = list(dict.fromkeys(line for line in lines if RELEVANT_LINE_RE.search(line)))
+            if relevant:
+                text = "\n".join(relevant + [f"(đã lược bỏ {len(lines) - len(relevant)} dòng không liên quan)"])
+        return self.clip(text, budget)
+
+    def trim_intermediate_steps(self, steps: list[tuple]) -> list[tuple]:
+        """
+        Dùng làm `trim_intermediate_steps` của AgentExecutor: observation mới nhất được tối đa
+        observation_tokens, các observation cũ hơn chia phần còn lại của scratchpad_tokens.
+        intermediate_steps trả về cho UI không bị ảnh hưởng.
+        """
+        remaining = self.scratchpad_tokens
+        trimmed = []
+        for action, observation in reversed(steps):
+            if remaining < 100:
+                observation = "(kết quả cũ đã được lược bỏ để giữ context trong ngân sách)"
+            else:
+                observation = self.compact_observation(observation, min(self.observation_tokens, remaining))
+                remaining -= self.count(observation)
+            trimmed.append((action, observation))
+        return trimmed[::-1]
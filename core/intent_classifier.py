@@ -0,0 +1,221 @@
+# File: core/intent_classifier.py
+# Bộ phân loại ý định chạy cục bộ, đứng trước router_llm: luật từ khóa + nearest-centroid trên
+# embedding MiniLM của các ví dụ có nhãn (core/data/intent_examples.jsonl).
+# Router chỉ gọi Gemini khi độ tin cậy của bộ phân loại này thấp.
+#
+# Báo cáo độ chính xác / độ trễ trên tập ví dụ (leave-one-out):
+#     python -m core.intent_classifier
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LABELS = ["generate_full_plan", "execute_pentest_tool", "specific_vulnerability_info", "tool_usage"]
+
+LOCAL_INTENT_ENABLED = os.getenv("LOCAL_INTENT_CLASSIFIER", "1") != "0"
+# Chênh lệch điểm tối thiểu giữa nhãn tốt nhất và nhãn thứ hai để bỏ qua router_llm
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", "0.1"))
+# Điểm cộng khi câu hỏi khớp luật từ khóa của một nhãn
+RULE_WEIGHT = 0.3
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "data", "intent_examples.jsonl")
+
+# --- Luật từ khóa ---
+_TOOLS = r"(nmap|sqlmap|dirsearch|burp|gobuster|ffuf|hydra|nikto|wpscan)"
+_TARGET_RE = re.compile(
+    r"(https?://\S+"                                   # URL
+    r"|\b\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?\b"       # IPv4 / CIDR
+    r"|\b(?:[a-z0-9-]+\.)+(?:com|org|net|io|vn|edu|gov|local|lab|htb)\b)"  # tên miền
+)
+_EXEC_RE = re.compile(r"\b(chạy|quét|scan|run|thực thi|execute|dò|kiểm tra|lấy danh sách)\b")
+# Chỉ câu mệnh lệnh bắt đầu bằng động từ chạy tool mới được coi là thực thi chắc chắn
+_IMPERATIVE_RE = re.compile(r"^\s*(?:hãy\s+|làm ơn\s+|giúp (?:tôi|mình)\s+|please\s+)?"
+                            r"(chạy|quét|scan|run|thực thi|execute|dò)\b")
+# Lập kế hoạch, viết báo cáo, câu phủ định: có mục tiêu + động từ quét nhưng không phải yêu cầu chạy tool
+_NON_EXEC_RE = re.compile(r"(kế hoạch|báo cáo|\breport\b|không được|\bđừng\b|\bcấm\b|\bdon't\b|\bdo not\b)")
+# Câu hỏi / hỏi cách dùng: không bao giờ là yêu cầu thực thi chắc chắn, kể cả khi có mục tiêu
+_QUESTION_RE = re.compile(r"(là gì|như thế nào|thế nào|cách dùng|cách sử dụng|giải thích|what is|how (do i|to)|\?)")
+RULES = {
+    "generate_full_plan": re.compile(
+        r"(kế hoạch|chiến lược|\bplan\b|methodology|quy trình|các bước|lộ trình|bắt đầu từ đâu)"),
+    "execute_pentest_tool": re.compile(rf"\b(chạy|quét|scan|run|thực thi|execute)\b.*\b{_TOOLS}\b"
+                                       rf"|\b{_TOOLS}\b.*\b(chạy|quét|scan|run)\b"),
+    "specific_vulnerability_info": re.compile(
+        r"(là gì|what is|khai thác|exploit|lỗ hổng|bypass|payload|hoạt động (như )?thế nào|kiểm thử lỗi|phát hiện lỗi"
+        r"|sql injection|\bxss\b|\bcsrf\b|\bssrf\b|\bidor\b|\blfi\b|\brfi\b|\bxxe\b|\brce\b|deserialization)"),
+    "tool_usage": re.compile(
+        r"(cách dùng|cách sử dụng|hướng dẫn sử dụng|dùng (như )?thế nào|cú pháp|\bcờ\b|\bflag\b|tùy chọn"
+        r"|\boption|how (do i|to) use|\busage\b|what does|dùng để làm gì|cấu hình|làm sao dùng|\blệnh\b|cách viết"
+        r"|giải thích (output|kết quả))"),
+}
+
+
+@dataclass
+class IntentPrediction:
+    label: str
+    confidence: float  # chênh lệch điểm giữa nhãn tốt nhất và nhãn thứ hai (1.0 với luật chắc chắn)
+    source: str        # "rule" | "centroid"
+    scores: dict = field(default_factory=dict)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= INTENT_MIN_MARGIN
+
+
+def rule_scores(text: str) -> tuple[str | None, dict]:
+    """
+    (nhãn chắc chắn hoặc None, {nhãn: 0/1 theo luật}).
+    Chỉ câu mệnh lệnh bắt đầu bằng động từ chạy tool ("Quét 10.0.0.5", "Hãy chạy sqlmap trên http://...")
+    kèm mục tiêu cụ thể (URL/IP/tên miền) là thực thi chắc chắn, trừ khi là câu hỏi (là gì, như thế nào,
+    cách dùng, giải thích, dấu "?" ngoài URL) hoặc nói về kế hoạch / báo cáo / phủ định ("không được quét").
+    """
+    t = text.lower()
+    rest = _TARGET_RE.sub(" ", t)
+    if (_TARGET_RE.search(t) and _IMPERATIVE_RE.search(t)
+            and not _QUESTION_RE.search(rest) and not _NON_EXEC_RE.search(rest)):
+        return "execute_pentest_tool", {}
+    return None, {label: float(bool(pattern.search(t))) for label, pattern in RULES.items()}
+
+
+def looks_like_execution(text: str) -> bool:
+    """Có mục tiêu + động từ quét nhưng không qua được luật chắc chắn: để router LLM quyết định."""
+    t = text.lower()
+    return bool(_TARGET_RE.search(t) and _EXEC_RE.search(t))
+
+
+def load_examples(path: str = DATASET_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IntentClassifier:
+    """Luật từ khóa + nearest-centroid (cosine) trên embedding của các ví dụ có nhãn."""
+
+    def __init__(self, embeddings, examples: list[dict] | None = None):
+        self.embeddings = embeddings
+        self.examples = examples if examples is not None else load_examples()
+        self.vectors = None
+        self.centroids = None
+        self.lock = threading.Lock()
+
+    def _fit(self):
+        """Embed các ví dụ và tính centroid của từng nhãn (một lần, khi phân loại lần đầu)."""
+        with self.lock:
+            if self.centroids is not None or self.embeddings is None:
+                return
+            vectors = _normalize(np.asarray(
+                self.embeddings.embed_documents([e["text"] for e in self.examples]), dtype="float32"))
+            labels = np.array([e["label"] for e in self.examples])
+            self.vectors = vectors
+            self.centroids = {label: _normalize(vectors[labels == label].mean(axis=0))
+                              for label in LABELS if (labels == label).any()}
+
+    def _predict(self, text: str, vector: np.ndarray | None, centroids: dict | None) -> IntentPrediction:
+        label, rules = rule_scores(text)
+        if label:
+            return IntentPrediction(label, 1.0, "rule")
+        scores = {}
+        for name in LABELS:
+            similarity = float(vector @ centroids[name]) if vector is not None and name in (centroids or {}) else 0.0
+            scores[name] = similarity + RULE_WEIGHT * rules[name]
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        confidence = scores[ranked[0]] - scores[ranked[1]]
+        if looks_like_execution(text):
+            # Phân loại sai ở đây có thể chạy một lần quét thật: không bao giờ bỏ qua router LLM
+            confidence = 0.0
+        return IntentPrediction(ranked[0], confidence, "centroid" if vector is not None else "rule", scores)
+
+    def classify(self, text: str) -> IntentPrediction:
+        self._fit()
+        vector = None
+        if self.centroids is not None and rule_scores(text)[0] is None:
+            vector = _normalize(np.asarray(self.embeddings.embed_query(text), dtype="float32"))
+        return self._predict(text, vector, self.centroids)
+
+    def evaluate(self) -> dict:
+        """
+        Độ chính xác leave-one-out trên tập ví dụ (centroid tính lại không có chính ví dụ đang xét)
+        và độ trễ của classify() cho từng câu.
+        """
+        self._fit()
+        labels = [e["label"] for e in self.examples]
+        results = []
+        for i, example in enumerate(self.examples):
+            centroids = None
+            if self.vectors is not None:
+                centroids = {}
+                for name in LABELS:
+                    members = [j for j, label in enumerate(labels) if label == name and j != i]
+                    if members:
+                        centroids[name] = _normalize(self.vectors[members].mean(axis=0))
+            vector = self.vectors[i] if self.vectors is not None else None
+            results.append((example["label"], self._predict(example["text"], vector, centroids)))
+
+        latencies = []
+        for example in self.examples:
+            start = time.perf_counter()
+            self.classify(example["text"])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        fast = [(gold, p) for gold, p in results if p.confident]
+        return {
+            "examples": len(results),
+            "accuracy": sum(gold == p.label for gold, p in results) / len(results),
+            "fast_path_rate": len(fast) / len(results),
+            "fast_path_accuracy": sum(gold == p.label for gold, p in fast) / len(fast) if fast else None,
+            "per_label_accuracy": {
+                name: (sum(gold == p.label for gold, p in results if gold == name)
+                       / max(1, sum(gold == name for gold, _ in results)))
+                for name in LABELS
+            },
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "max": max(latencies),
+            },
+            "errors": [{"text": e["text"], "gold": gold, "predicted": p.label, "confidence": round(p.confidence, 3)}
+                       for e, (gold, p) in zip(self.examples, results) if gold != p.label],
+        }
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier() -> IntentClassifier | None:
+    """IntentClassifier dùng chung (None nếu tắt bằng LOCAL_INTENT_CLASSIFIER=0)."""
+    global _classifier
+    if not LOCAL_INTENT_ENABLED:
+        return None
+    with _classifier_lock:
+        if _classifier is None:
+            from .chains.retriever import get_embeddings
+            _classifier = IntentClassifier(get_embeddings())
+        return _classifier
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Báo cáo độ chính xác và độ trễ của bộ phân loại ý định cục bộ.")
+    parser.add_argument("--dataset", default=DATASET_PATH, help="File JSONL các ví dụ có nhãn ({'text', 'label'}).")
+    parser.add_argument("--no-embeddings", action="store_true", help="Chỉ dùng luật từ khóa.")
+    args = parser.parse_args()
+
+    model = None
+    if not args.no_embeddings:
+        from .chains.retriever import get_embeddings
+        model = get_embeddings()
+    report = IntentClassifier(model, load_examples(args.dataset)).evaluate()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
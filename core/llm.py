@@ -0,0 +1,67 @@
+# File: core/llm.py
+# Nơi duy nhất khởi tạo ChatGoogleGenerativeAI, để mọi LLM dùng chung API key và rate limiter.
+
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from .rate_limiter import RateLimitCallback, aretry_rate_limited, get_rate_limiter, retry_rate_limited
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+load_dotenv()
+
+DEFAULT_GEMINI_MODEL = "gemini-2.0-flash"
+# SDK chỉ gọi 1 lần: nếu để SDK tự retry, GeminiRateLimiter chỉ thấy 429 sau khi các lần retry
+# nội bộ (không qua limiter) đã hết. Retry/backoff do retry_rate_limited đảm nhận.
+SDK_MAX_RETRIES = 1
+
+_gemini_class = None
+_gemini_class_lock = threading.Lock()
+
+
+def _rate_limited_gemini_class():
+    """Lớp con của ChatGoogleGenerativeAI gọi lại qua limiter khi gặp 429 (tạo một lần, import lười)."""
+    global _gemini_class
+    with _gemini_class_lock:
+        if _gemini_class is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            class RateLimitedGemini(ChatGoogleGenerativeAI):
+                # Lần gọi đầu đã qua rate_limiter.acquire của BaseChatModel; các lần gọi lại chờ limiter ở đây.
+                # Stream không được gọi lại: có thể đã trả một phần nội dung cho người dùng.
+                def _generate(self, *args, **kwargs):
+                    parent = super()._generate
+                    return retry_rate_limited(self.rate_limiter, lambda: parent(*args, **kwargs))
+
+                async def _agenerate(self, *args, **kwargs):
+                    parent = super()._agenerate
+                    return await aretry_rate_limited(self.rate_limiter, lambda: parent(*args, **kwargs))
+
+            _gemini_class = RateLimitedGemini
+        return _gemini_class
+
+
+def create_gemini_llm(model: str = DEFAULT_GEMINI_MODEL, **kwargs) -> "ChatGoogleGenerativeAI":
+    """
+    Tạo ChatGoogleGenerativeAI đi qua GeminiRateLimiter dùng chung (RPM/TPM + tự giảm tốc khi 429).
+    Khi gặp 429, limiter giảm tốc rồi gọi lại (SDK không tự retry, xem SDK_MAX_RETRIES).
+    Các tham số khác (temperature, ...) được truyền thẳng cho ChatGoogleGenerativeAI.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY không được tìm thấy")
+
+    limiter = get_rate_limiter()
+    kwargs.setdefault("max_retries", SDK_MAX_RETRIES)
+    # Import khi tạo LLM lần đầu (SDK Gemini import chậm), không phải khi import module
+    return _rate_limited_gemini_class()(
+        model=model,
+        google_api_key=api_key,
+        rate_limiter=limiter,
+        callbacks=[RateLimitCallback(limiter)],
+        **kwargs,
+    )
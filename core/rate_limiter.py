@@ -0,0 +1,205 @@
+# File: core/rate_limiter.py
+# Bộ giới hạn tốc độ gọi Gemini dùng chung cho cả process (router_llm, answer_llm, llm_plan, agent_llm...).
+# Hai token bucket: số request/phút (RPM) và số token/phút (TPM), cộng cơ chế tự giảm tốc khi gặp 429.
+# Nhờ vậy các LLM chạy nhanh nhất mà quota cho phép, thay vì ngủ cố định sau mỗi lần gọi.
+
+import asyncio
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+load_dotenv()
+
+# Quota của project Gemini (mặc định theo gói miễn phí của gemini-2.0-flash), chỉnh qua .env
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# Phần quota được phép dùng dồn một lúc (burst). Tốc độ nạp lại được trừ đi phần này,
+# nên trong bất kỳ cửa sổ 60 giây nào cũng không vượt quá RPM/TPM.
+BURST_FRACTION = float(os.getenv("GEMINI_BURST_FRACTION", "0.25"))
+# Khi gặp 429: tốc độ nạp giảm một nửa (không thấp hơn MIN_SCALE) và tạm dừng gọi trong COOLDOWN giây,
+# mỗi lần gọi thành công sau đó tăng lại RECOVERY_STEP cho đến tốc độ đầy đủ.
+MIN_SCALE = 0.1
+RECOVERY_STEP = 0.05
+MAX_COOLDOWN = 60
+# Độ chính xác của vòng chờ (giây)
+MIN_WAIT = 0.05
+# Số lần gọi lại khi gặp 429. SDK Gemini chỉ thử 1 lần (max_retries=1 trong core/llm.py),
+# việc chờ và gọi lại do limiter đảm nhận để mỗi 429 đều làm giảm tốc ngay lập tức.
+RATE_LIMIT_RETRIES = int(os.getenv("GEMINI_RATE_LIMIT_RETRIES", "5"))
+
+
+class TokenBucket:
+    """Token bucket đơn giản: nạp liên tục `rate` token mỗi giây, chứa tối đa `capacity` token."""
+
+    def __init__(self, per_minute: int, burst_fraction: float = BURST_FRACTION):
+        self.capacity = max(1.0, per_minute * burst_fraction)
+        self.rate = max(per_minute - self.capacity, 1.0) / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float = 1.0):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        """Số giây cần chờ để có đủ `amount` token (0 nếu đã đủ)."""
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.rate * scale)
+
+
+class GeminiRateLimiter(BaseRateLimiter):
+    """
+    Rate limiter cho ChatGoogleGenerativeAI (truyền qua tham số rate_limiter).
+    Mỗi request lấy 1 token RPM; số token thực tế của response được trừ vào bucket TPM sau khi gọi xong
+    (bucket có thể âm, các request sau sẽ chờ đến khi trả hết "nợ").
+    """
+
+    def __init__(self, rpm: int = GEMINI_RPM, tpm: int = GEMINI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.scale = 1.0
+        self.cooldown_until = 0.0
+        self.consecutive_429 = 0
+        self.lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """Lấy 1 request nếu được, trả về 0; nếu chưa được thì trả về số giây nên chờ."""
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now, self.scale)
+            self.tokens.refill(now, self.scale)
+            wait = max(self.cooldown_until - now,
+                       self.requests.wait_time(1, self.scale),
+                       # Chỉ cần bucket TPM không âm: chưa biết trước request này tốn bao nhiêu token
+                       self.tokens.wait_time(0, self.scale))
+            if wait <= 0:
+                self.requests.tokens -= 1
+                return 0.0
+            return max(wait, MIN_WAIT)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            await asyncio.sleep(wait)
+
+    def record_usage(self, total_tokens: int):
+        """Trừ số token thực tế của một lần gọi vào bucket TPM và tăng dần tốc độ trở lại."""
+        with self.lock:
+            self.tokens.refill(time.monotonic(), self.scale)
+            self.tokens.tokens -= total_tokens
+            self.consecutive_429 = 0
+            self.scale = min(1.0, self.scale + RECOVERY_STEP)
+
+    def record_rate_limited(self):
+        """Gemini trả về 429: giảm tốc độ nạp và tạm dừng gọi một khoảng tăng dần."""
+        with self.lock:
+            self.consecutive_429 += 1
+            self.scale = max(MIN_SCALE, self.scale / 2)
+            now = time.monotonic()
+            self.cooldown_until = max(self.cooldown_until, now + min(2 ** self.consecutive_429, MAX_COOLDOWN))
+            self.requests.refill(now, self.scale)
+            self.requests.tokens = min(self.requests.tokens, 0.0)
+        print(f"--- [Rate Limiter] Gemini trả về 429, giảm tốc độ còn {self.scale:.0%} quota ---")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "scale": self.scale,
+                "request_tokens": round(self.requests.tokens, 2),
+                "tpm_tokens": round(self.tokens.tokens),
+                "cooldown_seconds": max(0.0, round(self.cooldown_until - time.monotonic(), 2)),
+            }
+
+
+def _is_rate_limit_error(error: BaseException) -> bool:
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "ResourceExhausted" in text or "RESOURCE_EXHAUSTED" in text
+
+
+def _total_tokens(response) -> int:
+    """Tổng số token của một LLMResult (usage_metadata của chat model, nếu không có thì ước lượng)."""
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                total += usage.get("total_tokens", 0)
+            else:
+                # Ước lượng thô khi provider không trả usage: ~4 ký tự một token
+                total += len(generation.text) // 4
+    return total
+
+
+def retry_rate_limited(limiter: GeminiRateLimiter, call, retries: int = RATE_LIMIT_RETRIES):
+    """
+    Gọi call(); nếu gặp 429 thì báo limiter (giảm tốc + cooldown), chờ lấy lại quota rồi gọi lại,
+    tối đa `retries` lần. Lỗi 429 cuối cùng được ném ra cho RateLimitCallback ghi nhận như bình thường.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not _is_rate_limit_error(e):
+                raise
+            limiter.record_rate_limited()
+            limiter.acquire()
+
+
+async def aretry_rate_limited(limiter: GeminiRateLimiter, call, retries: int = RATE_LIMIT_RETRIES):
+    """Bản async của retry_rate_limited (call trả về coroutine)."""
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not _is_rate_limit_error(e):
+                raise
+            limiter.record_rate_limited()
+            await limiter.aacquire()
+
+
+class RateLimitCallback(BaseCallbackHandler):
+    """Báo cho GeminiRateLimiter số token đã dùng và các lỗi 429 của LLM."""
+
+    # Chỉ cập nhật bộ đếm, không cần chạy trong thread riêng
+    run_inline = True
+
+    def __init__(self, limiter: GeminiRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response, **kwargs):
+        self.limiter.record_usage(_total_tokens(response))
+
+    def on_llm_error(self, error, **kwargs):
+        if _is_rate_limit_error(error):
+            self.limiter.record_rate_limited()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> GeminiRateLimiter:
+    """GeminiRateLimiter dùng chung cho mọi LLM trong process."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = GeminiRateLimiter()
+        return _limiter
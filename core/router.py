@@ -1,34 +1,30 @@
 # File: core/router.py (CẬP NHẬT HOÀN CHỈNH)
 
+import asyncio
 import os
 from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.documents import Document
 
-# Import các chain con và retriever
-from .chains.full_plan_chain import full_plan_chain    # LUỒNG 2 (Lên kế hoạch)
+# Import các chain con và retriever (các tài nguyên nặng chỉ được tạo khi gọi create_router)
+from .chains.full_plan_chain import create_full_plan_chain, FULL_PLAN_MODE    # LUỒNG 2 (Lên kế hoạch)
 from .chains.prompts import router_prompt, rag_direct_prompt
 from .chains.retriever import retriever 
+from .chains.retrieval_context import get_retrieval_context, with_retrieval_context
 
 # <<< IMPORT LUỒNG MỚI (LUỒNG 3) >>>
-from .agents.executor import agent_executor           # LUỒNG 3 (Thực thi)
+from .agents.executor import create_agent_executor    # LUỒNG 3 (Thực thi)
+from .llm import create_gemini_llm
+from .streaming import as_step
+from .semantic_cache import get_semantic_cache, with_semantic_cache
+from .intent_classifier import get_intent_classifier
+from .tracing import get_tracer
+from .speculation import (SPECULATIVE_EXECUTION, SPECULATIVE_RUN_PREFIX, SpeculativeRun,
+                          get_speculations, get_speculator, with_speculation)
 
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY không được tìm thấy")
-
-# LLM cho router phân loại (Flash)
-router_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",
-                                  google_api_key=api_key)
-
-# LLM cho việc tạo câu trả lời cuối cùng (Pro)
-answer_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",
-                                  google_api_key=api_key,
-                                  temperature=0.3)
 
 # Hàm helper để định dạng context từ retriever
 def format_docs(docs: list[Document]) -> str:
@@ -44,27 +40,135 @@ def format_docs(docs: list[Document]) -> str:
 def prepare_subchain_input(input_dict: dict) -> dict:
     return {"user_input": input_dict["user_input"]}
 
-# Chain RAG Trực tiếp (LUỒNG 1)
-direct_rag_answer_chain = (
-    # Nhận input {"user_input": ..., "rag_context": ...}
-    rag_direct_prompt
-    | answer_llm
-    | StrOutputParser()
-)
+# Nhánh mà một topic dẫn tới: Luồng 2 (kế hoạch) là nhánh mặc định của RunnableBranch bên dưới
+def routes_to(topic: str, label: str) -> bool:
+    if label == "generate_full_plan":
+        return not any(other in topic for other in ("execute_pentest_tool", "specific_vulnerability_info", "tool_usage"))
+    return label in topic
+
+# Agent (Luồng 3) cần thêm lịch sử hội thoại để hiểu các câu như "quét tiếp cổng 443 của nó"
+def prepare_agent_input(input_dict: dict) -> dict:
+    return {"user_input": input_dict["user_input"], "chat_history": input_dict.get("chat_history") or []}
 
 def create_router():
     """
     Tạo Router Chain thông minh: 
     Phân loại -> Kiểm tra RAG -> Chọn 1 trong 3 Luồng.
+    Tốn vài giây (LLM client, Agent, model embedding của bộ phân loại): dùng get_router() trong
+    core/warmup.py để chỉ tạo một lần và tạo sớm ở luồng nền.
     """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY không được tìm thấy")
+
+    # LLM cho router phân loại (Flash)
+    router_llm = create_gemini_llm(model="gemini-2.0-flash")
+
+    # LLM cho việc tạo câu trả lời cuối cùng (Pro)
+    answer_llm = create_gemini_llm(model="gemini-2.0-flash",
+                                   temperature=0.3)
+
+    # Chain RAG Trực tiếp (LUỒNG 1)
+    direct_rag_answer_chain = (
+        # Nhận input {"user_input": ..., "rag_context": ...}
+        rag_direct_prompt
+        | answer_llm
+        | StrOutputParser()
+    )
+
+    # Luồng 2 (Lên kế hoạch) và Luồng 3 (Thực thi)
+    full_plan_chain, chain_step1_recon = create_full_plan_chain()
+    agent_executor = create_agent_executor()
     
     # 1. Chain phân loại ý định
     # Input: {"user_input": "..."} -> Output: string (topic)
-    classifier_chain = (lambda x: x["user_input"]) | router_prompt | router_llm | StrOutputParser()
+    # Bộ phân loại cục bộ (luật + centroid, core/intent_classifier.py) chạy trước;
+    # chỉ gọi router_llm khi nó không đủ tự tin (hoặc bị tắt bằng LOCAL_INTENT_CLASSIFIER=0).
+    llm_classifier_chain = (lambda x: x["user_input"]) | router_prompt | router_llm | StrOutputParser()
+    intent_classifier = get_intent_classifier()
+
+    def local_topic(x) -> tuple[str | None, str | None]:
+        """(nhãn nếu bộ phân loại cục bộ đủ tự tin, phỏng đoán tốt nhất của nó)."""
+        if intent_classifier is None:
+            return None, None
+        prediction = intent_classifier.classify(x["user_input"])
+        if prediction.confident:
+            print(f"--- [Router] Phân loại cục bộ ({prediction.source}): {prediction.label} "
+                  f"(độ tin cậy {prediction.confidence:.2f}) ---")
+            return prediction.label, prediction.label
+        print(f"--- [Router] Phân loại cục bộ chưa chắc chắn ({prediction.label}, "
+              f"{prediction.confidence:.2f}), hỏi router LLM ---")
+        return None, prediction.label
+
+    # Thực thi suy đoán (core/speculation.py): trong lúc chờ router LLM, chạy trước bước đầu tiên của
+    # nhánh mà bộ phân loại cục bộ đoán. {nhãn: (tên bước, runnable của bước)}.
+    # Nhánh RAG: bước đầu là retrieval (luôn chạy sớm, xem classify). Nhánh Agent: không suy đoán vì
+    # tool có tác động thật lên mục tiêu.
+    speculative_stages = {"generate_full_plan": ("recon_results", chain_step1_recon)}
+    speculator = get_speculator()
+
+    def speculate(guess: str | None, x, config, run_async: bool):
+        speculations = get_speculations(config)
+        plan_mode = (config.get("configurable") or {}).get("plan_mode", FULL_PLAN_MODE)
+        if not SPECULATIVE_EXECUTION or speculations is None or guess not in speculative_stages or plan_mode != "chain":
+            return
+        kind, stage = speculative_stages[guess]
+        run = SpeculativeRun(speculator, kind, stage, {"user_input": x["user_input"]},
+                             {"callbacks": config.get("callbacks"), "run_name": SPECULATIVE_RUN_PREFIX + kind})
+        if run.astart() if run_async else run.start():
+            speculations[kind] = run
+            print(f"--- [Speculation] Chạy trước '{kind}' (phỏng đoán: {guess}) trong lúc chờ router LLM ---")
+
+    def settle(topic: str, config, speculative: bool):
+        # Nhánh thực thi tool không dùng RAG: hủy retrieval; các nhánh khác cần nó nên bắt đầu ngay
+        context = get_retrieval_context(config)
+        if "execute_pentest_tool" in topic:
+            context.cancel("nhánh thực thi tool")
+        else:
+            context.start()
+        if speculative:
+            speculator.record("retrieval", "started")
+            speculator.record("retrieval", "misses" if "execute_pentest_tool" in topic else "hits")
+        # Giữ bước suy đoán nếu router LLM chọn đúng nhánh đã đoán, nếu không thì hủy
+        for label, (kind, _) in speculative_stages.items():
+            run = (get_speculations(config) or {}).get(kind)
+            if run is not None and not run.settled:
+                run.keep() if routes_to(topic, label) else run.cancel()
+        return topic
+
+    def classify(x, config):
+        topic, guess = local_topic(x)
+        if topic is None:
+            # Chạy retrieval và bước đầu của nhánh đoán được song song với router LLM, hủy nếu hóa ra không cần
+            get_retrieval_context(config).start()
+            speculate(guess, x, config, run_async=False)
+            return settle(llm_classifier_chain.invoke(x, config), config, speculative=True)
+        return settle(topic, config, speculative=False)
+
+    async def aclassify(x, config):
+        # Embedding câu hỏi chạy trên CPU: đẩy sang thread để không chặn event loop
+        topic, guess = await asyncio.to_thread(local_topic, x)
+        if topic is None:
+            get_retrieval_context(config).start()
+            speculate(guess, x, config, run_async=True)
+            return settle(await llm_classifier_chain.ainvoke(x, config), config, speculative=True)
+        return settle(topic, config, speculative=False)
+
+    classifier_chain = RunnableLambda(classify, afunc=aclassify, name="intent_classifier")
+
+    # 2. Context RAG của request (core/chains/retrieval_context.py)
+    # Input: {"user_input": ..., "topic": ...} -> Output: list[Document] ([] cho nhánh thực thi tool)
+    def rag_docs(x, config):
+        return [] if "execute_pentest_tool" in x["topic"] else get_retrieval_context(config).get()
+
+    async def arag_docs(x, config):
+        return [] if "execute_pentest_tool" in x["topic"] else await get_retrieval_context(config).aget()
+
+    rag_retrieval_chain = RunnableLambda(rag_docs, afunc=arag_docs, name="rag_retrieval")
 
-    # 2. Chain Lấy Context RAG Sớm
-    # Input: {"user_input": "..."} -> Output: list[Document]
-    early_rag_retrieval_chain = (lambda x: x["user_input"]) | retriever
+    # Cache ngữ nghĩa (bật bằng SEMANTIC_CACHE=1) chỉ bọc Luồng 1 và Luồng 2.
+    # Luồng 3 (thực thi tool) luôn chạy thật, vì kết quả quét phụ thuộc trạng thái mục tiêu tại thời điểm chạy.
+    semantic_cache = get_semantic_cache()
 
     # 3. Logic Phân nhánh 3 Luồng (CẬP NHẬT)
     # Input cho branch là dict: {"topic": ..., "user_input": ..., "rag_context_docs": ...}
@@ -74,34 +178,41 @@ def create_router():
         # Ưu tiên cao nhất
         (lambda x: "execute_pentest_tool" in x["topic"],
             # Chạy Agent Executor
-            RunnableLambda(prepare_subchain_input) | agent_executor
+            as_step(RunnableLambda(prepare_agent_input) | agent_executor, "agent")
         ),
         
         # ĐIỀU KIỆN 2: Nếu là câu hỏi cụ thể VÀ có RAG (LUỒNG 1)
         (lambda x: ("specific_vulnerability_info" in x["topic"] or "tool_usage" in x["topic"]) and x.get("rag_context_docs"),
             # Nếu ĐÚNG -> Định dạng context và chạy chain RAG TRỰC TIẾP
-            RunnableLambda(
+            as_step(with_semantic_cache(RunnableLambda(
                 lambda x: {
                     "user_input": x["user_input"],
                     "rag_context": format_docs(x["rag_context_docs"]) # Định dạng context
                 }
-            ) | direct_rag_answer_chain
+            ) | direct_rag_answer_chain, semantic_cache, "rag_answer"), "rag_answer")
         ),
         
         # FALLBACK: (LUỒNG 2 - Lên kế hoạch)
         # Nếu là 'generate_full_plan' HOẶC các luồng kia không khớp
-        RunnableLambda(prepare_subchain_input) | full_plan_chain # full_plan_chain tự query RAG lại
+        with_semantic_cache(
+            RunnableLambda(prepare_subchain_input) | full_plan_chain, # full_plan_chain dùng lại retrieval của request
+            # Kế hoạch của chế độ nhanh và chế độ 4 bước được cache riêng
+            semantic_cache, "full_plan", configurable={"plan_mode": FULL_PLAN_MODE}
+        )
     )
 
     # 4. Gắn kết tất cả lại
     # - Nhận input {"user_input": "..."}
-    # - Chạy classifier lấy "topic"
-    # - Chạy retriever sớm lấy "rag_context_docs"
+    # - Chạy classifier lấy "topic" (retrieval chạy sớm song song nếu phải hỏi router LLM)
+    # - Lấy "rag_context_docs" từ retrieval của request (bỏ qua với nhánh thực thi tool)
     # - Đưa cả ba vào chain phân nhánh 'branch'
-    final_chain = RunnablePassthrough.assign(
-        topic=classifier_chain, # Chạy phân loại
-        rag_context_docs=early_rag_retrieval_chain # Chạy RAG sớm song song
+    final_chain = with_speculation(with_retrieval_context(
+        RunnablePassthrough.assign(topic=classifier_chain)  # Chạy phân loại
+        | RunnablePassthrough.assign(rag_context_docs=rag_retrieval_chain)
         # Input gốc ("user_input") được giữ lại tự động bởi RunnablePassthrough
-    ) | branch # Đưa dict {"topic": ..., "user_input": ..., "rag_context_docs": ...} vào branch
+        | branch,  # Đưa dict {"topic": ..., "user_input": ..., "rag_context_docs": ...} vào branch
+        retriever,
+    ))
 
-    return final_chain
\ No newline at end of file
+    # 5. Tracing (core/tracing.py): thời gian, token, retrieval và tool của từng bước cho mọi request
+    return final_chain.with_config(callbacks=[get_tracer()])
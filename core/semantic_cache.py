@@ -0,0 +1,243 @@
+# File: core/semantic_cache.py
+# Cache câu trả lời theo ngữ nghĩa cho router: các câu hỏi gần giống nhau ("Cách dùng sqlmap",
+# "sqlmap dùng thế nào") dùng lại câu trả lời đã sinh, không gọi lại LLM.
+# Câu hỏi được embed bằng model MiniLM đã load trong retriever.py và tìm trong một FAISS index nhỏ
+# (tích vô hướng trên vector đã chuẩn hóa = cosine). Tắt mặc định, bật bằng SEMANTIC_CACHE=1.
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+# Độ tương đồng cosine tối thiểu để coi là cùng một câu hỏi
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Thời gian sống của một câu trả lời (giây) và số câu trả lời tối đa cho mỗi nhánh
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR",
+                               os.path.join(os.path.dirname(__file__), '..', 'semantic_cache'))
+
+
+def _encode(value):
+    """Chuyển câu trả lời (chuỗi, AIMessage, dict của full_plan_chain) thành JSON."""
+    if isinstance(value, BaseMessage):
+        return {"__message__": message_to_dict(value)}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__message__" in value:
+            return messages_from_dict([value["__message__"]])[0]
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class _Namespace:
+    """Các câu hỏi đã cache của một nhánh router: metadata + vector + FAISS index dựng lại từ vector."""
+
+    def __init__(self, dim: int):
+        self.entries: list[dict] = []
+        self.vectors = np.zeros((0, dim), dtype="float32")
+        self.index = faiss.IndexFlatIP(dim)
+
+    def rebuild(self):
+        self.index.reset()
+        if len(self.vectors):
+            self.index.add(self.vectors)
+
+
+class SemanticCache:
+    """
+    Cache ngữ nghĩa có TTL, giới hạn số mục (loại bỏ mục lâu không dùng nhất) và lưu xuống đĩa.
+    Mỗi namespace (nhánh router) có index riêng, nên câu trả lời của nhánh này không bao giờ
+    được trả cho nhánh khác.
+    """
+
+    def __init__(self, embeddings, path: str = SEMANTIC_CACHE_DIR,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespaces: dict[str, _Namespace] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._load()
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _namespace_locked(self, namespace: str, dim: int) -> _Namespace:
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = _Namespace(dim)
+        return self.namespaces[namespace]
+
+    def lookup(self, namespace: str, query: str):
+        """Câu trả lời đã cache của câu hỏi gần nhất (độ tương đồng >= threshold), hoặc None."""
+        vector = self._embed(query)
+        with self.lock:
+            ns = self.namespaces.get(namespace)
+            if ns is not None and ns.index.ntotal:
+                scores, ids = ns.index.search(vector, 1)
+                score, idx = float(scores[0][0]), int(ids[0][0])
+                entry = ns.entries[idx] if idx >= 0 else None
+                now = time.time()
+                if entry and score >= self.threshold and now - entry["created"] <= self.ttl:
+                    entry["last_used"] = now
+                    entry["hits"] += 1
+                    self.hits += 1
+                    print(f"--- [Semantic Cache] HIT ({namespace}, {score:.3f}): '{entry['query']}' ---")
+                    return _decode(entry["answer"])
+            self.misses += 1
+        return None
+
+    def store(self, namespace: str, query: str, answer):
+        vector = self._embed(query)
+        now = time.time()
+        with self.lock:
+            ns = self._namespace_locked(namespace, vector.shape[1])
+            ns.entries.append({"query": query, "answer": _encode(answer),
+                               "created": now, "last_used": now, "hits": 0})
+            ns.vectors = np.vstack([ns.vectors, vector])
+            self._evict_locked(ns, now)
+            ns.rebuild()
+            self._save_locked(namespace)
+
+    def _evict_locked(self, ns: _Namespace, now: float):
+        """Bỏ các mục hết hạn, rồi các mục lâu không dùng nhất nếu vượt max_entries."""
+        keep = [i for i, entry in enumerate(ns.entries) if now - entry["created"] <= self.ttl]
+        if len(keep) > self.max_entries:
+            keep = sorted(keep, key=lambda i: ns.entries[i]["last_used"])[-self.max_entries:]
+            keep.sort()
+        if len(keep) != len(ns.entries):
+            ns.entries = [ns.entries[i] for i in keep]
+            ns.vectors = ns.vectors[keep]
+
+    # --- Lưu / tải từ đĩa ---
+
+    def _save_locked(self, name: str):
+        """Ghi một namespace (chỉ namespace vừa thay đổi) xuống đĩa."""
+        os.makedirs(self.path, exist_ok=True)
+        ns = self.namespaces[name]
+        base = os.path.join(self.path, name)
+        # Ghi ra file tạm rồi đổi tên, để một lần ghi dở dang không làm hỏng cache
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(ns.entries, f, ensure_ascii=False)
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, ns.vectors)
+        os.replace(base + ".npy.tmp", base + ".npy")
+        os.replace(base + ".json.tmp", base + ".json")
+
+    def _load(self):
+        if not os.path.isdir(self.path):
+            return
+        now = time.time()
+        for filename in os.listdir(self.path):
+            if not filename.endswith(".json"):
+                continue
+            name = filename[:-len(".json")]
+            try:
+                with open(os.path.join(self.path, filename), encoding="utf-8") as f:
+                    entries = json.load(f)
+                vectors = np.load(os.path.join(self.path, name + ".npy")).astype("float32")
+                if len(entries) != len(vectors):
+                    raise ValueError("số mục và số vector không khớp")
+            except Exception as e:
+                print(f"--- [Semantic Cache] Bỏ qua cache hỏng '{name}': {e} ---")
+                continue
+            ns = _Namespace(vectors.shape[1])
+            ns.entries, ns.vectors = entries, vectors
+            self._evict_locked(ns, now)
+            ns.rebuild()
+            self.namespaces[name] = ns
+        print(f"--- [Semantic Cache] Đã tải {sum(len(ns.entries) for ns in self.namespaces.values())} câu trả lời từ {self.path} ---")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": {name: len(ns.entries) for name, ns in self.namespaces.items()}}
+
+
+def with_semantic_cache(runnable: Runnable, cache: SemanticCache | None, namespace: str,
+                        query_key: str = "user_input", configurable: dict | None = None) -> Runnable:
+    """
+    Bọc một nhánh của router: trả về câu trả lời đã cache nếu có câu hỏi đủ giống, nếu không thì chạy
+    nhánh và lưu kết quả. cache=None (cache tắt) -> trả về nguyên runnable.
+    configurable: {khóa trong config["configurable"]: giá trị mặc định} mà câu trả lời phụ thuộc vào
+    (vd: {"plan_mode": FULL_PLAN_MODE}); mỗi giá trị dùng một namespace riêng (vd: "full_plan.fast").
+    Ở đường async, embedding và ghi đĩa chạy trong thread để không chặn event loop.
+    """
+    if cache is None:
+        return runnable
+
+    def namespace_for(config: RunnableConfig) -> str:
+        values = (config or {}).get("configurable") or {}
+        return "".join([namespace] + [f".{values.get(key, default)}" for key, default in (configurable or {}).items()])
+
+    def restore(x, answer):
+        # full_plan_chain trả về dict có chứa user_input: giữ câu hỏi hiện tại thay vì câu hỏi cũ
+        if isinstance(answer, dict) and query_key in answer:
+            answer[query_key] = x[query_key]
+        return answer
+
+    def invoke(x, config):
+        name = namespace_for(config)
+        answer = cache.lookup(name, x[query_key])
+        if answer is not None:
+            return restore(x, answer)
+        answer = runnable.invoke(x, config)
+        cache.store(name, x[query_key], answer)
+        return answer
+
+    async def ainvoke(x, config):
+        name = namespace_for(config)
+        answer = await asyncio.to_thread(cache.lookup, name, x[query_key])
+        if answer is not None:
+            return restore(x, answer)
+        answer = await runnable.ainvoke(x, config)
+        await asyncio.to_thread(cache.store, name, x[query_key], answer)
+        return answer
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"semantic_cache:{namespace}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache | None:
+    """SemanticCache dùng chung (None nếu chưa bật SEMANTIC_CACHE hoặc không có embedding model)."""
+    global _cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            from .chains.retriever import get_embeddings
+            embeddings = get_embeddings()
+            if embeddings is None:
+                print("--- [Semantic Cache] Không có embedding model, tắt cache. ---")
+                return None
+            _cache = SemanticCache(embeddings)
+        return _cache
@@ -0,0 +1,253 @@
+# File: core/speculation.py
+# Thực thi suy đoán (speculative execution) cho router: khi bộ phân loại cục bộ chưa đủ tự tin và
+# router phải hỏi LLM, bước đầu tiên của nhánh có khả năng nhất (theo phỏng đoán cục bộ) được chạy
+# song song với lần gọi LLM phân loại. Router LLM đồng ý -> nhánh dùng lại kết quả; không đồng ý -> hủy.
+#
+# Chi phí của phỏng đoán sai bị giới hạn:
+#   - tối đa SPECULATION_MAX_INFLIGHT bước suy đoán chạy cùng lúc (trên mọi request), vượt thì bỏ qua,
+#   - đường async: bước bị hủy ngay khi có kết quả phân loại (task bị cancel, request HTTP bị ngắt);
+#     đường sync: thread đang chạy không hủy được, kết quả bị bỏ khi xong (thời gian tốn được tính khi đó),
+#   - khi tỉ lệ đoán đúng gần đây thấp hơn SPECULATION_MIN_HIT_RATE, ngừng suy đoán (thỉnh thoảng thử lại).
+# Mọi lần suy đoán được đếm trong get_speculator().stats().
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+load_dotenv()
+
+# Bật/tắt thực thi suy đoán
+SPECULATIVE_EXECUTION = os.getenv("SPECULATIVE_EXECUTION", "1") == "1"
+# Số bước suy đoán (mỗi bước thường là một lần gọi LLM) chạy đồng thời tối đa
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "2"))
+# Tỉ lệ đoán đúng tối thiểu (trên SPECULATION_WINDOW lần gần nhất) để tiếp tục suy đoán
+SPECULATION_MIN_HIT_RATE = float(os.getenv("SPECULATION_MIN_HIT_RATE", "0.5"))
+SPECULATION_WINDOW = 20
+
+SPECULATIONS_KEY = "speculations"
+# Tiền tố run_name của các bước suy đoán (core/tracing.py tính mỗi bước là một "bước" riêng)
+SPECULATIVE_RUN_PREFIX = "speculative:"
+
+_executor = ThreadPoolExecutor(max_workers=max(1, SPECULATION_MAX_INFLIGHT), thread_name_prefix="speculation")
+
+
+class Speculator:
+    """Giới hạn và thống kê các bước suy đoán (dùng chung cho mọi request)."""
+
+    def __init__(self, max_inflight: int = SPECULATION_MAX_INFLIGHT, min_hit_rate: float = SPECULATION_MIN_HIT_RATE,
+                 window: int = SPECULATION_WINDOW):
+        self.slots = threading.BoundedSemaphore(max(1, max_inflight))
+        self.min_hit_rate = min_hit_rate
+        self.window = window
+        self.lock = threading.Lock()
+        self.recent: dict[str, deque] = {}  # loại -> kết quả đúng/sai gần đây
+        self.suppressed_runs: dict[str, int] = {}
+        self.counters: dict[str, dict] = {}
+
+    def _count(self, kind: str, key: str, amount=1):
+        counters = self.counters.setdefault(kind, {"started": 0, "hits": 0, "misses": 0, "unused": 0, "failed": 0,
+                                                    "skipped_busy": 0, "suppressed": 0, "wasted_seconds": 0.0})
+        counters[key] += amount
+
+    def acquire(self, kind: str) -> bool:
+        """Xin một suất chạy suy đoán; False nếu đang đủ suất hoặc tỉ lệ đoán đúng gần đây quá thấp."""
+        with self.lock:
+            recent = self.recent.get(kind)
+            if recent and len(recent) >= self.window // 2 and sum(recent) / len(recent) < self.min_hit_rate:
+                # Vẫn thử lại một lần sau mỗi `window` lần bỏ qua, để phát hiện khi phỏng đoán tốt trở lại
+                self.suppressed_runs[kind] = self.suppressed_runs.get(kind, 0) + 1
+                if self.suppressed_runs[kind] % self.window:
+                    self._count(kind, "suppressed")
+                    return False
+            if not self.slots.acquire(blocking=False):
+                self._count(kind, "skipped_busy")
+                return False
+            self._count(kind, "started")
+            return True
+
+    def release(self):
+        self.slots.release()
+
+    def record(self, kind: str, outcome: str, wasted_seconds: float = 0.0):
+        """outcome: "hits" (router LLM đồng ý), "misses" (bị hủy), "unused" (đồng ý nhưng nhánh không dùng), "failed"."""
+        with self.lock:
+            self._count(kind, outcome)
+            self._count(kind, "wasted_seconds", wasted_seconds)
+            if outcome in ("hits", "misses"):
+                self.recent.setdefault(kind, deque(maxlen=self.window)).append(outcome == "hits")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {kind: {key: round(value, 3) if isinstance(value, float) else value for key, value in counters.items()}
+                    for kind, counters in self.counters.items()}
+
+
+class SpeculativeRun:
+    """Một bước (`kind`) chạy trước khi biết nhánh: bắt đầu (thread hoặc task async), giữ lại hoặc hủy, lấy kết quả."""
+
+    def __init__(self, speculator: Speculator, kind: str, runnable: Runnable, inputs: dict, config: RunnableConfig):
+        self.speculator = speculator
+        self.kind = kind
+        self.runnable = runnable
+        self.inputs = inputs
+        self.config = config
+        self.future: Future | asyncio.Task | None = None
+        self.started = self.finished = None
+        self.kept = False
+        self.settled = False
+        self.discarded: str | None = None  # outcome khi bị bỏ; thời gian lãng phí được ghi lúc bước thật sự dừng
+        self.recorded = False
+        self.lock = threading.Lock()
+
+    def _done(self, future):
+        self.finished = time.perf_counter()
+        self.speculator.release()
+        if not future.cancelled():
+            future.exception()  # lỗi được xử lý khi lấy kết quả; tránh cảnh báo "exception was never retrieved"
+        self._record_discarded()
+
+    def _record_discarded(self):
+        """Ghi lại bước bị bỏ (một lần), khi đã bị bỏ và đã dừng hẳn."""
+        with self.lock:
+            if self.discarded is None or self.finished is None or self.recorded:
+                return
+            self.recorded = True
+        wasted = self._elapsed()
+        self.speculator.record(self.kind, self.discarded, wasted)
+        print(f"--- [Speculation] Bỏ '{self.kind}' ({self.discarded}), tốn {wasted:.2f}s ---")
+
+    def start(self) -> bool:
+        if not self.speculator.acquire(self.kind):
+            return False
+        self.started = time.perf_counter()
+        self.future = _executor.submit(self.runnable.invoke, self.inputs, self.config)
+        self.future.add_done_callback(self._done)
+        return True
+
+    def astart(self) -> bool:
+        """Như start(), nhưng chạy thành task trên event loop hiện tại (hủy được giữa chừng)."""
+        if not self.speculator.acquire(self.kind):
+            return False
+        self.started = time.perf_counter()
+        self.future = asyncio.ensure_future(self.runnable.ainvoke(self.inputs, self.config))
+        self.future.add_done_callback(self._done)
+        return True
+
+    def _elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def keep(self):
+        self.kept = True
+        self.speculator.record(self.kind, "hits")
+        print(f"--- [Speculation] Đoán đúng nhánh, giữ lại '{self.kind}' ({self._elapsed():.2f}s đã chạy trước) ---")
+
+    def cancel(self, outcome: str = "misses"):
+        """
+        Bỏ kết quả suy đoán. Chỉ đường async (astart) thật sự hủy được bước đang chạy; ở đường sync (start)
+        thread đã chạy thì không dừng được, bước chạy đến hết và kết quả bị bỏ. Thời gian lãng phí được ghi
+        trong done-callback, khi bước thật sự dừng (không phải lúc gọi cancel).
+        """
+        if self.settled:
+            return
+        self.settled = True
+        self.discarded = outcome
+        self.future.cancel()
+        # Bước đã xong từ trước: done-callback đã chạy khi chưa bị bỏ, nên ghi lại ngay
+        self._record_discarded()
+
+    def take(self):
+        """Đánh dấu kết quả đã được nhánh dùng (không bị tính là lãng phí khi request kết thúc)."""
+        self.settled = True
+
+    def fail(self, error: BaseException):
+        self.speculator.record(self.kind, "failed", self._elapsed())
+        print(f"--- [Speculation] '{self.kind}' lỗi ({type(error).__name__}: {error}), chạy lại bình thường ---")
+
+
+_speculator = None
+_speculator_lock = threading.Lock()
+
+
+def get_speculator() -> Speculator:
+    global _speculator
+    with _speculator_lock:
+        if _speculator is None:
+            _speculator = Speculator()
+        return _speculator
+
+
+def get_speculations(config: RunnableConfig | None) -> dict[str, SpeculativeRun] | None:
+    return ((config or {}).get("configurable") or {}).get(SPECULATIONS_KEY)
+
+
+def with_speculation(runnable: Runnable) -> Runnable:
+    """
+    Bọc chain của router: tạo nơi chứa các bước suy đoán của request (truyền qua config["configurable"]).
+    Bước suy đoán chưa được dùng khi chain kết thúc bị hủy và tính là lãng phí.
+    """
+
+    def scoped_config(config: RunnableConfig) -> tuple[dict, RunnableConfig]:
+        speculations: dict[str, SpeculativeRun] = {}
+        configurable = {**(config.get("configurable") or {}), SPECULATIONS_KEY: speculations}
+        return speculations, {**config, "configurable": configurable}
+
+    def settle_all(speculations: dict[str, SpeculativeRun]):
+        for run in speculations.values():
+            run.cancel("unused" if run.kept else "misses")
+
+    def invoke(x, config):
+        speculations, config = scoped_config(config)
+        try:
+            return runnable.invoke(x, config)
+        finally:
+            settle_all(speculations)
+
+    async def ainvoke(x, config):
+        speculations, config = scoped_config(config)
+        try:
+            return await runnable.ainvoke(x, config)
+        finally:
+            settle_all(speculations)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="speculation")
+
+
+def speculative_stage(runnable: Runnable, kind: str) -> Runnable:
+    """
+    Bước `kind` của một nhánh: dùng kết quả suy đoán của request nếu đã được giữ lại cho cùng input,
+    nếu không (không có suy đoán, bị hủy, lỗi, chain được gọi riêng) thì chạy `runnable` như bình thường.
+    """
+
+    def speculation_for(x, config) -> SpeculativeRun | None:
+        run = (get_speculations(config) or {}).get(kind)
+        if run is None or not run.kept or run.settled or any(x.get(key) != value for key, value in run.inputs.items()):
+            return None
+        run.take()
+        return run
+
+    def invoke(x, config):
+        run = speculation_for(x, config)
+        if run is not None:
+            try:
+                return run.future.result()
+            except Exception as e:
+                run.fail(e)
+        return runnable.invoke(x, config)
+
+    async def ainvoke(x, config):
+        run = speculation_for(x, config)
+        if run is not None:
+            try:
+                future = run.future
+                return await (future if isinstance(future, asyncio.Future) else asyncio.wrap_future(future))
+            except Exception as e:
+                run.fail(e)
+        return await runnable.ainvoke(x, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="speculative_stage")
@@ -0,0 +1,119 @@
+# File: core/streaming.py
+# API stream cho router: phát sự kiện theo từng bước (bắt đầu/kết thúc), từng token của LLM,
+# từng dòng output của tool, và kết quả cuối cùng, để UI hiển thị ngay khi có dữ liệu
+# thay vì chờ cả chain chạy xong.
+#
+# Mỗi sự kiện là một dict có khóa "type":
+#   {"type": "step_start", "step": tên_bước}   # có thể đến trước khi input của bước sẵn sàng
+#   {"type": "token", "step": tên_bước, "text": "..."}
+#   {"type": "step_end", "step": tên_bước, "output": ...}
+#   {"type": "tool_start", "tool": tên_tool, "input": {...}}
+#   {"type": "tool_end", "tool": tên_tool, "output": "..."}
+#   {"type": "tool_output", "tool": ..., "stream": "stdout"|"stderr", "line": "..."}
+#   {"type": "final", "output": ..., "run_id": ...}   # output giống giá trị trả về của chain.invoke;
+#                                                     # run_id dùng để lấy trace (core/tracing.py)
+
+import asyncio
+import queue
+import threading
+
+from langchain_core.runnables import Runnable
+
+from .tools.kali_client import KALI_OUTPUT_EVENT, close_async_kali_client
+
+# Tag đánh dấu các bước cần hiển thị; token của LLM nằm ngoài mọi bước (vd: router phân loại) bị bỏ qua
+STEP_TAG_PREFIX = "step:"
+
+# Thời gian chờ tối đa để chain dừng hẳn khi người dùng bỏ dở việc đọc stream (giây)
+CANCEL_WAIT = 5
+
+
+def as_step(runnable: Runnable, name: str) -> Runnable:
+    """Đặt tên và tag cho một bước để stream_events nhận ra (tag được kế thừa bởi các run con)."""
+    return runnable.with_config(run_name=name, tags=[STEP_TAG_PREFIX + name])
+
+
+def _step_of(event: dict) -> str | None:
+    for tag in event.get("tags") or []:
+        if tag.startswith(STEP_TAG_PREFIX):
+            return tag[len(STEP_TAG_PREFIX):]
+    return None
+
+
+def _chunk_text(chunk) -> str:
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    # Một số model trả content dạng danh sách các phần (text, tool call...)
+    return "".join(part if isinstance(part, str) else part.get("text", "")
+                   for part in content if isinstance(part, (str, dict)))
+
+
+async def astream_events(chain: Runnable, inputs: dict, config: dict | None = None):
+    """Chạy chain và phát các sự kiện gọn (xem đầu file) từ astream_events v2 của LangChain."""
+    async for event in chain.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+        data = event.get("data", {})
+        step = _step_of(event)
+
+        if kind == "on_chat_model_stream" and step:
+            text = _chunk_text(data.get("chunk"))
+            if text:
+                yield {"type": "token", "step": step, "text": text}
+        elif kind in ("on_chain_start", "on_chain_end") and step and event["name"] == step:
+            if kind == "on_chain_start":
+                yield {"type": "step_start", "step": step}
+            else:
+                yield {"type": "step_end", "step": step, "output": data.get("output")}
+        elif kind == "on_tool_start":
+            yield {"type": "tool_start", "tool": event["name"], "input": data.get("input")}
+        elif kind == "on_tool_end":
+            yield {"type": "tool_end", "tool": event["name"], "output": data.get("output")}
+        elif kind == "on_custom_event" and event["name"] == KALI_OUTPUT_EVENT:
+            yield {"type": "tool_output", **data}
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            yield {"type": "final", "output": data.get("output"), "run_id": event["run_id"]}
+
+
+def stream_events(chain: Runnable, inputs: dict, config: dict | None = None):
+    """
+    Bản đồng bộ của astream_events cho Streamlit / CLI: chain chạy bằng asyncio.run trong thread riêng,
+    các sự kiện được chuyển qua queue và yield trong thread của người gọi (để UI vẽ được).
+    Nếu người gọi dừng vòng lặp giữa chừng, chain bị hủy.
+    """
+    events = queue.Queue()
+    done = object()
+    started = threading.Event()
+    running = {}
+
+    async def pump():
+        running["loop"] = asyncio.get_running_loop()
+        running["task"] = asyncio.current_task()
+        started.set()
+        try:
+            async for event in astream_events(chain, inputs, config):
+                events.put(event)
+        except BaseException as e:
+            events.put(e)
+        finally:
+            events.put(done)
+            # Loop này chỉ sống một lượt: đóng AsyncKaliClient (pool httpx) của nó trước khi asyncio.run kết thúc
+            await close_async_kali_client()
+
+    # asyncio.run tự hủy các task con còn sót và đóng các async generator khi pump() kết thúc
+    thread = threading.Thread(target=asyncio.run, args=(pump(),), name="router-stream", daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            item = events.get()
+            if item is done:
+                finished = True
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not finished and started.wait(CANCEL_WAIT):
+            running["loop"].call_soon_threadsafe(running["task"].cancel)
+        thread.join(CANCEL_WAIT)
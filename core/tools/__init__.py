@@ -1,8 +1,23 @@
 # File: core/tools/__init__.py
+# Các tool được import lười (PEP 562): import một module con (vd: core.tools.kali_client) không kéo theo
+# mọi tool, và dirsearch_tool (Agent chưa dùng) chỉ được import khi thật sự cần.
 
-from .nmap_tool import run_nmap_scan
-from .sqlmap_tool import run_sqlmap_scan
-from .dirsearch_tool import run_dirsearch_scan
+import importlib
 
-# List of all tools for easy import
-all_tools = [run_nmap_scan, run_sqlmap_scan, run_dirsearch_scan]
+_TOOL_MODULES = {
+    "run_nmap_scan": ".nmap_tool",
+    "run_nmap_batch_scan": ".nmap_tool",
+    "run_sqlmap_scan": ".sqlmap_tool",
+    "run_dirsearch_scan": ".dirsearch_tool",
+}
+
+__all__ = [*_TOOL_MODULES, "all_tools"]
+
+
+def __getattr__(name):
+    if name in _TOOL_MODULES:
+        return getattr(importlib.import_module(_TOOL_MODULES[name], __name__), name)
+    if name == "all_tools":
+        # List of all tools for easy import
+        return [__getattr__(tool) for tool in _TOOL_MODULES]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
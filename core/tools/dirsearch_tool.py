@@ -1,38 +1,45 @@
 # File: core/tools/dirsearch_tool.py
 
-from langchain_core.tools import tool
-import requests
-import os
+from langchain_core.tools import StructuredTool
 
-KALI_LISTENER_URL = os.getenv("KALI_LISTENER_URL")
+# KALI_LISTENER_URL (kèm giá trị mặc định) được đọc từ .env trong kali_client
+from .kali_client import get_async_kali_client, get_kali_client, make_async_output_dispatcher, make_output_dispatcher
+from .parsers import summarize_dirsearch
 
-@tool
-def run_dirsearch_scan(url: str, params: str = "-e php,html,js") -> str:
-    """Gửi yêu cầu quét Dirsearch đến máy Kali Listener."""
+def _dirsearch_params(url: str, params: str) -> list[str]:
     print(f"--- [Agent] Gửi yêu cầu Dirsearch đến Kali: {url} ---")
-
     param_list = params.split()
     param_list.extend(["-u", url])
+    return param_list
 
-    payload = {
-        "tool": "dirsearch",
-        "params": param_list
-    }
-
-    if not KALI_LISTENER_URL:
-        return "Lỗi: Biến môi trường KALI_LISTENER_URL chưa được cài đặt."
+def _run_dirsearch_scan(url: str, params: str = "-e php,html,js", raw_output: bool = False) -> str:
+    """
+    Gửi yêu cầu quét Dirsearch đến máy Kali Listener.
+    Trả về danh sách đường dẫn tìm thấy theo mã trạng thái (JSON); raw_output=True để nhận log console đầy đủ.
+    """
+    param_list = _dirsearch_params(url, params)
+    client = get_kali_client()
 
     try:
-        response = requests.post(f"{KALI_LISTENER_URL}/execute", json=payload, timeout=610)
-        response.raise_for_status()
+        data = client.run_job("dirsearch", param_list, on_line=make_output_dispatcher("dirsearch"))
+        if data.get("success") and not raw_output:
+            return summarize_dirsearch(client.full_output(data))
+        return client.format_result("Dirsearch", data)
+    except Exception as e:
+        return client.describe_error("Dirsearch", e)
 
-        data = response.json()
-        if data.get("success"):
-            return f"Kết quả quét Dirsearch từ Kali:\n{data.get('output')}"
-        else:
-            return f"Máy Kali báo lỗi khi chạy Dirsearch: {data.get('error_output')}"
+async def _arun_dirsearch_scan(url: str, params: str = "-e php,html,js", raw_output: bool = False) -> str:
+    """Bản bất đồng bộ của _run_dirsearch_scan."""
+    param_list = _dirsearch_params(url, params)
+    client = get_async_kali_client()
 
-    except requests.exceptions.RequestException as e:
-        return f"Lỗi kết nối đến máy Kali Listener: {str(e)}"
+    try:
+        data = await client.run_job("dirsearch", param_list, on_line=make_async_output_dispatcher("dirsearch"))
+        if data.get("success") and not raw_output:
+            return summarize_dirsearch(await client.full_output(data))
+        return client.format_result("Dirsearch", data)
     except Exception as e:
-        return f"Lỗi không xác định: {str(e)}"
+        return client.describe_error("Dirsearch", e)
+
+run_dirsearch_scan = StructuredTool.from_function(func=_run_dirsearch_scan, coroutine=_arun_dirsearch_scan,
+                                                  name="run_dirsearch_scan")
@@ -0,0 +1,490 @@
+# File: core/tools/kali_client.py
+# Client dùng chung cho mọi tool gửi job đến Kali Listener (API /jobs bất đồng bộ).
+# Một KaliClient giữ một requests.Session với connection pool keep-alive, nên các lần gọi tool
+# dùng lại kết nối TCP/TLS thay vì mở kết nối mới mỗi lần.
+# AsyncKaliClient là bản bất đồng bộ (httpx) cho đường ainvoke của tool, để nhiều tool chạy đồng thời.
+
+import os
+import json
+import random
+import threading
+import time
+import asyncio
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+
+load_dotenv()
+
+# Lấy IP của máy KALI từ file .env
+# Nếu không tìm thấy, dùng một IP placeholder (hãy đảm bảo bạn đã đặt nó trong .env)
+KALI_LISTENER_URL = os.getenv("KALI_LISTENER_URL", "http://192.168.1.100:5000")
+
+# --- CẤU HÌNH CLIENT (có thể chỉnh qua .env) ---
+# Timeout kết nối / đọc cho từng HTTP request ngắn (tạo job, hỏi trạng thái), KHÔNG phải thời gian chạy tool
+CONNECT_TIMEOUT = float(os.getenv("KALI_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("KALI_READ_TIMEOUT", "15"))
+# Số kết nối keep-alive tối đa giữ trong pool
+POOL_SIZE = int(os.getenv("KALI_POOL_SIZE", "10"))
+# Số lần thử lại khi lỗi kết nối hoặc 502/503/504 (POST chỉ được thử lại khi chưa gửi được request)
+MAX_RETRIES = int(os.getenv("KALI_MAX_RETRIES", "3"))
+# Khoảng thời gian giữa hai lần hỏi trạng thái job (giây)
+POLL_INTERVAL = 2
+# Thời gian tối đa chờ một job hoàn thành (giây), lớn hơn JOB_TIMEOUT của Listener
+JOB_WAIT_TIMEOUT = 900
+# Số lần thử lại khi Listener trả về 429 (hàng đợi đầy) và thời gian chờ tối đa mỗi lần (giây)
+MAX_BUSY_RETRIES = 5
+MAX_BACKOFF = 60
+# Thời gian tối đa chờ một batch nhiều mục tiêu (/batches) hoàn thành (giây)
+BATCH_WAIT_TIMEOUT = 3600
+# Bật/tắt chế độ stream output từng dòng (SSE) thay cho việc hỏi trạng thái định kỳ
+STREAM_OUTPUT = os.getenv("KALI_STREAM_OUTPUT", "1") != "0"
+# Listener gửi keep-alive mỗi 15 giây, nên read timeout chỉ cần lớn hơn chút
+STREAM_READ_TIMEOUT = 60
+
+# Số byte output tối đa tải về để phân tích khi Listener chỉ trả về phần đầu/cuối (core/tools/parsers.py)
+PARSE_OUTPUT_LIMIT = int(os.getenv("KALI_PARSE_OUTPUT_LIMIT", str(8 * 1024 * 1024)))
+# Kích thước một lần lấy output (bằng MAX_RANGE_BYTES của Listener)
+OUTPUT_CHUNK_BYTES = 1024 * 1024
+
+# Tên custom event mà các tool phát ra cho mỗi dòng output (UI bắt qua callback on_custom_event)
+KALI_OUTPUT_EVENT = "kali_tool_output"
+
+
+class KaliJobTimeout(Exception):
+    """Job không kết thúc trong JOB_WAIT_TIMEOUT giây (job đã được hủy trên Kali)."""
+
+
+class BaseKaliClient:
+    """Phần dùng chung của client đồng bộ và bất đồng bộ: địa chỉ Listener và cách xử lý response/lỗi."""
+
+    def __init__(self, base_url: str = KALI_LISTENER_URL, job_wait_timeout: float = JOB_WAIT_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.job_wait_timeout = job_wait_timeout
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def format_result(self, label: str, data: dict) -> str:
+        """Chuỗi kết quả trả về cho Agent từ dict kết quả job (thành công hoặc tool báo lỗi)."""
+        if data.get("success"):
+            return f"Kết quả quét {label} từ Kali:\n{data.get('output')}{truncation_note(data)}"
+        return (f"Máy Kali báo lỗi khi chạy {label}: {data.get('error_output') or data.get('error')}\n"
+                f"Kết quả (nếu có): {data.get('output')}")
+
+    def describe_error(self, label: str, error: Exception) -> str:
+        """Thông báo lỗi thân thiện cho Agent khi không gọi được Listener (requests hoặc httpx)."""
+        if isinstance(error, KaliJobTimeout):
+            return f"Lỗi: Job {label} trên Kali Listener chưa xong sau {self.job_wait_timeout} giây và đã bị hủy."
+        if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+            return "Lỗi: Yêu cầu đến Kali Listener bị timeout."
+        if isinstance(error, (requests.exceptions.ConnectionError, httpx.TransportError)):
+            return (f"Lỗi kết nối: Không thể kết nối đến Kali Listener tại {self.base_url}. "
+                    "Hãy kiểm tra IP trong .env và đảm bảo Listener (kali_listener.py) đang chạy.")
+        if isinstance(error, (requests.exceptions.RequestException, httpx.HTTPError)):
+            # Các lỗi HTTP khác (403 Forbidden, 429, 500 Internal Server Error từ Flask,...)
+            response = getattr(error, "response", None)
+            response_text = response.text if response is not None else "Không có phản hồi"
+            return f"Lỗi API: {str(error)}\nPhản hồi từ server: {response_text}"
+        return f"Lỗi không xác định khi gọi tool {label}: {str(error)}"
+
+
+class KaliClient(BaseKaliClient):
+    """
+    Client HTTP tới Kali Listener: connection pool keep-alive, timeout và chính sách retry
+    cấu hình ở một chỗ, cùng cách xử lý response/lỗi thống nhất cho mọi tool.
+    """
+
+    def __init__(self, base_url: str = KALI_LISTENER_URL,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 pool_size: int = POOL_SIZE, max_retries: int = MAX_RETRIES,
+                 job_wait_timeout: float = JOB_WAIT_TIMEOUT):
+        super().__init__(base_url, job_wait_timeout)
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            # 429 do _post_with_backoff tự xử lý (có jitter); GET/DELETE an toàn để gửi lại
+            allowed_methods=frozenset({"GET", "DELETE"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # --- HTTP ---
+
+    def _get(self, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.get(self._url(path), **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _post_with_backoff(self, path: str, payload: dict, timeout=None) -> requests.Response:
+        """POST đến Listener, tự thử lại với jittered backoff khi nhận 429 (Listener đang quá tải)."""
+        for attempt in range(MAX_BUSY_RETRIES + 1):
+            response = self.session.post(self._url(path), json=payload, timeout=timeout or self.timeout)
+            if response.status_code != 429 or attempt == MAX_BUSY_RETRIES:
+                break
+            delay = _backoff_delay(response, attempt)
+            print(f"--- [Kali Client] Listener đang quá tải (429), thử lại sau {delay:.1f} giây... ---")
+            time.sleep(delay)
+        response.raise_for_status()
+        return response
+
+    # --- API job ---
+
+    def submit_job(self, tool: str, params: list[str], structured: bool = False) -> dict:
+        """
+        Tạo job trên Kali Listener, trả về ngay thông tin job (có 'job_id').
+        structured=True: Listener trả thêm kết quả có cấu trúc (trường 'structured') nếu tool hỗ trợ.
+        """
+        return self._post_with_backoff("/jobs", {"tool": tool, "params": params, "structured": structured}).json()
+
+    def get_job(self, job_id: str) -> dict:
+        return self._get(f"/jobs/{job_id}").json()
+
+    def cancel_job(self, job_id: str) -> dict:
+        response = self.session.delete(self._url(f"/jobs/{job_id}"), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def wait_for_job(self, job_id: str, timeout: float | None = None) -> dict:
+        """Hỏi trạng thái job định kỳ cho đến khi job kết thúc."""
+        timeout = self.job_wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self.get_job(job_id)
+            if data.get("status") in ("succeeded", "failed", "cancelled"):
+                return data
+            if time.monotonic() >= deadline:
+                try:
+                    self.cancel_job(job_id)
+                except requests.exceptions.RequestException:
+                    pass
+                raise KaliJobTimeout(f"Job {job_id} chưa xong sau {timeout} giây")
+            time.sleep(POLL_INTERVAL)
+
+    def stream_job(self, job_id: str, on_line, timeout: float | None = None) -> dict:
+        """
+        Đọc output của job qua SSE (/jobs/<id>/stream), gọi on_line(stream, line)
+        cho từng dòng, và trả về trạng thái cuối cùng của job.
+        Nếu kết nối stream bị đứt giữa chừng, chuyển sang hỏi trạng thái định kỳ.
+        """
+        timeout = self.job_wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            with self._get(f"/jobs/{job_id}/stream", stream=True,
+                           timeout=(self.timeout[0], STREAM_READ_TIMEOUT)) as response:
+                event = None
+                for raw in response.iter_lines(decode_unicode=True):
+                    if raw.startswith("event:"):
+                        event = raw[len("event:"):].strip()
+                    elif raw.startswith("data:"):
+                        data = json.loads(raw[len("data:"):].strip())
+                        if event == "done":
+                            return data
+                        on_line(data.get("stream"), data.get("line", ""))
+                    if time.monotonic() >= deadline:
+                        break
+        except requests.exceptions.RequestException as e:
+            print(f"--- [Kali Client] Stream job {job_id[:8]} bị gián đoạn ({e}), chuyển sang polling ---")
+        return self.wait_for_job(job_id, timeout=max(deadline - time.monotonic(), 0))
+
+    def fetch_output(self, job_id: str, offset: int = 0, length: int = 64 * 1024, stream: str = "stdout") -> str:
+        """Lấy một khoảng byte của output đã được Listener spool ra đĩa (response được nén gzip)."""
+        response = self._get(f"/jobs/{job_id}/output",
+                             params={"stream": stream, "offset": offset, "length": length})
+        return response.content.decode("utf-8", "replace")
+
+    def full_output(self, data: dict, limit: int = PARSE_OUTPUT_LIMIT) -> str:
+        """
+        Toàn bộ stdout của một job đã xong (tối đa `limit` byte): lấy lại từ spool trên Kali nếu
+        output trong kết quả job đã bị Listener cắt bớt, nếu không lấy được thì dùng output đã có.
+        """
+        if not data.get("output_truncated") or not data.get("job_id"):
+            return data.get("output") or ""
+        try:
+            chunks = []
+            size = min(data.get("output_size") or 0, limit)
+            for offset in range(0, size, OUTPUT_CHUNK_BYTES):
+                response = self._get(f"/jobs/{data['job_id']}/output",
+                                     params={"offset": offset, "length": min(OUTPUT_CHUNK_BYTES, size - offset)})
+                chunks.append(response.content)
+            return b"".join(chunks).decode("utf-8", "replace")
+        except requests.exceptions.RequestException as e:
+            print(f"--- [Kali Client] Không lấy được output đầy đủ của job {data['job_id'][:8]} ({e}) ---")
+            return data.get("output") or ""
+
+    def run_job(self, tool: str, params: list[str], on_line=None, structured: bool = False) -> dict:
+        """
+        Gửi job và chờ kết quả. Trả về dict giống API /execute cũ:
+        {"success": ..., "output": ..., "error_output": ...}
+        Nếu có on_line và STREAM_OUTPUT bật, output được stream từng dòng.
+        """
+        job = self.submit_job(tool, params, structured)
+        print(f"--- [Kali Client] Đã tạo job {job['job_id'][:8]} ({tool}), đang chờ kết quả... ---")
+        if on_line is not None and STREAM_OUTPUT:
+            return self.stream_job(job["job_id"], on_line)
+        return self.wait_for_job(job["job_id"])
+
+    def run_batch(self, tool: str, params: list[str], targets: list[str],
+                  shard_size: int | None = None, max_parallel: int | None = None,
+                  structured: bool = False) -> dict:
+        """
+        Chạy một lệnh trên nhiều mục tiêu: tạo batch qua POST /batches (Listener tự chia shard, chạy song song)
+        rồi hỏi trạng thái định kỳ. Kết quả gộp theo từng host trong 'hosts', trạng thái từng host
+        (up/down/no_result) trong 'host_status'. Quá BATCH_WAIT_TIMEOUT giây thì batch bị hủy.
+        """
+        batch = self._post_with_backoff("/batches", _batch_payload(tool, params, targets, shard_size,
+                                                                   max_parallel, structured)).json()
+        print(f"--- [Kali Client] Đã tạo batch {batch['batch_id'][:8]} ({tool}, {len(targets)} mục tiêu) ---")
+        deadline = time.monotonic() + BATCH_WAIT_TIMEOUT
+        while batch.get("status") not in ("succeeded", "failed", "cancelled"):
+            if time.monotonic() >= deadline:
+                try:
+                    self.session.delete(self._url(f"/batches/{batch['batch_id']}"), timeout=self.timeout)
+                except requests.exceptions.RequestException:
+                    pass
+                raise KaliJobTimeout(f"Batch {batch['batch_id']} chưa xong sau {BATCH_WAIT_TIMEOUT} giây")
+            time.sleep(POLL_INTERVAL)
+            batch = self._get(f"/batches/{batch['batch_id']}").json()
+        return batch
+
+
+class AsyncKaliClient(BaseKaliClient):
+    """
+    Bản bất đồng bộ của KaliClient trên httpx.AsyncClient (cùng API, các hàm là coroutine),
+    dùng trong đường ainvoke của tool để Agent chạy nhiều tool cùng lúc mà không chiếm thread.
+    """
+
+    def __init__(self, base_url: str = KALI_LISTENER_URL,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 pool_size: int = POOL_SIZE, max_retries: int = MAX_RETRIES,
+                 job_wait_timeout: float = JOB_WAIT_TIMEOUT):
+        super().__init__(base_url, job_wait_timeout)
+        self.connect_timeout = connect_timeout
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # httpx chỉ thử lại khi chưa kết nối được, nên an toàn cho cả POST
+        transport = httpx.AsyncHTTPTransport(
+            retries=max_retries,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self.client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    # --- HTTP ---
+
+    async def _get(self, path: str, **kwargs) -> httpx.Response:
+        response = await self.client.get(self._url(path), **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def _post_with_backoff(self, path: str, payload: dict, timeout=None) -> httpx.Response:
+        """POST đến Listener, tự thử lại với jittered backoff khi nhận 429 (Listener đang quá tải)."""
+        for attempt in range(MAX_BUSY_RETRIES + 1):
+            response = await self.client.post(self._url(path), json=payload, timeout=timeout or self.timeout)
+            if response.status_code != 429 or attempt == MAX_BUSY_RETRIES:
+                break
+            delay = _backoff_delay(response, attempt)
+            print(f"--- [Kali Client] Listener đang quá tải (429), thử lại sau {delay:.1f} giây... ---")
+            await asyncio.sleep(delay)
+        response.raise_for_status()
+        return response
+
+    # --- API job ---
+
+    async def submit_job(self, tool: str, params: list[str], structured: bool = False) -> dict:
+        response = await self._post_with_backoff("/jobs", {"tool": tool, "params": params, "structured": structured})
+        return response.json()
+
+    async def get_job(self, job_id: str) -> dict:
+        return (await self._get(f"/jobs/{job_id}")).json()
+
+    async def cancel_job(self, job_id: str) -> dict:
+        response = await self.client.delete(self._url(f"/jobs/{job_id}"))
+        response.raise_for_status()
+        return response.json()
+
+    async def wait_for_job(self, job_id: str, timeout: float | None = None) -> dict:
+        """Hỏi trạng thái job định kỳ cho đến khi job kết thúc."""
+        timeout = self.job_wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            data = await self.get_job(job_id)
+            if data.get("status") in ("succeeded", "failed", "cancelled"):
+                return data
+            if time.monotonic() >= deadline:
+                try:
+                    await self.cancel_job(job_id)
+                except httpx.HTTPError:
+                    pass
+                raise KaliJobTimeout(f"Job {job_id} chưa xong sau {timeout} giây")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def stream_job(self, job_id: str, on_line, timeout: float | None = None) -> dict:
+        """
+        Đọc output của job qua SSE, await on_line(stream, line) cho từng dòng,
+        và trả về trạng thái cuối cùng của job (chuyển sang polling nếu stream bị đứt).
+        """
+        timeout = self.job_wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            async with self.client.stream("GET", self._url(f"/jobs/{job_id}/stream"),
+                                          timeout=httpx.Timeout(STREAM_READ_TIMEOUT, connect=self.connect_timeout)) as response:
+                response.raise_for_status()
+                event = None
+                async for raw in response.aiter_lines():
+                    if raw.startswith("event:"):
+                        event = raw[len("event:"):].strip()
+                    elif raw.startswith("data:"):
+                        data = json.loads(raw[len("data:"):].strip())
+                        if event == "done":
+                            return data
+                        await on_line(data.get("stream"), data.get("line", ""))
+                    if time.monotonic() >= deadline:
+                        break
+        except httpx.HTTPError as e:
+            print(f"--- [Kali Client] Stream job {job_id[:8]} bị gián đoạn ({e}), chuyển sang polling ---")
+        return await self.wait_for_job(job_id, timeout=max(deadline - time.monotonic(), 0))
+
+    async def fetch_output(self, job_id: str, offset: int = 0, length: int = 64 * 1024, stream: str = "stdout") -> str:
+        response = await self._get(f"/jobs/{job_id}/output",
+                                   params={"stream": stream, "offset": offset, "length": length})
+        return response.content.decode("utf-8", "replace")
+
+    async def full_output(self, data: dict, limit: int = PARSE_OUTPUT_LIMIT) -> str:
+        if not data.get("output_truncated") or not data.get("job_id"):
+            return data.get("output") or ""
+        try:
+            chunks = []
+            size = min(data.get("output_size") or 0, limit)
+            for offset in range(0, size, OUTPUT_CHUNK_BYTES):
+                response = await self._get(f"/jobs/{data['job_id']}/output",
+                                           params={"offset": offset, "length": min(OUTPUT_CHUNK_BYTES, size - offset)})
+                chunks.append(response.content)
+            return b"".join(chunks).decode("utf-8", "replace")
+        except httpx.HTTPError as e:
+            print(f"--- [Kali Client] Không lấy được output đầy đủ của job {data['job_id'][:8]} ({e}) ---")
+            return data.get("output") or ""
+
+    async def run_job(self, tool: str, params: list[str], on_line=None, structured: bool = False) -> dict:
+        """Gửi job và chờ kết quả (giống KaliClient.run_job, on_line là coroutine function)."""
+        job = await self.submit_job(tool, params, structured)
+        print(f"--- [Kali Client] Đã tạo job {job['job_id'][:8]} ({tool}), đang chờ kết quả... ---")
+        if on_line is not None and STREAM_OUTPUT:
+            return await self.stream_job(job["job_id"], on_line)
+        return await self.wait_for_job(job["job_id"])
+
+    async def run_batch(self, tool: str, params: list[str], targets: list[str],
+                        shard_size: int | None = None, max_parallel: int | None = None,
+                        structured: bool = False) -> dict:
+        """Tạo batch và chờ kết quả (giống KaliClient.run_batch)."""
+        batch = (await self._post_with_backoff("/batches", _batch_payload(tool, params, targets, shard_size,
+                                                                          max_parallel, structured))).json()
+        print(f"--- [Kali Client] Đã tạo batch {batch['batch_id'][:8]} ({tool}, {len(targets)} mục tiêu) ---")
+        deadline = time.monotonic() + BATCH_WAIT_TIMEOUT
+        while batch.get("status") not in ("succeeded", "failed", "cancelled"):
+            if time.monotonic() >= deadline:
+                try:
+                    await self.client.delete(self._url(f"/batches/{batch['batch_id']}"))
+                except httpx.HTTPError:
+                    pass
+                raise KaliJobTimeout(f"Batch {batch['batch_id']} chưa xong sau {BATCH_WAIT_TIMEOUT} giây")
+            await asyncio.sleep(POLL_INTERVAL)
+            batch = (await self._get(f"/batches/{batch['batch_id']}")).json()
+        return batch
+
+
+def _batch_payload(tool: str, params: list[str], targets: list[str], shard_size: int | None,
+                   max_parallel: int | None, structured: bool) -> dict:
+    payload = {"tool": tool, "params": params, "targets": targets, "structured": structured}
+    if shard_size:
+        payload["shard_size"] = shard_size
+    if max_parallel:
+        payload["max_parallel"] = max_parallel
+    return payload
+
+
+def _backoff_delay(response, attempt: int) -> float:
+    """Thời gian chờ trước lần thử lại: theo Retry-After của Listener, cộng jitter để các client không dồn cùng lúc."""
+    try:
+        retry_after = float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        retry_after = 1
+    return min(retry_after + random.uniform(0, 2 ** attempt), MAX_BACKOFF)
+
+
+def truncation_note(data: dict) -> str:
+    """Ghi chú thêm vào kết quả tool khi Listener chỉ trả về phần đầu/cuối của output."""
+    if not data.get("output_truncated"):
+        return ""
+    return (f"\n\n(Output gốc dài {data.get('output_size')} byte nên chỉ hiển thị phần đầu và cuối; "
+            f"phần còn lại được lưu trên Kali, job_id: {data.get('job_id')})")
+
+
+def make_output_dispatcher(tool: str):
+    """
+    Tạo hàm on_line phát mỗi dòng output thành custom event KALI_OUTPUT_EVENT
+    để app.py / main.py hiển thị tiến trình trực tiếp.
+    Phải được gọi trong thread của tool để LangChain tìm được run cha (qua contextvars).
+    """
+    def on_line(stream, line):
+        try:
+            dispatch_custom_event(KALI_OUTPUT_EVENT, {"tool": tool, "stream": stream, "line": line})
+        except Exception:
+            # Tool được gọi ngoài một run của LangChain (không có callback) -> bỏ qua
+            pass
+    return on_line
+
+
+def make_async_output_dispatcher(tool: str):
+    """Giống make_output_dispatcher nhưng dùng adispatch_custom_event cho đường ainvoke của tool."""
+    async def on_line(stream, line):
+        try:
+            await adispatch_custom_event(KALI_OUTPUT_EVENT, {"tool": tool, "stream": stream, "line": line})
+        except Exception:
+            pass
+    return on_line
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_kali_client() -> KaliClient:
+    """KaliClient dùng chung cho cả process (một connection pool cho mọi tool)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KaliClient()
+        return _client
+
+
+# httpx.AsyncClient gắn với event loop đã tạo ra nó, nên mỗi event loop có một AsyncKaliClient riêng
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_kali_client() -> AsyncKaliClient:
+    """AsyncKaliClient dùng chung trong event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncKaliClient()
+    return client
+
+
+async def close_async_kali_client():
+    """Đóng AsyncKaliClient của event loop hiện tại (gọi trước khi một loop tạm thời như asyncio.run kết thúc)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
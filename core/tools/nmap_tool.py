@@ -1,19 +1,125 @@
 # File: core/tools/nmap_tool.py
 
-import os
-import requests
-from langchain_core.tools import tool
-from dotenv import load_dotenv
+import json
+from langchain_core.tools import StructuredTool
 
-# Tải biến môi trường (để lấy KALI_LISTENER_URL)
-load_dotenv()
+# KALI_LISTENER_URL được đọc từ .env trong kali_client
+from .kali_client import (KALI_LISTENER_URL, get_async_kali_client, get_kali_client,
+                          make_async_output_dispatcher, make_output_dispatcher)
 
-# Lấy IP của máy KALI từ file .env
-# Nếu không tìm thấy, dùng một IP placeholder (hãy đảm bảo bạn đã đặt nó trong .env)
-KALI_LISTENER_URL = os.getenv("KALI_LISTENER_URL", "http://192.168.1.100:5000") 
+# Dòng mở đầu của kết quả có cấu trúc, app.py dựa vào đây để nhận ra và hiển thị thành bảng
+NMAP_JSON_HEADER = "Kết quả quét Nmap từ Kali (JSON):"
 
-@tool
-def run_nmap_scan(target: str, scan_type: str = "basic") -> str:
+def format_structured_result(model: dict) -> str:
+    """Chuỗi JSON gọn (không thụt lề) của mô hình kết quả Nmap để đưa vào context của LLM."""
+    return f"{NMAP_JSON_HEADER}\n{json.dumps(model, ensure_ascii=False, separators=(',', ':'))}"
+
+def extract_structured_result(observation: str) -> dict | None:
+    """Lấy lại mô hình kết quả Nmap từ output của tool (None nếu không phải dạng JSON)."""
+    if not isinstance(observation, str) or not observation.startswith(NMAP_JSON_HEADER):
+        return None
+    try:
+        return json.loads(observation[len(NMAP_JSON_HEADER):])
+    except ValueError:
+        return None
+
+# --- Quét "smart" hai pha ---
+# Pha 1: tìm nhanh các cổng mở trên toàn bộ 65535 cổng (không dò dịch vụ, timing nhanh, tốc độ gói tối thiểu).
+# Pha 2: chỉ chạy -sV/-sC (và script vuln với 'smart_vuln') trên các cổng vừa tìm được.
+SMART_SCAN_TYPES = {"smart": False, "smart_vuln": True}  # scan_type -> có chạy script vuln hay không
+SMART_MIN_RATE = 1000
+SMART_DISCOVERY_FLAGS = ["-p-", "-T4", "--min-rate", str(SMART_MIN_RATE), "--open"]
+
+def build_scan_flags(scan_type: str) -> list[str]:
+    """Các cờ Nmap (chưa gồm mục tiêu) tương ứng với từng scan_type (với 'smart': cờ của pha 1)."""
+    if scan_type in SMART_SCAN_TYPES:
+        return list(SMART_DISCOVERY_FLAGS)
+    elif scan_type == "full":
+        return ["-p-", "-sV", "-sC", "-O"]
+    elif scan_type == "vuln":
+        return ["-sV", "--script", "vuln"]
+    else: # basic (mặc định)
+        return ["-sV", "-p", "1-1000"]
+
+def find_open_ports(model: dict) -> tuple[list[str], list[int]]:
+    """Các host có cổng TCP mở và danh sách (hợp) các cổng mở đó, từ kết quả pha 1."""
+    hosts, ports = [], set()
+    for host in model.get("hosts", []):
+        found = [p["port"] for p in host.get("ports", []) if p.get("state") == "open" and p.get("protocol") == "tcp"]
+        if found:
+            hosts.append(host.get("address"))
+            ports.update(found)
+    return hosts, sorted(ports)
+
+def build_service_flags(ports: list[int], vuln: bool) -> list[str]:
+    """Cờ Nmap của pha 2: dò dịch vụ/script chỉ trên các cổng đã biết là mở."""
+    flags = ["-sV", "-p", ",".join(str(p) for p in ports)]
+    return flags + (["--script", "default,vuln"] if vuln else ["-sC"])
+
+def _smart_phase2(discovery: dict, scan_type: str, label: str):
+    """
+    Từ kết quả pha 1, trả về (host, cờ) cho pha 2, hoặc None nếu không cần chạy pha 2
+    (không đọc được XML của pha 1 hoặc không có cổng mở).
+    """
+    if discovery.get("structured") is None:
+        return None
+    hosts, ports = find_open_ports(discovery["structured"])
+    if not ports:
+        print(f"--- [Tool: {label}] Pha 1 không tìm thấy cổng mở nào, bỏ qua pha 2. ---")
+        return None
+    print(f"--- [Tool: {label}] Pha 1 tìm thấy {len(ports)} cổng mở trên {len(hosts)} host, "
+          f"bắt đầu pha 2 (dò dịch vụ) trên: {','.join(str(p) for p in ports)} ---")
+    return hosts, build_service_flags(ports, SMART_SCAN_TYPES[scan_type])
+
+def _merge_smart_result(discovery: dict, data: dict) -> dict:
+    """Kết quả pha 2 (cùng dạng với các scan_type khác), cộng thêm thời gian của pha 1."""
+    model = data.get("structured")
+    if model is not None and "elapsed" in model and "elapsed" in discovery["structured"]:
+        model["elapsed"] += discovery["structured"]["elapsed"]
+    return data
+
+def _nmap_result(client, data: dict) -> str:
+    """Chuỗi kết quả cho Agent từ dict kết quả job Nmap (ưu tiên mô hình JSON có cấu trúc)."""
+    # Kiểm tra xem 'Tay' (Flask) có báo thành công không
+    if data.get("success"):
+        print("--- [Tool: Nmap] 'Tay' đã thực thi thành công. ---")
+        if data.get("structured") is not None:
+            return format_structured_result(data["structured"])
+    else:
+        # Lỗi do chính tool Nmap báo về (ví dụ: không tìm thấy host)
+        print(f"--- [Tool: Nmap] 'Tay' báo lỗi khi chạy tool: {data.get('error_output')} ---")
+    return client.format_result("Nmap", data)
+
+def _nmap_params(target: str, scan_type: str) -> list[str]:
+    print(f"--- [Tool: Nmap] Nhận lệnh quét '{scan_type}' trên target: {target} ---")
+    print(f"--- [Tool: Nmap] Đang gửi yêu cầu đến 'Tay' tại: {KALI_LISTENER_URL} ---")
+    # Xây dựng các tham số (params) dựa trên scan_type
+    return build_scan_flags(scan_type) + [target]
+
+def _nmap_job(client, target: str, scan_type: str) -> dict:
+    """Chạy job Nmap (hai job liên tiếp với scan_type 'smart'), trả về dict kết quả của job cuối."""
+    on_line = make_output_dispatcher("nmap")
+    # structured=True: Kali chạy nmap với -oX và trả về mô hình JSON thay cho stdout thô
+    data = client.run_job("nmap", _nmap_params(target, scan_type), on_line=on_line, structured=True)
+    if scan_type not in SMART_SCAN_TYPES:
+        return data
+    phase2 = _smart_phase2(data, scan_type, "Nmap")
+    if phase2 is None:
+        return data
+    return _merge_smart_result(data, client.run_job("nmap", phase2[1] + [target], on_line=on_line, structured=True))
+
+async def _anmap_job(client, target: str, scan_type: str) -> dict:
+    """Bản bất đồng bộ của _nmap_job."""
+    on_line = make_async_output_dispatcher("nmap")
+    data = await client.run_job("nmap", _nmap_params(target, scan_type), on_line=on_line, structured=True)
+    if scan_type not in SMART_SCAN_TYPES:
+        return data
+    phase2 = _smart_phase2(data, scan_type, "Nmap")
+    if phase2 is None:
+        return data
+    return _merge_smart_result(data, await client.run_job("nmap", phase2[1] + [target], on_line=on_line, structured=True))
+
+def _run_nmap_scan(target: str, scan_type: str = "basic") -> str:
     """
     Gửi yêu cầu quét Nmap đến máy Kali Listener một cách an toàn.
     AI Agent chỉ cần cung cấp 'target' (mục tiêu) và 'scan_type'.
@@ -24,59 +130,134 @@ def run_nmap_scan(target: str, scan_type: str = "basic") -> str:
             - 'basic': Quét nhanh (-sV, 1000 cổng TCP phổ biến nhất). Đây là mặc định.
             - 'full': Quét toàn diện tất cả 65535 cổng (-p-, -sV, -sC, -O).
             - 'vuln': Quét các script lỗ hổng cơ bản (--script vuln).
+            - 'smart': Quét hai pha: tìm nhanh cổng mở trên toàn bộ 65535 cổng, rồi chỉ chạy -sV -sC
+              trên các cổng mở. Bao phủ như 'full' nhưng nhanh hơn nhiều.
+            - 'smart_vuln': Giống 'smart' nhưng pha 2 chạy thêm các script lỗ hổng (vuln).
             
     Returns:
-        str: Kết quả output thô từ Nmap, hoặc thông báo lỗi.
+        str: Kết quả dạng JSON gọn (host, cổng, trạng thái, dịch vụ, phiên bản, kết quả script),
+             hoặc output thô nếu không đọc được XML, hoặc thông báo lỗi.
     """
     
-    print(f"--- [Tool: Nmap] Nhận lệnh quét '{scan_type}' trên target: {target} ---")
-    print(f"--- [Tool: Nmap] Đang gửi yêu cầu đến 'Tay' tại: {KALI_LISTENER_URL} ---")
+    client = get_kali_client()
 
-    # Xây dựng các tham số (params) dựa trên scan_type
-    if scan_type == "full":
-        params = ["-p-", "-sV", "-sC", "-O", target]
-    elif scan_type == "vuln":
-        params = ["-sV", "--script", "vuln", target]
-    else: # basic (mặc định)
-        params = ["-sV", "-p", "1-1000", target]
+    try:
+        # Tạo job trên máy Kali rồi chờ kết quả (không giữ một HTTP request mở suốt thời gian quét)
+        data = _nmap_job(client, target, scan_type)
+        return _nmap_result(client, data)
 
-    # Dữ liệu để gửi
-    payload = {
-        "tool": "nmap",
-        "params": params
-    }
-    
-    api_endpoint = f"{KALI_LISTENER_URL}/execute"
+    except Exception as e:
+        # Timeout, lỗi kết nối, lỗi HTTP (403, 500,...) hoặc lỗi khác (ví dụ: lỗi JSON decode)
+        print(f"--- [Tool: Nmap] Lỗi: {e} ---")
+        return client.describe_error("Nmap", e)
+
+async def _arun_nmap_scan(target: str, scan_type: str = "basic") -> str:
+    """Bản bất đồng bộ của _run_nmap_scan (dùng khi Agent chạy nhiều tool cùng lúc)."""
+    client = get_async_kali_client()
 
     try:
-        # Gửi request POST đến máy Kali, timeout 610 giây (lớn hơn 10 phút của Kali)
-        response = requests.post(api_endpoint, json=payload, timeout=610) 
-        
-        # Báo lỗi nếu HTTP status không phải 2xx (ví dụ: 403, 500)
-        response.raise_for_status() 
-
-        data = response.json()
-        
-        # Kiểm tra xem 'Tay' (Flask) có báo thành công không
-        if data.get("success"):
-            print("--- [Tool: Nmap] 'Tay' đã thực thi thành công. ---")
-            return f"Kết quả quét Nmap từ Kali:\n{data.get('output')}"
-        else:
-            # Lỗi do chính tool Nmap báo về (ví dụ: không tìm thấy host)
-            print(f"--- [Tool: Nmap] 'Tay' báo lỗi khi chạy tool: {data.get('error_output')} ---")
-            return f"Máy Kali báo lỗi khi chạy Nmap: {data.get('error_output')}\nKết quả (nếu có): {data.get('output')}"
-
-    except requests.exceptions.Timeout:
-        print("--- [Tool: Nmap] Lỗi: Yêu cầu bị Timeout ---")
-        return f"Lỗi: Yêu cầu đến Kali Listener bị timeout (quá 610 giây)."
-    except requests.exceptions.ConnectionError:
-        print("--- [Tool: Nmap] Lỗi: Không kết nối được 'Tay' ---")
-        return f"Lỗi kết nối: Không thể kết nối đến Kali Listener tại {api_endpoint}. Hãy kiểm tra IP trong .env và đảm bảo Listener (kali_listener.py) đang chạy."
-    except requests.exceptions.RequestException as e:
-        # Các lỗi HTTP khác (403 Forbidden, 500 Internal Server Error từ Flask,...)
-        print(f"--- [Tool: Nmap] Lỗi API: {e} ---")
-        return f"Lỗi API: {str(e)}\nPhản hồi từ server: {e.response.text if e.response else 'Không có phản hồi'}"
+        data = await _anmap_job(client, target, scan_type)
+        return _nmap_result(client, data)
+
+    except Exception as e:
+        print(f"--- [Tool: Nmap] Lỗi: {e} ---")
+        return client.describe_error("Nmap", e)
+
+run_nmap_scan = StructuredTool.from_function(func=_run_nmap_scan, coroutine=_arun_nmap_scan, name="run_nmap_scan")
+
+def _nmap_batch_result(data: dict) -> str:
+    """Chuỗi kết quả cho Agent từ kết quả gộp của một batch (/batches)."""
+    host_status = data.get("host_status", {})
+    up_hosts = [host for host, status in host_status.items() if status == "up"]
+    down_hosts = [host for host, status in host_status.items() if status == "down"]
+    failed_targets = [host for host, status in host_status.items() if status == "no_result"]
+    print(f"--- [Tool: Nmap Batch] Nhận kết quả của {len(up_hosts)}/{data.get('target_count')} host "
+          f"({len(down_hosts)} không phản hồi, {len(failed_targets)} không có kết quả). ---")
+
+    if data.get("structured") is not None:
+        model = dict(data["structured"])
+        if down_hosts:
+            model["down_targets"] = down_hosts
+        if failed_targets:
+            model["failed_targets"] = failed_targets
+        return format_structured_result(model)
+
+    result = f"Kết quả quét Nmap từ Kali ({len(up_hosts)} host có phản hồi / {data.get('target_count')} mục tiêu):\n{data.get('output')}"
+    if down_hosts:
+        result += f"\n\nCác mục tiêu không phản hồi: {', '.join(down_hosts)}"
+    if failed_targets:
+        result += f"\n\nCác mục tiêu không có kết quả (lỗi, bị hủy hoặc Kali quá tải): {', '.join(failed_targets)}"
+    return result
+
+def _nmap_batch_targets(targets: str, scan_type: str) -> list[str]:
+    target_list = targets.replace(",", " ").split()
+    print(f"--- [Tool: Nmap Batch] Nhận lệnh quét '{scan_type}' trên {len(target_list)} mục tiêu: {targets} ---")
+    return target_list
+
+def _nmap_batch_job(client, target_list: list[str], scan_type: str) -> dict:
+    """Chạy batch Nmap; với scan_type 'smart', pha 2 chỉ quét các host có cổng mở ở pha 1."""
+    data = client.run_batch("nmap", build_scan_flags(scan_type), target_list, structured=True)
+    if scan_type not in SMART_SCAN_TYPES:
+        return data
+    phase2 = _smart_phase2(data, scan_type, "Nmap Batch")
+    if phase2 is None:
+        return data
+    return _merge_smart_result(data, client.run_batch("nmap", phase2[1], phase2[0], structured=True))
+
+async def _anmap_batch_job(client, target_list: list[str], scan_type: str) -> dict:
+    """Bản bất đồng bộ của _nmap_batch_job."""
+    data = await client.run_batch("nmap", build_scan_flags(scan_type), target_list, structured=True)
+    if scan_type not in SMART_SCAN_TYPES:
+        return data
+    phase2 = _smart_phase2(data, scan_type, "Nmap Batch")
+    if phase2 is None:
+        return data
+    return _merge_smart_result(data, await client.run_batch("nmap", phase2[1], phase2[0], structured=True))
+
+def _run_nmap_batch_scan(targets: str, scan_type: str = "basic") -> str:
+    """
+    Quét Nmap NHIỀU mục tiêu cùng lúc (danh sách host hoặc dải mạng CIDR).
+    Máy Kali sẽ chia mục tiêu thành nhiều phần và quét song song.
+    Dùng tool này thay vì gọi run_nmap_scan nhiều lần khi cần quét cả một mạng.
+
+    Args:
+        targets (str): Danh sách mục tiêu, cách nhau bởi dấu phẩy hoặc khoảng trắng.
+            Ví dụ: "192.168.1.0/24" hoặc "10.0.0.5, 10.0.0.7, scanme.nmap.org".
+        scan_type (str, optional): 'basic' (mặc định), 'full', 'vuln', 'smart' hoặc 'smart_vuln' (giống run_nmap_scan).
+
+    Returns:
+        str: Kết quả Nmap dạng JSON gọn, gộp theo từng host, hoặc thông báo lỗi.
+    """
+
+    target_list = _nmap_batch_targets(targets, scan_type)
+    if not target_list:
+        return "Lỗi: Chưa cung cấp mục tiêu nào để quét."
+
+    client = get_kali_client()
+
+    try:
+        data = _nmap_batch_job(client, target_list, scan_type)
+        return _nmap_batch_result(data)
+
     except Exception as e:
-        # Các lỗi khác (ví dụ: lỗi JSON decode)
-        print(f"--- [Tool: Nmap] Lỗi không xác định: {e} ---")
-        return f"Lỗi không xác định khi gọi tool Nmap: {str(e)}"
\ No newline at end of file
+        print(f"--- [Tool: Nmap Batch] Lỗi: {e} ---")
+        return client.describe_error("Nmap Batch", e)
+
+async def _arun_nmap_batch_scan(targets: str, scan_type: str = "basic") -> str:
+    """Bản bất đồng bộ của _run_nmap_batch_scan."""
+    target_list = _nmap_batch_targets(targets, scan_type)
+    if not target_list:
+        return "Lỗi: Chưa cung cấp mục tiêu nào để quét."
+
+    client = get_async_kali_client()
+
+    try:
+        data = await _anmap_batch_job(client, target_list, scan_type)
+        return _nmap_batch_result(data)
+
+    except Exception as e:
+        print(f"--- [Tool: Nmap Batch] Lỗi: {e} ---")
+        return client.describe_error("Nmap Batch", e)
+
+run_nmap_batch_scan = StructuredTool.from_function(func=_run_nmap_batch_scan, coroutine=_arun_nmap_batch_scan,
+                                                   name="run_nmap_batch_scan")
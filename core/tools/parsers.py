@@ -0,0 +1,177 @@
+# File: core/tools/parsers.py
+# Chuyển output console của SQLMap và Dirsearch thành bản tóm tắt JSON gọn cho Agent:
+# bỏ banner, dòng tiến trình, heuristic lặp lại; chỉ giữ các kết luận (tham số injectable, kỹ thuật,
+# DBMS, database/bảng đã liệt kê; mã trạng thái + đường dẫn tìm thấy).
+
+import json
+import re
+
+# Dòng mở đầu của các bản tóm tắt (giống NMAP_JSON_HEADER trong nmap_tool.py)
+SQLMAP_JSON_HEADER = "Kết quả quét SQLMap từ Kali (JSON):"
+DIRSEARCH_JSON_HEADER = "Kết quả quét Dirsearch từ Kali (JSON):"
+
+# Số mục tối đa của mỗi danh sách trong bản tóm tắt
+MAX_LIST_ITEMS = 100
+
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_LOG_PREFIX_RE = re.compile(r"^\[\d{2}:\d{2}:\d{2}\]\s*\[(\w+)\]\s*")
+
+# --- SQLMap ---
+_SQLMAP_PARAMETER_RE = re.compile(r"^Parameter:\s*(?P<name>.+?)\s*\((?P<place>[^)]+)\)\s*$")
+_SQLMAP_FIELD_RE = re.compile(r"^\s+(?P<key>Type|Title|Payload|Vector):\s*(?P<value>.*)$")
+_SQLMAP_INFO_RE = {
+    "dbms": re.compile(r"^back-end DBMS:\s*(.+)$"),
+    "web_server_os": re.compile(r"^web server operating system:\s*(.+)$"),
+    "web_technology": re.compile(r"^web application technology:\s*(.+)$"),
+    "current_user": re.compile(r"^current user:\s*'?(.+?)'?$"),
+    "current_database": re.compile(r"^current database:\s*'?(.+?)'?$"),
+    "is_dba": re.compile(r"^current user is DBA:\s*(.+)$"),
+}
+_SQLMAP_DATABASES_RE = re.compile(r"^available databases \[\d+\]:$")
+_SQLMAP_TABLES_DB_RE = re.compile(r"^Database:\s*(.+)$")
+_SQLMAP_TABLES_COUNT_RE = re.compile(r"^\[\d+ tables?\]$")
+_SQLMAP_TABLE_ROW_RE = re.compile(r"^\|\s*(.+?)\s*\|$")
+_SQLMAP_NOT_INJECTABLE_RE = re.compile(r"do(es)? not (seem|appear) to be injectable", re.IGNORECASE)
+
+
+def _clean_lines(text: str) -> list[str]:
+    return [_ANSI_RE.sub("", line.rstrip("\r")) for line in (text or "").splitlines()]
+
+
+def parse_sqlmap_output(text: str) -> dict:
+    """
+    Tóm tắt output console của SQLMap:
+    {"injectable": [{"parameter", "place", "techniques": [{"type", "title", "payload"}]}],
+     "dbms", "web_server_os", "web_technology", "current_user", "current_database", "is_dba",
+     "databases": [...], "tables": {db: [...]}, "critical": [...], "warnings": [...]}
+    (chỉ có các khóa tìm thấy trong output).
+    """
+    result = {"injectable": []}
+    lines = _clean_lines(text)
+    parameter = technique = None
+    databases = tables = None
+    in_injection_block = False
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped == "---":
+            # Khối "---" bao quanh danh sách injection point
+            in_injection_block = not in_injection_block
+            parameter = technique = None
+            continue
+
+        if in_injection_block:
+            match = _SQLMAP_PARAMETER_RE.match(stripped)
+            if match:
+                parameter = {"parameter": match["name"], "place": match["place"], "techniques": []}
+                # Một tham số có thể xuất hiện lại khi sqlmap in lại kết quả từ session
+                if not any(p["parameter"] == parameter["parameter"] and p["place"] == parameter["place"]
+                           for p in result["injectable"]):
+                    result["injectable"].append(parameter)
+                continue
+            match = _SQLMAP_FIELD_RE.match(line)
+            if match and parameter is not None:
+                key, value = match["key"].lower(), match["value"].strip()
+                if key == "type":
+                    technique = {"type": value}
+                    if value not in (t["type"] for t in parameter["techniques"]):
+                        parameter["techniques"].append(technique)
+                elif technique is not None:
+                    technique[key] = value
+            continue
+
+        log = _LOG_PREFIX_RE.match(line)
+        if log:
+            level, message = log.group(1).upper(), line[log.end():].strip()
+            if level == "CRITICAL":
+                result.setdefault("critical", []).append(message)
+            elif level == "WARNING" and _SQLMAP_NOT_INJECTABLE_RE.search(message):
+                result.setdefault("warnings", []).append(message)
+            databases = tables = None
+            continue
+
+        for key, pattern in _SQLMAP_INFO_RE.items():
+            match = pattern.match(stripped)
+            if match:
+                result[key] = match.group(1).strip()
+                break
+        else:
+            if _SQLMAP_DATABASES_RE.match(stripped):
+                databases = result.setdefault("databases", [])
+            elif stripped.startswith("[*] ") and databases is not None:
+                if stripped[4:] not in databases:
+                    databases.append(stripped[4:])
+            elif _SQLMAP_TABLES_DB_RE.match(stripped):
+                databases = None
+                tables = result.setdefault("tables", {}).setdefault(_SQLMAP_TABLES_DB_RE.match(stripped).group(1), [])
+            elif tables is not None and _SQLMAP_TABLE_ROW_RE.match(stripped):
+                name = _SQLMAP_TABLE_ROW_RE.match(stripped).group(1)
+                if name not in tables:
+                    tables.append(name)
+            elif not stripped:
+                databases = None
+            elif tables is not None and not (_SQLMAP_TABLES_COUNT_RE.match(stripped) or stripped.startswith("+")):
+                tables = None
+
+    for key in ("critical", "warnings", "databases"):
+        if key in result:
+            result[key] = list(dict.fromkeys(result[key]))[:MAX_LIST_ITEMS]
+    for db, names in result.get("tables", {}).items():
+        result["tables"][db] = names[:MAX_LIST_ITEMS]
+    return result
+
+
+# --- Dirsearch ---
+# vd: "[12:00:00] 301 -  169B  - /js  ->  http://target/js/"
+_DIRSEARCH_LINE_RE = re.compile(
+    r"^\[\d{2}:\d{2}:\d{2}\]\s+(?P<status>\d{3})\s+-\s+(?P<size>\S+)\s+-\s+(?P<path>\S+)"
+    r"(?:\s+->\s+(?P<redirect>\S+))?"
+)
+
+
+def parse_dirsearch_output(text: str) -> dict:
+    """
+    Tóm tắt output console của Dirsearch:
+    {"total": n, "by_status": {"200": n, ...}, "paths": {"200": ["/admin (1KB)", ...], "301": ["/js -> ...", ...]}}
+    """
+    paths: dict[str, list[str]] = {}
+    seen = set()
+    for line in _clean_lines(text):
+        match = _DIRSEARCH_LINE_RE.match(line.strip())
+        if not match or (match["status"], match["path"]) in seen:
+            continue
+        seen.add((match["status"], match["path"]))
+        entry = f"{match['path']} ({match['size']})"
+        if match["redirect"]:
+            entry += f" -> {match['redirect']}"
+        paths.setdefault(match["status"], []).append(entry)
+    return {
+        "total": len(seen),
+        "by_status": {status: len(entries) for status, entries in sorted(paths.items())},
+        "paths": {status: entries[:MAX_LIST_ITEMS] for status, entries in sorted(paths.items())},
+    }
+
+
+def format_summary(header: str, summary: dict, raw_size: int | None = None) -> str:
+    """Chuỗi JSON gọn của bản tóm tắt để đưa vào context của LLM."""
+    note = (f"\n(Đã tóm tắt từ {raw_size} ký tự output gốc; gọi lại tool với raw_output=True "
+            "nếu cần xem log đầy đủ.)" if raw_size else "")
+    return f"{header}\n{json.dumps(summary, ensure_ascii=False, separators=(',', ':'))}{note}"
+
+
+def summarize_sqlmap(output: str) -> str:
+    return format_summary(SQLMAP_JSON_HEADER, parse_sqlmap_output(output), len(output))
+
+
+def summarize_dirsearch(output: str) -> str:
+    return format_summary(DIRSEARCH_JSON_HEADER, parse_dirsearch_output(output), len(output))
+
+
+def extract_summary(header: str, observation: str) -> dict | None:
+    """Lấy lại bản tóm tắt từ output của tool (None nếu không phải dạng JSON)."""
+    if not isinstance(observation, str) or not observation.startswith(header):
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(observation[len(header):].lstrip())[0]
+    except ValueError:
+        return None
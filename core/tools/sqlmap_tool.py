@@ -1,20 +1,32 @@
-# File: core/tools/sqlmap_tool.py (Phiên bản "Làm mát" API)
+# File: core/tools/sqlmap_tool.py
+# Không cần "làm mát" API sau mỗi lần quét nữa: quota Gemini được kiểm soát bởi core/rate_limiter.py
 
-import os
-import requests
-import time  # <<< 1. THÊM IMPORT NÀY
-from langchain_core.tools import tool
-from dotenv import load_dotenv
+from langchain_core.tools import StructuredTool
 from typing import List, Optional
 
-# Tải biến môi trường (để lấy KALI_LISTENER_URL)
-load_dotenv()
+# KALI_LISTENER_URL được đọc từ .env trong kali_client
+from .kali_client import (KALI_LISTENER_URL, get_async_kali_client, get_kali_client,
+                          make_async_output_dispatcher, make_output_dispatcher)
+from .parsers import summarize_sqlmap
 
-# Lấy IP của máy KALI từ file .env
-KALI_LISTENER_URL = os.getenv("KALI_LISTENER_URL", "http://192.168.1.100:5000") 
+def _sqlmap_params(url: str, params: Optional[List[str]]) -> list[str]:
+    print(f"--- [Tool: SQLMap] Nhận lệnh quét trên URL: {url} ---")
+    print(f"--- [Tool: SQLMap] Đang gửi yêu cầu đến 'Pentest Tools' tại: {KALI_LISTENER_URL} ---")
+    
+    # Xây dựng các tham số (params)
+    # Bắt đầu với lệnh cơ bản
+    final_params = ["-u", url]
+    
+    # Thêm các tham số bổ sung nếu AI cung cấp
+    if params:
+        final_params.extend(params)
+        
+    # LUÔN LUÔN thêm "--batch" để đảm bảo tool chạy tự động, không bị treo
+    if "--batch" not in final_params:
+        final_params.append("--batch")
+    return final_params
 
-@tool
-def run_sqlmap_scan(url: str, params: Optional[List[str]] = None) -> str:
+def _run_sqlmap_scan(url: str, params: Optional[List[str]] = None, raw_output: bool = False) -> str:
     """
     Gửi yêu cầu quét SQLMap đến máy Kali Listener một cách an toàn.
     Công cụ sẽ TỰ ĐỘNG thêm cờ '--batch' để chạy không tương tác.
@@ -26,65 +38,53 @@ def run_sqlmap_scan(url: str, params: Optional[List[str]] = None) -> str:
             để truyền cho SQLMap.
             Ví dụ: ["--dbs"] hoặc ["--tables", "-D", "dbname"]
             Nếu không cung cấp, AI sẽ mặc định chạy kiểm tra cơ bản.
+        raw_output (bool, optional): True để nhận log console đầy đủ của SQLMap thay cho bản tóm tắt.
 
     Returns:
-        str: Kết quả output thô từ SQLMap, hoặc thông báo lỗi.
+        str: Bản tóm tắt JSON (tham số injectable, kỹ thuật, DBMS, database/bảng đã liệt kê),
+            log thô nếu raw_output=True, hoặc thông báo lỗi.
     """
     
-    print(f"--- [Tool: SQLMap] Nhận lệnh quét trên URL: {url} ---")
-    print(f"--- [Tool: SQLMap] Đang gửi yêu cầu đến 'Pentest Tools' tại: {KALI_LISTENER_URL} ---")
-    
-    # Xây dựng các tham số (params)
-    # Bắt đầu với lệnh cơ bản
-    final_params = ["-u", url]
-    
-    # Thêm các tham số bổ sung nếu AI cung cấp
-    if params:
-        final_params.extend(params)
+    final_params = _sqlmap_params(url, params)
+    client = get_kali_client()
+
+    try:
+        # Tạo job trên máy Kali rồi chờ kết quả
+        data = client.run_job("sqlmap", final_params, on_line=make_output_dispatcher("sqlmap"))
         
-    # LUÔN LUÔN thêm "--batch" để đảm bảo tool chạy tự động, không bị treo
-    if "--batch" not in final_params:
-        final_params.append("--batch")
+        if data.get("success"):
+            print("--- [Tool: SQLMap] 'Pentest Tools' đã thực thi thành công. ---")
+            if not raw_output:
+                # Agent chỉ cần kết luận, không cần banner / dòng tiến trình của SQLMap
+                return summarize_sqlmap(client.full_output(data))
+        else:
+            # Lỗi do chính tool SQLMap báo về
+            print(f"--- [Tool: SQLMap] 'Pentest Tools' báo lỗi khi chạy tool: {data.get('error_output')} ---")
+        return client.format_result("SQLMap", data)
 
-    # Dữ liệu để gửi
-    payload = {
-        "tool": "sqlmap",
-        "params": final_params
-    }
-    
-    api_endpoint = f"{KALI_LISTENER_URL}/execute"
+    except Exception as e:
+        # Timeout, lỗi kết nối, lỗi HTTP hoặc lỗi khác
+        print(f"--- [Tool: SQLMap] Lỗi: {e} ---")
+        return client.describe_error("SQLMap", e)
+
+async def _arun_sqlmap_scan(url: str, params: Optional[List[str]] = None, raw_output: bool = False) -> str:
+    """Bản bất đồng bộ của _run_sqlmap_scan (dùng khi Agent chạy nhiều tool cùng lúc)."""
+    final_params = _sqlmap_params(url, params)
+    client = get_async_kali_client()
 
     try:
-        # Gửi request POST đến máy Kali, timeout 610 giây
-        response = requests.post(api_endpoint, json=payload, timeout=610) 
-        response.raise_for_status() # Báo lỗi nếu HTTP status không phải 2xx
+        data = await client.run_job("sqlmap", final_params, on_line=make_async_output_dispatcher("sqlmap"))
 
-        data = response.json()
-        
         if data.get("success"):
             print("--- [Tool: SQLMap] 'Pentest Tools' đã thực thi thành công. ---")
-            
-            # <<< 2. THÊM DÒNG NÀY ĐỂ "LÀM MÁT" API TRƯỚC KHI TRẢ VỀ >>>
-            print("--- [Tool: SQLMap] Đang chờ 4 giây để tránh lỗi 429... ---")
-            time.sleep(4) 
-            
-            return f"Kết quả quét SQLMap từ Kali:\n{data.get('output')}"
+            if not raw_output:
+                return summarize_sqlmap(await client.full_output(data))
         else:
-            # Lỗi do chính tool SQLMap báo về
             print(f"--- [Tool: SQLMap] 'Pentest Tools' báo lỗi khi chạy tool: {data.get('error_output')} ---")
-            return f"Máy Kali báo lỗi khi chạy SQLMap: {data.get('error_output')}\nKết quả (nếu có): {data.get('output')}"
+        return client.format_result("SQLMap", data)
 
-    except requests.exceptions.Timeout:
-        print("--- [Tool: SQLMap] Lỗi: Yêu cầu bị Timeout ---")
-        return f"Lỗi: Yêu cầu đến Kali Listener bị timeout (quá 610 giây)."
-    except requests.exceptions.ConnectionError:
-        print("--- [Tool: SQLMap] Lỗi: Không kết nối được 'Kali linux' ---")
-        return f"Lỗi kết nối: Không thể kết nối đến Kali Listener tại {api_endpoint}. Hãy kiểm tra IP trong .env và đảm bảo Listener (kali_listener.py) đang chạy."
-    except requests.exceptions.RequestException as e:
-        # Các lỗi HTTP khác
-        print(f"--- [Tool: SQLMap] Lỗi API: {e} ---")
-        return f"Lỗi API: {str(e)}\nPhản hồi từ server: {e.response.text if e.response else 'Không có phản hồi'}"
     except Exception as e:
-        # Các lỗi khác
-        print(f"--- [Tool: SQLMap] Lỗi không xác định: {e} ---")
-        return f"Lỗi không xác định khi gọi tool SQLMap: {str(e)}"
\ No newline at end of file
+        print(f"--- [Tool: SQLMap] Lỗi: {e} ---")
+        return client.describe_error("SQLMap", e)
+
+run_sqlmap_scan = StructuredTool.from_function(func=_run_sqlmap_scan, coroutine=_arun_sqlmap_scan, name="run_sqlmap_scan")
@@ -0,0 +1,230 @@
+# File: core/tracing.py
+# Đo thời gian từng bước của router bằng một callback handler: bộ phân loại, retrieval FAISS,
+# các bước LLM của full_plan_chain, vòng lặp Agent và thời gian chạy tool trên Kali.
+# Mỗi request (một run gốc) tạo ra một bản ghi JSON: tổng thời gian, thống kê theo bước
+# (thời gian, số lần gọi LLM, token vào/ra, thời gian tool, thời gian retrieval) và danh sách span.
+# Bản ghi được ghi thêm vào TRACE_FILE (JSONL) và giữ trong bộ nhớ để UI hiển thị (get_trace).
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .speculation import SPECULATIVE_RUN_PREFIX
+from .streaming import STEP_TAG_PREFIX
+
+load_dotenv()
+
+# File JSONL nhận các bản ghi trace (đặt TRACE_FILE= rỗng để không ghi ra đĩa)
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(os.path.dirname(__file__), '..', 'traces', 'router.jsonl'))
+# Số trace gần nhất giữ trong bộ nhớ cho get_trace
+TRACE_MEMORY = 100
+# Các run không phải "bước" (as_step) nhưng vẫn được tính là một bước riêng
+STAGE_NAMES = {"intent_classifier", "rag_retrieval"}
+
+
+class _Trace:
+    def __init__(self, user_input):
+        self.user_input = user_input
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: list[dict] = []
+        self.stages: dict[str, dict] = {}
+
+
+class RouterTracer(BaseCallbackHandler):
+    """
+    Callback handler gắn vào chain của router (create_router). Dùng chung cho mọi request:
+    các run được gom theo run gốc, nên nhiều request chạy đồng thời không lẫn vào nhau.
+    """
+
+    run_inline = True
+
+    def __init__(self, path: str | None = TRACE_FILE):
+        self.path = path
+        self.runs: dict[UUID, dict] = {}      # run_id -> thông tin run đang chạy
+        self.traces: dict[UUID, _Trace] = {}  # run gốc -> trace đang ghi
+        self.finished: OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.Lock()
+
+    # --- Quản lý run ---
+
+    def _start(self, kind: str, name: str | None, run_id: UUID, parent_run_id: UUID | None, tags=None, inputs=None):
+        with self.lock:
+            parent = self.runs.get(parent_run_id) if parent_run_id else None
+            if parent is None and parent_run_id is None:
+                root = run_id
+                self.traces[root] = _Trace(inputs.get("user_input") if isinstance(inputs, dict) else None)
+            elif parent is not None:
+                root = parent["root"]
+                trace = self.traces.get(root)
+                if trace is not None and trace.user_input is None and isinstance(inputs, dict):
+                    # Khi stream, input của run gốc chưa có lúc bắt đầu: lấy từ run con đầu tiên
+                    trace.user_input = inputs.get("user_input")
+            else:
+                return  # run con của một run không được theo dõi
+            stage = parent["stage"] if parent else None
+            if kind == "chain" and name and (name in STAGE_NAMES or name.startswith(SPECULATIVE_RUN_PREFIX)
+                                             or STEP_TAG_PREFIX + name in (tags or [])):
+                stage = name
+            self.runs[run_id] = {"root": root, "kind": kind, "name": name, "stage": stage,
+                                 "start": time.perf_counter(), "owns_stage": stage == name and kind == "chain"}
+
+    def _end(self, run_id: UUID, error: BaseException | None = None, **extra):
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+            if run is None:
+                return
+            trace = self.traces.get(run["root"])
+            if trace is None:
+                return
+            end = time.perf_counter()
+            duration = end - run["start"]
+            stage = run["stage"] or ("retrieval" if run["kind"] == "retriever" else None)
+
+            if run["kind"] != "chain" or run["owns_stage"]:
+                span = {"kind": run["kind"], "name": run["name"], "stage": stage,
+                        "start": round(run["start"] - trace.start, 4), "duration": round(duration, 4), **extra}
+                if error is not None:
+                    span["error"] = f"{type(error).__name__}: {error}"
+                trace.spans.append(span)
+            if stage:
+                stats = trace.stages.setdefault(stage, {"duration": 0.0, "llm_calls": 0, "llm_seconds": 0.0,
+                                                        "input_tokens": 0, "output_tokens": 0,
+                                                        "tool_calls": 0, "tool_seconds": 0.0,
+                                                        "retrieval_seconds": 0.0, "documents": 0})
+                if run["owns_stage"] or (run["kind"] == "retriever" and not run["stage"]):
+                    stats["duration"] += duration
+                if run["kind"] == "llm":
+                    stats["llm_calls"] += 1
+                    stats["llm_seconds"] += duration
+                    stats["input_tokens"] += extra.get("input_tokens") or 0
+                    stats["output_tokens"] += extra.get("output_tokens") or 0
+                elif run["kind"] == "tool":
+                    stats["tool_calls"] += 1
+                    stats["tool_seconds"] += duration
+                elif run["kind"] == "retriever":
+                    stats["retrieval_seconds"] += duration
+                    stats["documents"] += extra.get("documents") or 0
+
+            if run_id == run["root"]:
+                record = self._finish(run_id, trace, end, error)
+        if run_id == run["root"]:
+            self._write(record)
+
+    def _finish(self, root: UUID, trace: _Trace, end: float, error: BaseException | None) -> dict:
+        del self.traces[root]
+        record = {
+            "trace_id": str(root),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(trace.started_at)),
+            "user_input": trace.user_input,
+            "total_seconds": round(end - trace.start, 4),
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+            "stages": {name: {key: round(value, 4) if isinstance(value, float) else value
+                              for key, value in stats.items()}
+                       for name, stats in trace.stages.items()},
+            "spans": trace.spans,
+        }
+        self.finished[str(root)] = record
+        while len(self.finished) > TRACE_MEMORY:
+            self.finished.popitem(last=False)
+        return record
+
+    def _write(self, record: dict):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"--- [Tracing] Không ghi được trace vào {self.path}: {e} ---")
+
+    def get_trace(self, run_id) -> dict | None:
+        with self.lock:
+            return self.finished.get(str(run_id))
+
+    # --- Callback của LangChain ---
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start("chain", kwargs.get("name"), run_id, parent_run_id, tags, inputs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start("llm", kwargs.get("name") or (serialized or {}).get("name"), run_id, parent_run_id, tags)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start("llm", kwargs.get("name") or (serialized or {}).get("name"), run_id, parent_run_id, tags)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start("tool", kwargs.get("name") or (serialized or {}).get("name"), run_id, parent_run_id, tags)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._start("retriever", kwargs.get("name") or "retriever", run_id, parent_run_id, tags)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> RouterTracer:
+    """RouterTracer dùng chung (được gắn vào chain trong create_router)."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = RouterTracer()
+        return _tracer
+
+
+def get_trace(run_id) -> dict | None:
+    """Trace của một request đã xong, theo run_id của run gốc (sự kiện "final" của core/streaming.py)."""
+    return get_tracer().get_trace(run_id)
+
+
+def stage_rows(trace: dict) -> list[dict]:
+    """Các dòng của bảng thời gian theo bước (dùng chung cho app.py và main.py), bước chậm nhất trước."""
+    rows = []
+    for name, stats in sorted(trace.get("stages", {}).items(), key=lambda item: -item[1]["duration"]):
+        rows.append({
+            "Bước": name,
+            "Thời gian (s)": round(stats["duration"], 2),
+            "LLM (lần / s)": f"{stats['llm_calls']} / {stats['llm_seconds']:.2f}",
+            "Token vào/ra": f"{stats['input_tokens']} / {stats['output_tokens']}",
+            "Tool (lần / s)": f"{stats['tool_calls']} / {stats['tool_seconds']:.2f}",
+            "Retrieval (s)": round(stats["retrieval_seconds"], 2),
+        })
+    return rows
@@ -0,0 +1,121 @@
+# File: core/warmup.py
+# Khởi động nền cho các tài nguyên nặng: model embedding, FAISS index, centroid của bộ phân loại ý định,
+# LLM client và Agent (create_router). main.py / app.py gọi start_warmup() ngay khi mở để hiện giao diện
+# trước, rồi lấy router bằng get_router() (chờ nếu chưa khởi động xong). get_readiness() cho biết
+# trạng thái hiện tại để UI hiển thị.
+
+import threading
+import time
+
+# Trạng thái khởi động
+COLD, LOADING, READY, FAILED = "cold", "loading", "ready", "failed"
+
+
+class Readiness:
+    """Trạng thái khởi động dùng chung cho cả process (mọi phiên Streamlit cùng đọc một đối tượng)."""
+
+    def __init__(self):
+        self.state = COLD
+        self.stage: str | None = None
+        self.error: BaseException | None = None
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            end = self.finished or time.perf_counter()
+            return {
+                "state": self.state,
+                "stage": self.stage,
+                "error": f"{type(self.error).__name__}: {self.error}" if self.error else None,
+                "elapsed": round(end - self.started, 2) if self.started else 0.0,
+            }
+
+
+_readiness = Readiness()
+_router = None
+
+
+def _warm_intent_classifier():
+    from .intent_classifier import get_intent_classifier
+    classifier = get_intent_classifier()
+    if classifier is not None:
+        classifier.classify("khởi động")  # embed các ví dụ và tính centroid ngay bây giờ
+
+
+def _build_router():
+    global _router
+    from .router import create_router
+    _router = create_router()
+
+
+def _load_embeddings():
+    from .chains.retriever import get_embeddings
+    get_embeddings()
+
+
+def _load_index():
+    from .chains.retriever import get_retriever
+    get_retriever()
+
+
+# Các bước khởi động (tên hiển thị, hàm), theo thứ tự
+WARMUP_STAGES = [
+    ("Model embedding", _load_embeddings),
+    ("FAISS index", _load_index),
+    ("Bộ phân loại ý định", _warm_intent_classifier),
+    ("LLM client và Agent", _build_router),
+]
+
+
+def _run_warmup():
+    readiness = _readiness
+    try:
+        for stage, load in WARMUP_STAGES:
+            with readiness.lock:
+                readiness.stage = stage
+            started = time.perf_counter()
+            load()
+            print(f"--- [Warmup] {stage}: {time.perf_counter() - started:.1f}s ---")
+        with readiness.lock:
+            readiness.state, readiness.stage = READY, None
+    except Exception as e:
+        print(f"--- [Warmup Error] Khởi động thất bại ở bước '{readiness.stage}': {e} ---")
+        with readiness.lock:
+            readiness.state, readiness.error = FAILED, e
+    finally:
+        readiness.finished = time.perf_counter()
+        readiness.done.set()
+
+
+def start_warmup() -> Readiness:
+    """Bắt đầu khởi động trong luồng nền (một lần cho cả process; chạy lại nếu lần trước thất bại)."""
+    readiness = _readiness
+    with readiness.lock:
+        if readiness.state in (LOADING, READY):
+            return readiness
+        readiness.state, readiness.error = LOADING, None
+        readiness.started, readiness.finished = time.perf_counter(), None
+        readiness.done.clear()
+    threading.Thread(target=_run_warmup, name="warmup", daemon=True).start()
+    return readiness
+
+
+def get_readiness() -> Readiness:
+    return _readiness
+
+
+def get_router(timeout: float | None = None):
+    """Router dùng chung; bắt đầu khởi động nếu chưa, rồi chờ xong (lỗi khởi động được ném lại)."""
+    readiness = start_warmup()
+    if not readiness.done.wait(timeout):
+        raise TimeoutError(f"Router chưa khởi động xong sau {timeout}s (đang ở bước: {readiness.stage})")
+    if readiness.state == FAILED:
+        raise RuntimeError(f"Khởi động router thất bại ở bước '{readiness.stage}'") from readiness.error
+    return _router
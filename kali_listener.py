@@ -1,6 +1,17 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+import gzip
+import ipaddress
+import os
+import resource
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
 import json
+import xml.etree.ElementTree as ET
 
 app = Flask(__name__)
 
@@ -11,45 +22,1280 @@ ALLOWED_TOOLS = {
     "dirsearch": "/usr/bin/dirsearch" # Cần kiểm tra đường dẫn
 }
 
-@app.route("/execute", methods=["POST"])
-def execute_command():
-    data = request.json
+def _parse_tool_limits(value, defaults):
+    """Đọc giới hạn theo tool từ chuỗi dạng 'nmap=2,sqlmap=1' (tool không nêu giữ mặc định)."""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        tool, _, limit = item.partition("=")
+        if tool.strip() in ALLOWED_TOOLS and limit.strip().isdigit():
+            limits[tool.strip()] = int(limit)
+    return limits
+
+
+# --- CẤU HÌNH WORKER POOL & ADMISSION CONTROL ---
+# Có thể chỉnh qua biến môi trường khi chạy Listener, ví dụ:
+#   KALI_MAX_WORKERS=6 KALI_TOOL_LIMITS="nmap=3,sqlmap=1" KALI_MAX_QUEUE=20 python kali_listener.py
+# Tổng số tiến trình tool được chạy cùng lúc trên máy Kali
+MAX_WORKERS = int(os.getenv("KALI_MAX_WORKERS", "4"))
+# Giới hạn số tiến trình chạy song song cho từng tool trong ALLOWED_TOOLS
+TOOL_CONCURRENCY = _parse_tool_limits(os.getenv("KALI_TOOL_LIMITS", ""), {
+    "nmap": 2,
+    "sqlmap": 2,
+    "dirsearch": 2
+})
+# Số job tối đa được xếp hàng chờ; vượt quá sẽ trả về 429 kèm Retry-After
+MAX_QUEUE = int(os.getenv("KALI_MAX_QUEUE", "16"))
+DEFAULT_JOB_SECONDS = 60    # Thời gian chạy ước lượng khi chưa có số liệu, dùng để tính Retry-After
+MAX_RETRY_AFTER = 300       # Giá trị Retry-After tối đa (giây)
+JOB_TIMEOUT = 600       # Thời gian chạy tối đa của một job (giây)
+JOB_RETENTION = 3600    # Giữ kết quả job đã xong trong bao lâu (giây)
+CANCEL_GRACE = 5        # Thời gian chờ sau SIGTERM trước khi SIGKILL (giây)
+STREAM_KEEPALIVE = 15   # Gửi comment keep-alive cho client SSE sau mỗi chừng này giây im lặng
+
+# --- CẤU HÌNH CACHE KẾT QUẢ ---
+# TTL (giây) và số kết quả tối đa (LRU) được giữ lại cho từng tool.
+# Chỉ cache các job chạy thành công; client gửi "cache": false để bỏ qua cache.
+CACHE_POLICY = {
+    "nmap": {"ttl": 900, "max_entries": 128},
+    "sqlmap": {"ttl": 1800, "max_entries": 64},
+    "dirsearch": {"ttl": 600, "max_entries": 32}
+}
+
+# --- CẤU HÌNH BATCH (/execute_batch) ---
+BATCH_MAX_TARGETS = 1024    # Số host/URL tối đa sau khi mở rộng CIDR
+BATCH_SHARD_SIZE = 16       # Số host mặc định trong một shard nmap
+BATCH_MAX_PARALLEL = 4      # Số shard mặc định chạy song song trong một batch
+BATCH_SUBMIT_RETRIES = 6    # Số lần một shard thử lại khi hàng đợi đầy (chờ tối đa 5 giây mỗi lần), hết lượt thì bị bỏ
+BATCH_SYNC_WAIT = 300       # /execute_batch chờ tối đa chừng này giây, sau đó trả 202 để hỏi tiếp qua /batches/<id>
+# Cách gắn mục tiêu vào lệnh: nmap nhận nhiều host trong một lệnh, các tool còn lại chỉ nhận một URL (-u)
+MULTI_TARGET_TOOLS = {"nmap"}
+
+# Tool hỗ trợ trả về kết quả có cấu trúc ("structured": true), kèm cờ xuất XML tương ứng
+STRUCTURED_OUTPUT_FLAGS = {"nmap": "-oX"}
+# Giới hạn độ dài output của mỗi NSE script trong kết quả có cấu trúc
+SCRIPT_OUTPUT_LIMIT = 500
+
+# --- CẤU HÌNH SPOOL OUTPUT ---
+# Output của tool được ghi ra đĩa; bộ nhớ chỉ giữ phần đầu/cuối để tóm tắt, nên không phụ thuộc độ dài output
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "kali-spool")
+MAX_SPOOL_BYTES = 50 * 1024 * 1024  # Dung lượng tối đa ghi ra đĩa cho mỗi luồng output của một job
+HEAD_BYTES = 16 * 1024              # Phần đầu output được giữ trong bộ nhớ và trả về trong tóm tắt
+TAIL_BYTES = 16 * 1024              # Phần cuối output được giữ trong bộ nhớ và trả về trong tóm tắt
+MAX_LINE_CHARS = 4096               # Cắt các dòng quá dài khi giữ trong bộ nhớ
+STREAM_BUFFER_LINES = 2000          # Số dòng gần nhất giữ lại cho client đang stream (SSE)
+MAX_RANGE_BYTES = 1024 * 1024       # Kích thước tối đa một lần lấy output qua /jobs/<id>/output
+GZIP_MIN_BYTES = 1024               # Chỉ nén gzip các response lớn hơn ngưỡng này
+
+os.makedirs(SPOOL_DIR, exist_ok=True)
+
+# Trạng thái của một job
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+# Shard của batch không được nhận vì hàng đợi đầy
+REJECTED = "rejected"
+
+# Các luồng output của một job (thứ tự là chỉ số lưu trong Job.line_streams)
+STREAMS = ("stdout", "stderr")
+LINE_NOT_SPOOLED = 2
+
+
+class OutputSpool:
+    """
+    Một luồng output (stdout hoặc stderr) của job: toàn bộ được ghi ra file trên đĩa
+    (tối đa MAX_SPOOL_BYTES), bộ nhớ chỉ giữ HEAD_BYTES đầu và TAIL_BYTES cuối.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.size = 0           # Tổng số byte tool đã ghi ra
+        self.spooled = 0        # Số byte đã ghi xuống đĩa
+        self.head = []
+        self.head_bytes = 0
+        self.tail = deque()
+        self.tail_bytes = 0
+        self.dropped = False    # Có phần giữa bị bỏ khỏi bộ nhớ hay không
+
+    def write(self, line):
+        """Ghi một dòng; trả về True nếu dòng được ghi xuống đĩa (chưa vượt MAX_SPOOL_BYTES)."""
+        data = line.encode("utf-8", "replace")
+        self.size += len(data)
+        spooled = self.spooled + len(data) <= MAX_SPOOL_BYTES
+        if spooled:
+            if self.file is None:
+                self.file = open(self.path, "wb")
+            self.file.write(data)
+            self.spooled += len(data)
+
+        line = line[:MAX_LINE_CHARS]
+        if self.head_bytes < HEAD_BYTES:
+            self.head.append(line)
+            self.head_bytes += len(data)
+        else:
+            self.tail.append(line)
+            self.tail_bytes += len(data)
+            while self.tail_bytes > TAIL_BYTES and len(self.tail) > 1:
+                self.tail_bytes -= len(self.tail.popleft().encode("utf-8", "replace"))
+                self.dropped = True
+        return spooled
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    @property
+    def truncated(self):
+        return self.dropped
+
+    def summary(self):
+        """Toàn bộ output nếu đủ nhỏ, ngược lại là phần đầu + phần cuối kèm ghi chú."""
+        if not self.dropped:
+            return "".join(self.head) + "".join(self.tail)
+        omitted = self.size - self.head_bytes - self.tail_bytes
+        marker = f"\n... [Kali Listener] Đã lược bớt {omitted} byte ở giữa, lấy đầy đủ qua /jobs/<id>/output ...\n"
+        return "".join(self.head) + marker + "".join(self.tail)
+
+    def read(self, offset, length):
+        if self.file is None or offset >= self.spooled:
+            return b""
+        if not self.file.closed:
+            self.file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(min(length, self.spooled - offset))
+
+    def iter_lines(self):
+        """Đọc lại từng dòng đã ghi xuống đĩa (theo thứ tự ghi)."""
+        if self.file is None:
+            return
+        if not self.file.closed:
+            self.file.flush()
+        with open(self.path, "rb") as f:
+            for data in f:
+                yield data.decode("utf-8", "replace")
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Job:
+    """Một lần chạy tool trên máy Kali, được quản lý bởi JobManager."""
+
+    def __init__(self, tool, params, structured=False):
+        self.id = uuid.uuid4().hex
+        self.tool = tool
+        self.params = params
+        self.structured = structured and tool in STRUCTURED_OUTPUT_FLAGS
+        self.key = normalize_command(tool, params, self.structured)
+        # Số client đang chờ job này (tăng khi request giống hệt được gộp vào)
+        self.subscribers = 1
+        # Xây dựng lệnh an toàn (tránh command injection)
+        self.command = [ALLOWED_TOOLS[tool]] + params
+        # Kết quả có cấu trúc: tool ghi XML ra file tạm, stdout vẫn là output dễ đọc để stream
+        self.xml_path = None
+        self.result = None
+        if self.structured:
+            self.xml_path = os.path.join(SPOOL_DIR, f"{self.id}.xml")
+            self.command += [STRUCTURED_OUTPUT_FLAGS[tool], self.xml_path]
+        self.status = QUEUED
+        self.output = ""
+        self.error_output = ""
+        self.returncode = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+        self.spools = {
+            "stdout": OutputSpool(os.path.join(SPOOL_DIR, f"{self.id}.out")),
+            "stderr": OutputSpool(os.path.join(SPOOL_DIR, f"{self.id}.err")),
+        }
+        # Các dòng gần nhất theo thứ tự tool ghi ra: (stream, line), stream là "stdout"/"stderr".
+        # line_count là tổng số dòng, nên dòng đầu tiên trong 'recent' có chỉ số line_count - len(recent).
+        # Khi job kết thúc, 'recent' được giải phóng (None): client đến muộn đọc lại từ file spool.
+        self.recent = deque(maxlen=STREAM_BUFFER_LINES)
+        # Mỗi dòng một byte: chỉ số stream (STREAMS) + LINE_NOT_SPOOLED nếu dòng không được ghi xuống đĩa,
+        # để đọc lại từ 2 file spool đúng thứ tự và đúng chỉ số dòng như lúc stream trực tiếp
+        self.line_streams = bytearray()
+        self.line_count = 0
+        self.cond = threading.Condition()
+
+    def append_line(self, stream, line):
+        with self.cond:
+            spooled = self.spools[stream].write(line)
+            self.line_streams.append(STREAMS.index(stream) | (0 if spooled else LINE_NOT_SPOOLED))
+            if self.recent is not None:
+                self.recent.append((stream, line[:MAX_LINE_CHARS]))
+            self.line_count += 1
+            self.cond.notify_all()
+
+    def iter_lines(self, offset=0):
+        """
+        Sinh ra các lô dòng output mới kể từ vị trí 'offset' cho đến khi job kết thúc.
+        Lô rỗng nghĩa là đã chờ STREAM_KEEPALIVE giây mà chưa có dòng mới.
+        Client đọc chậm hơn STREAM_BUFFER_LINES dòng sẽ bị bỏ qua các dòng cũ (chỉ số nhảy cóc).
+        Sau khi job kết thúc và bộ đệm đã được giải phóng, các dòng còn lại được đọc từ file spool.
+        """
+        while True:
+            with self.cond:
+                if offset >= self.line_count and not self.done.is_set() and self.recent is not None:
+                    self.cond.wait(timeout=STREAM_KEEPALIVE)
+                if self.recent is None:
+                    break
+                first = self.line_count - len(self.recent)
+                offset = max(offset, first)
+                batch = list(self.recent)[offset - first:]
+                finished = self.done.is_set()
+            yield offset, batch
+            offset += len(batch)
+            if finished and not batch:
+                return
+        yield from self._replay(offset)
+
+    def _replay(self, offset):
+        """
+        Các lô dòng liên tiếp từ chỉ số 'offset' của job đã kết thúc, đọc lại từ file spool.
+        Dòng không được ghi xuống đĩa (vượt MAX_SPOOL_BYTES) bị bỏ qua, chỉ số nhảy cóc như khi đọc chậm.
+        """
+        readers = {stream: self.spools[stream].iter_lines() for stream in STREAMS}
+        batch, start = [], offset
+        for index, tag in enumerate(self.line_streams):
+            stream = STREAMS[tag & ~LINE_NOT_SPOOLED]
+            line = None if tag & LINE_NOT_SPOOLED else next(readers[stream], None)
+            if index < offset:
+                continue
+            if line is None or len(batch) >= STREAM_BUFFER_LINES:
+                if batch:
+                    yield start, batch
+                batch = []
+                if line is None:
+                    continue
+            if not batch:
+                start = index
+            batch.append((stream, line[:MAX_LINE_CHARS]))
+        if batch:
+            yield start, batch
+
+    def remove_files(self):
+        for spool in self.spools.values():
+            spool.remove()
+
+    def to_dict(self):
+        finished = self.status in FINISHED_STATES
+        data = {
+            "job_id": self.id,
+            "tool": self.tool,
+            "params": self.params,
+            "status": self.status,
+            "subscribers": self.subscribers,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if finished:
+            data.update({
+                "success": self.status == SUCCEEDED,
+                "returncode": self.returncode,
+                "output": self.output,
+                "error_output": self.error_output,
+                "output_size": self.spools["stdout"].size,
+                "output_truncated": self.spools["stdout"].truncated,
+            })
+            if self.spools["stdout"].truncated or self.spools["stderr"].truncated:
+                # Handle để lấy phần output bị lược bớt theo từng khoảng byte
+                data["output_url"] = f"/jobs/{self.id}/output"
+            if self.error:
+                data["error"] = self.error
+            if self.result is not None:
+                data["structured"] = self.result
+        return data
+
+
+def normalize_command(tool, params, structured=False):
+    """
+    Khóa cache của một lệnh: đúng danh sách tham số được thực thi (không chuẩn hóa khoảng trắng,
+    vì params được chạy nguyên văn: hai lệnh khác nhau không bao giờ dùng chung một kết quả).
+    """
+    return (tool, tuple(params), structured)
+
+
+class ResultCache:
+    """Cache kết quả job thành công theo từng tool, có TTL và loại bỏ theo LRU."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.entries = {tool: OrderedDict() for tool in policy}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        tool = key[0]
+        entries = self.entries.get(tool)
+        if entries is None or key not in entries:
+            self.misses += 1
+            return None
+        expires_at, job = entries[key]
+        if expires_at < time.time():
+            del entries[key]
+            self.misses += 1
+            return None
+        entries.move_to_end(key)
+        self.hits += 1
+        return job
+
+    def put(self, job):
+        policy = self.policy.get(job.tool)
+        if not policy or policy["max_entries"] <= 0:
+            return
+        entries = self.entries[job.tool]
+        entries[job.key] = (time.time() + policy["ttl"], job)
+        entries.move_to_end(job.key)
+        while len(entries) > policy["max_entries"]:
+            entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": {tool: len(entries) for tool, entries in self.entries.items()},
+        }
+
+
+# Các mốc (giây) của histogram thời gian chạy / thời gian chờ trong hàng đợi
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class Histogram:
+    """Histogram tích lũy theo định dạng Prometheus (mỗi bucket đếm các giá trị <= mốc)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self, name, labels):
+        lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.3f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """Số liệu vận hành của Listener, xuất ra dạng text của Prometheus tại /metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs_total = {}        # (tool, status) -> số job đã kết thúc
+        self.submissions = {}       # (tool, source) -> số request theo nguồn (new/cache/inflight)
+        self.rejected = {}          # tool -> số request bị từ chối 429
+        self.output_bytes = {}      # (tool, stream) -> số byte output
+        self.durations = {tool: Histogram(DURATION_BUCKETS) for tool in ALLOWED_TOOLS}
+        self.queue_waits = {tool: Histogram(DURATION_BUCKETS) for tool in ALLOWED_TOOLS}
+
+    def record_submission(self, tool, source):
+        with self.lock:
+            self.submissions[(tool, source)] = self.submissions.get((tool, source), 0) + 1
+
+    def record_rejection(self, tool):
+        with self.lock:
+            self.rejected[tool] = self.rejected.get(tool, 0) + 1
+
+    def record_finished(self, job):
+        with self.lock:
+            key = (job.tool, job.status)
+            self.jobs_total[key] = self.jobs_total.get(key, 0) + 1
+            if job.started_at is not None:
+                self.queue_waits[job.tool].observe(job.started_at - job.created_at)
+                self.durations[job.tool].observe(job.finished_at - job.started_at)
+            for stream, spool in job.spools.items():
+                self.output_bytes[(job.tool, stream)] = self.output_bytes.get((job.tool, stream), 0) + spool.size
+
+    def render(self, stats):
+        """Xuất toàn bộ số liệu; 'stats' là ảnh chụp trạng thái hàng đợi từ JobManager.stats()."""
+        # RUSAGE_CHILDREN: tổng tài nguyên của các tiến trình con (tool) đã kết thúc
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        lines = [
+            "# HELP kali_jobs_total Số job đã kết thúc theo tool và trạng thái.",
+            "# TYPE kali_jobs_total counter",
+        ]
+        with self.lock:
+            lines += [f'kali_jobs_total{{tool="{tool}",status="{status}"}} {n}'
+                      for (tool, status), n in sorted(self.jobs_total.items())]
+            lines += ["# HELP kali_job_requests_total Số request chạy tool theo nguồn kết quả (new, cache, inflight).",
+                      "# TYPE kali_job_requests_total counter"]
+            lines += [f'kali_job_requests_total{{tool="{tool}",source="{source}"}} {n}'
+                      for (tool, source), n in sorted(self.submissions.items())]
+            lines += ["# HELP kali_jobs_rejected_total Số request bị từ chối vì hàng đợi đầy (429).",
+                      "# TYPE kali_jobs_rejected_total counter"]
+            lines += [f'kali_jobs_rejected_total{{tool="{tool}"}} {n}' for tool, n in sorted(self.rejected.items())]
+            lines += ["# HELP kali_job_duration_seconds Thời gian chạy (wall time) của tiến trình tool.",
+                      "# TYPE kali_job_duration_seconds histogram"]
+            for tool, histogram in sorted(self.durations.items()):
+                lines += histogram.render("kali_job_duration_seconds", f'tool="{tool}"')
+            lines += ["# HELP kali_job_queue_wait_seconds Thời gian job chờ trong hàng đợi trước khi chạy.",
+                      "# TYPE kali_job_queue_wait_seconds histogram"]
+            for tool, histogram in sorted(self.queue_waits.items()):
+                lines += histogram.render("kali_job_queue_wait_seconds", f'tool="{tool}"')
+            lines += ["# HELP kali_output_bytes_total Số byte output các tool đã ghi ra.",
+                      "# TYPE kali_output_bytes_total counter"]
+            lines += [f'kali_output_bytes_total{{tool="{tool}",stream="{stream}"}} {n}'
+                      for (tool, stream), n in sorted(self.output_bytes.items())]
+
+        lines += [
+            "# HELP kali_queue_depth Số job đang chờ trong hàng đợi.",
+            "# TYPE kali_queue_depth gauge",
+        ]
+        lines += [f'kali_queue_depth{{tool="{tool}"}} {n}' for tool, n in sorted(stats["queued_by_tool"].items())]
+        lines += [
+            "# HELP kali_queue_capacity Số job tối đa được xếp hàng chờ.",
+            "# TYPE kali_queue_capacity gauge",
+            f"kali_queue_capacity {stats['max_queue']}",
+            "# HELP kali_jobs_running Số tiến trình tool đang chạy.",
+            "# TYPE kali_jobs_running gauge",
+        ]
+        lines += [f'kali_jobs_running{{tool="{tool}"}} {n}' for tool, n in sorted(stats["running"].items())]
+        lines += [
+            "# HELP kali_result_cache_hits_total Số lần lấy kết quả từ cache.",
+            "# TYPE kali_result_cache_hits_total counter",
+            f"kali_result_cache_hits_total {stats['cache']['hits']}",
+            "# HELP kali_child_cpu_seconds_total Thời gian CPU của các tiến trình tool đã kết thúc (resource.getrusage).",
+            "# TYPE kali_child_cpu_seconds_total counter",
+            f'kali_child_cpu_seconds_total{{mode="user"}} {usage.ru_utime:.3f}',
+            f'kali_child_cpu_seconds_total{{mode="system"}} {usage.ru_stime:.3f}',
+            "# HELP kali_child_max_rss_bytes RSS lớn nhất của một tiến trình tool (resource.getrusage).",
+            "# TYPE kali_child_max_rss_bytes gauge",
+            # Trên Linux ru_maxrss tính bằng KB
+            f"kali_child_max_rss_bytes {usage.ru_maxrss * 1024}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class QueueFull(Exception):
+    """Hàng đợi job đã đầy; retry_after là số giây client nên chờ trước khi thử lại."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Hàng đợi đã đầy, thử lại sau {retry_after} giây")
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """
+    Hàng đợi job + worker pool có giới hạn.
+    Job được lấy theo thứ tự FIFO, nhưng chỉ được khởi chạy khi còn slot
+    toàn cục (MAX_WORKERS) và còn slot của riêng tool đó (TOOL_CONCURRENCY).
+    Lệnh giống hệt đã có kết quả trong cache hoặc đang chạy sẽ dùng chung job đó
+    thay vì tạo tiến trình mới (single-flight).
+    """
+
+    def __init__(self, max_workers, tool_limits, cache_policy, max_queue):
+        self.max_workers = max_workers
+        self.tool_limits = tool_limits
+        self.max_queue = max_queue
+        # Thời gian chạy trung bình (EWMA) của từng tool, để ước lượng Retry-After
+        self.avg_runtime = {tool: DEFAULT_JOB_SECONDS for tool in ALLOWED_TOOLS}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kali-job")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.pending = deque()
+        self.running = {tool: 0 for tool in ALLOWED_TOOLS}
+        self.cache = ResultCache(cache_policy)
+        # Job chưa kết thúc theo khóa lệnh, để gộp các request giống hệt
+        self.inflight = {}
+
+    def submit(self, tool, params, use_cache=True, structured=False):
+        """
+        Trả về (job, source), source là:
+        - "cache": kết quả đã có sẵn trong cache
+        - "inflight": gộp vào job giống hệt đang chờ/đang chạy
+        - "new": job mới được đưa vào hàng đợi
+        Ném QueueFull nếu cần tạo job mới nhưng hàng đợi đã đầy.
+        """
+        key = normalize_command(tool, params, structured and tool in STRUCTURED_OUTPUT_FLAGS)
+        with self.lock:
+            self._prune_locked()
+            if use_cache:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.jobs[cached.id] = cached
+                    metrics.record_submission(tool, "cache")
+                    return cached, "cache"
+                inflight = self.inflight.get(key)
+                if inflight is not None:
+                    inflight.subscribers += 1
+                    metrics.record_submission(tool, "inflight")
+                    return inflight, "inflight"
+
+            if len(self.pending) >= self.max_queue:
+                metrics.record_rejection(tool)
+                raise QueueFull(self._retry_after_locked(tool))
+
+            job = Job(tool, params, structured)
+            self.jobs[job.id] = job
+            if use_cache:
+                self.inflight[key] = job
+            self.pending.append(job)
+            self._dispatch_locked()
+        metrics.record_submission(tool, "new")
+        return job, "new"
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            # Job đang được nhiều client dùng chung: chỉ hủy thật khi không còn ai chờ
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return job
+            job.cancel_requested = True
+            if job.status == QUEUED:
+                # Chưa chạy: chỉ cần bỏ khỏi hàng đợi
+                self.pending.remove(job)
+                self._finish_locked(job, CANCELLED)
+                return job
+            process = job.process
+
+        # Đang chạy: dừng tiến trình con, worker sẽ tự đánh dấu CANCELLED
+        if process is not None:
+            _terminate(process)
+        return job
+
+    def free_queue_slots(self):
+        with self.lock:
+            return max(self.max_queue - len(self.pending), 0)
+
+    def retry_after(self, tool):
+        with self.lock:
+            return self._retry_after_locked(tool)
+
+    def _retry_after_locked(self, tool):
+        """Ước lượng thời gian đến khi có chỗ: số job chờ của tool / số slot của tool * thời gian chạy TB."""
+        queued = sum(1 for job in self.pending if job.tool == tool) + 1
+        slots = max(self.tool_limits.get(tool, 1), 1)
+        estimate = self.avg_runtime[tool] * queued / slots
+        return int(min(max(estimate, 1), MAX_RETRY_AFTER))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": len(self.pending),
+                "queued_by_tool": {tool: sum(1 for job in self.pending if job.tool == tool) for tool in ALLOWED_TOOLS},
+                "max_queue": self.max_queue,
+                "running": dict(self.running),
+                "max_workers": self.max_workers,
+                "tool_limits": dict(self.tool_limits),
+                "inflight": len(self.inflight),
+                "cache": self.cache.stats(),
+            }
+
+    def _dispatch_locked(self):
+        """Khởi chạy các job đang chờ nếu còn slot (gọi khi đang giữ lock)."""
+        total_running = sum(self.running.values())
+        for job in list(self.pending):
+            if total_running >= self.max_workers:
+                break
+            if self.running[job.tool] >= self.tool_limits.get(job.tool, 1):
+                continue
+            self.pending.remove(job)
+            self.running[job.tool] += 1
+            total_running += 1
+            job.status = RUNNING
+            job.started_at = time.time()
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        status = FAILED
+        try:
+            print(f"--- [Kali Listener] Job {job.id[:8]} đang chạy lệnh: {' '.join(job.command)} ---")
+            # bufsize=1: đọc theo dòng để stream output ngay khi tool ghi ra
+            process = subprocess.Popen(job.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       text=True, bufsize=1)
+            with self.lock:
+                job.process = process
+                cancel_requested = job.cancel_requested
+            if cancel_requested:
+                _terminate(process)
+
+            readers = [
+                threading.Thread(target=_pump, args=(job, process.stdout, "stdout"), daemon=True),
+                threading.Thread(target=_pump, args=(job, process.stderr, "stderr"), daemon=True),
+            ]
+            for reader in readers:
+                reader.start()
+
+            try:
+                process.wait(timeout=JOB_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                _terminate(process)
+                job.error = f"Tool chạy quá {JOB_TIMEOUT} giây và đã bị dừng"
+            for reader in readers:
+                reader.join()
+
+            with job.cond:
+                for spool in job.spools.values():
+                    spool.close()
+                job.output = job.spools["stdout"].summary()
+                job.error_output = job.spools["stderr"].summary()
+
+            job.returncode = process.returncode
+            if job.xml_path and os.path.exists(job.xml_path):
+                try:
+                    job.result = parse_nmap_xml(job.xml_path)
+                except ET.ParseError as e:
+                    job.error_output += f"\n[Kali Listener] Không đọc được XML của nmap: {e}"
+            if job.cancel_requested:
+                status = CANCELLED
+            elif job.returncode == 0 and not job.error:
+                status = SUCCEEDED
+        except Exception as e:
+            job.error = f"Lỗi server nội bộ: {str(e)}"
+        finally:
+            if job.xml_path and os.path.exists(job.xml_path):
+                os.remove(job.xml_path)
+            with self.lock:
+                self.running[job.tool] -= 1
+                if job.started_at is not None:
+                    runtime = time.time() - job.started_at
+                    self.avg_runtime[job.tool] = 0.8 * self.avg_runtime[job.tool] + 0.2 * runtime
+                self._finish_locked(job, status)
+                self._dispatch_locked()
+            print(f"--- [Kali Listener] Job {job.id[:8]} kết thúc với trạng thái: {status} ---")
+
+    def _finish_locked(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job.process = None
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+        if status == SUCCEEDED:
+            self.cache.put(job)
+        metrics.record_finished(job)
+        with job.cond:
+            job.done.set()
+            job.recent = None  # client đến muộn đọc output từ file spool
+            job.cond.notify_all()
+
+    def _prune_locked(self):
+        """Xóa các job đã xong quá JOB_RETENTION giây để không rò rỉ bộ nhớ."""
+        cutoff = time.time() - JOB_RETENTION
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            self.jobs.pop(job_id).remove_files()
+
+
+def parse_nmap_xml(path):
+    """
+    Đọc file XML của nmap theo kiểu stream (iterparse, giải phóng từng <host>)
+    và trả về mô hình JSON gọn: host, cổng, trạng thái, dịch vụ, phiên bản, kết quả script.
+    """
+    result = {"hosts": []}
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "host":
+            result["hosts"].append(_parse_nmap_host(elem))
+            elem.clear()
+        elif elem.tag == "finished":
+            result["elapsed"] = float(elem.get("elapsed", 0))
+            result["summary"] = elem.get("summary")
+        elif elem.tag == "hosts" and elem.get("up") is not None:
+            result["hosts_up"] = int(elem.get("up", 0))
+            result["hosts_down"] = int(elem.get("down", 0))
+    return result
+
+
+def _parse_nmap_host(host):
+    status = host.find("status")
+    data = {
+        "address": next((a.get("addr") for a in host.findall("address") if a.get("addrtype") != "mac"), None),
+        "hostnames": [h.get("name") for h in host.findall("hostnames/hostname")],
+        "status": status.get("state") if status is not None else None,
+        "ports": [],
+    }
+    for port in host.findall("ports/port"):
+        state = port.find("state")
+        service = port.find("service")
+        entry = {
+            "port": int(port.get("portid")),
+            "protocol": port.get("protocol"),
+            "state": state.get("state") if state is not None else None,
+        }
+        if service is not None:
+            for field, attr in (("service", "name"), ("product", "product"),
+                                ("version", "version"), ("extrainfo", "extrainfo")):
+                if service.get(attr):
+                    entry[field] = service.get(attr)
+        scripts = _parse_nmap_scripts(port)
+        if scripts:
+            entry["scripts"] = scripts
+        data["ports"].append(entry)
+
+    os_match = host.find("os/osmatch")
+    if os_match is not None:
+        data["os"] = {"name": os_match.get("name"), "accuracy": int(os_match.get("accuracy", 0))}
+    host_scripts = _parse_nmap_scripts(host.find("hostscript"))
+    if host_scripts:
+        data["host_scripts"] = host_scripts
+    return {key: value for key, value in data.items() if value not in (None, [])}
+
+
+def _parse_nmap_scripts(parent):
+    if parent is None:
+        return {}
+    return {
+        script.get("id"): (script.get("output") or "").strip()[:SCRIPT_OUTPUT_LIMIT]
+        for script in parent.findall("script")
+    }
+
+
+def _pump(job, pipe, stream):
+    """Đọc từng dòng từ stdout/stderr của tiến trình con và lưu vào job."""
+    with pipe:
+        for line in pipe:
+            job.append_line(stream, line)
+
+
+def _terminate(process):
+    """Gửi SIGTERM, chờ CANCEL_GRACE giây rồi SIGKILL nếu tiến trình chưa thoát."""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=CANCEL_GRACE)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+job_manager = JobManager(MAX_WORKERS, TOOL_CONCURRENCY, CACHE_POLICY, MAX_QUEUE)
+
+
+def _parse_job_request():
+    """
+    Kiểm tra body {"tool": ..., "params": [...], "cache": true, "structured": false}
+    chung cho /execute và /jobs. Trả về (tool, params, options, error_response),
+    options là các tham số từ khóa cho JobManager.submit.
+    """
+    data = request.get_json(silent=True) or {}
     tool = data.get("tool")
     params = data.get("params") # params là một danh sách, ví dụ: ["-sV", "target.com"]
+    options = {
+        "use_cache": data.get("cache", True) is not False,
+        "structured": data.get("structured") is True,
+    }
 
     if not tool or not params:
-        return jsonify({"error": "Thiếu 'tool' hoặc 'params'"}), 400
+        return None, None, options, (jsonify({"error": "Thiếu 'tool' hoặc 'params'"}), 400)
 
     if tool not in ALLOWED_TOOLS:
-        return jsonify({"error": f"Công cụ '{tool}' không được phép"}), 403
+        return None, None, options, (jsonify({"error": f"Công cụ '{tool}' không được phép"}), 403)
 
-    # Xây dựng lệnh an toàn (tránh command injection)
-    command = [ALLOWED_TOOLS[tool]] + params
+    if not isinstance(params, list) or not all(isinstance(p, str) for p in params):
+        return None, None, options, (jsonify({"error": "'params' phải là một danh sách chuỗi"}), 400)
+
+    return tool, params, options, None
+
+
+def _queue_full_response(error):
+    """429 Too Many Requests kèm Retry-After để client lùi lại (backoff) thay vì dồn thêm việc."""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@app.route("/execute", methods=["POST"])
+def execute_command():
+    """
+    API đồng bộ (giữ tương thích ngược): đưa lệnh vào worker pool
+    rồi chờ job kết thúc mới trả về.
+    """
+    tool, params, options, error = _parse_job_request()
+    if error:
+        return error
 
     try:
-        print(f"--- [Kali Listener] Đang chạy lệnh: {' '.join(command)} ---")
-        # Chạy lệnh
-        result = subprocess.run(command, capture_output=True, text=True, timeout=600, check=True)
-
-        # Trả về kết quả thành công
-        return jsonify({
-            "success": True,
-            "tool": tool,
-            "output": result.stdout,
-            "error_output": result.stderr
-        })
-
-    except subprocess.CalledProcessError as e:
-        # Trả về lỗi nếu lệnh thất bại
-         return jsonify({
-            "success": False,
-            "tool": tool,
-            "output": e.stdout,
-            "error_output": e.stderr
-        }), 500
-    except Exception as e:
-        return jsonify({"error": f"Lỗi server nội bộ: {str(e)}"}), 500
+        job, source = job_manager.submit(tool, params, **options)
+    except QueueFull as e:
+        return _queue_full_response(e)
+    job.done.wait()
+
+    result = job.to_dict()
+    result["source"] = source
+    if job.error and job.returncode is None:
+        return jsonify({"error": job.error}), 500
+    return jsonify(result), (200 if result["success"] else 500)
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Tạo job mới và trả về job_id ngay lập tức (202 Accepted).
+    Nếu kết quả đã có trong cache thì trả về luôn (200), trường 'source' cho biết nguồn gốc.
+    """
+    tool, params, options, error = _parse_job_request()
+    if error:
+        return error
+
+    try:
+        job, source = job_manager.submit(tool, params, **options)
+    except QueueFull as e:
+        return _queue_full_response(e)
+    result = job.to_dict()
+    result["source"] = source
+    return jsonify(result), (200 if source == "cache" else 202)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Trả về trạng thái của job, kèm kết quả nếu job đã kết thúc."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Không tìm thấy job '{job_id}'"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Hủy job đang chờ hoặc đang chạy."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Không tìm thấy job '{job_id}'"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/stream", methods=["GET"])
+def stream_job(job_id):
+    """
+    Stream output của job dưới dạng Server-Sent Events:
+    - event 'line': một dòng output {"stream": "stdout"|"stderr", "line": "..."}
+    - event 'done': trạng thái cuối cùng của job (giống GET /jobs/<id>)
+    Client có thể nối lại bằng ?offset=N hoặc header Last-Event-ID.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Không tìm thấy job '{job_id}'"}), 404
+
+    try:
+        last_event_id = request.headers.get("Last-Event-ID")
+        offset = int(last_event_id) + 1 if last_event_id is not None else request.args.get("offset", 0, type=int)
+    except ValueError:
+        offset = 0
+
+    def generate():
+        for start, batch in job.iter_lines(max(offset, 0)):
+            if not batch:
+                yield ": keep-alive\n\n"
+                continue
+            for index, (stream, line) in enumerate(batch, start):
+                payload = json.dumps({"stream": stream, "line": line.rstrip("\n")}, ensure_ascii=False)
+                yield f"id: {index}\nevent: line\ndata: {payload}\n\n"
+        yield f"event: done\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def expand_targets(targets):
+    """
+    Mở rộng danh sách mục tiêu (host, IP, CIDR, URL) thành danh sách host riêng lẻ,
+    bỏ trùng lặp nhưng giữ thứ tự. Ném ValueError nếu mục tiêu không hợp lệ.
+    """
+    expanded = []
+    seen = set()
+    for target in targets:
+        target = target.strip() if isinstance(target, str) else ""
+        # Mục tiêu không được trông giống cờ của tool hay chứa khoảng trắng
+        if not target or target.startswith("-") or any(c.isspace() for c in target):
+            raise ValueError(f"Mục tiêu không hợp lệ: '{target}'")
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            network = None  # Tên miền hoặc URL
+        if network is None:
+            hosts = [target]
+        elif network.num_addresses > BATCH_MAX_TARGETS + 2:
+            raise ValueError(f"Dải '{target}' vượt quá {BATCH_MAX_TARGETS} mục tiêu")
+        elif network.num_addresses > 1:
+            hosts = [str(ip) for ip in network.hosts()]
+        else:
+            hosts = [str(network.network_address)]
+        for host in hosts:
+            if host not in seen:
+                seen.add(host)
+                expanded.append(host)
+            if len(expanded) > BATCH_MAX_TARGETS:
+                raise ValueError(f"Batch vượt quá {BATCH_MAX_TARGETS} mục tiêu")
+    return expanded
+
+
+def split_nmap_report(output):
+    """Tách output nmap thành từng phần theo host ('Nmap scan report for ...')."""
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith("Nmap scan report for "):
+            current = line[len("Nmap scan report for "):].strip()
+            sections[current] = []
+        elif current is not None:
+            if not line.strip() or line.startswith("Nmap done:") or line.startswith("Service detection performed"):
+                continue
+            sections[current].append(line)
+    return {host: "\n".join(lines) for host, lines in sections.items()}
+
+
+def match_nmap_sections(sections, hosts):
+    """
+    Gán các phần của split_nmap_report về đúng mục tiêu đã yêu cầu: nmap ghi 'tên (ip)' cho tên miền
+    và có thể ghi 'rdns (ip)' cho IP, nên khớp theo tên hoặc theo IP trong ngoặc.
+    """
+    matched = {}
+    for key, section in sections.items():
+        name, _, ip = key.partition(" (")
+        ip = ip.rstrip(")")
+        host = name if name in hosts else ip if ip in hosts else key
+        matched[host] = section
+    return matched
+
+
+class Batch:
+    """
+    Một lệnh trên nhiều mục tiêu: danh sách mục tiêu được chia thành shard, mỗi shard là một job
+    trong worker pool, tối đa 'max_parallel' shard chạy cùng lúc. Chạy nền trong BatchManager;
+    to_dict() gộp kết quả theo từng host (cả khi batch chưa xong).
+    """
+
+    def __init__(self, tool, params, hosts, shard_size, max_parallel, use_cache=True, structured=False):
+        self.id = uuid.uuid4().hex
+        self.tool = tool
+        self.params = params
+        self.hosts = hosts
+        self.use_cache = use_cache
+        self.structured = structured
+        if tool not in MULTI_TARGET_TOOLS:
+            shard_size = 1
+        self.shards = [hosts[i:i + shard_size] for i in range(0, len(hosts), shard_size)]
+        self.max_parallel = min(max_parallel, len(self.shards))
+        # Mỗi shard: (job, source) sau khi được nhận, hoặc (None, REJECTED/CANCELLED) nếu không chạy được
+        self.shard_jobs = [None] * len(self.shards)
+        self.retry_after = 0
+        self.status = RUNNING
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    def _run_shard(self, index):
+        shard = self.shards[index]
+        shard_params = self.params + shard if self.tool in MULTI_TARGET_TOOLS else self.params + ["-u", shard[0]]
+        for attempt in range(BATCH_SUBMIT_RETRIES + 1):
+            if self.cancel_requested:
+                self.shard_jobs[index] = (None, CANCELLED)
+                return
+            try:
+                self.shard_jobs[index] = job_manager.submit(self.tool, shard_params, self.use_cache, self.structured)
+                break
+            except QueueFull as e:
+                # Batch đã được nhận: shard chờ đến lượt một số lần có giới hạn, hết lượt thì bị bỏ
+                self.retry_after = max(self.retry_after, e.retry_after)
+                if attempt == BATCH_SUBMIT_RETRIES:
+                    self.shard_jobs[index] = (None, REJECTED)
+                    return
+                time.sleep(min(e.retry_after, 5))
+        if self.cancel_requested:
+            job_manager.cancel(self.shard_jobs[index][0].id)
+        self.shard_jobs[index][0].done.wait()
+
+    def run(self):
+        print(f"--- [Kali Listener] Batch {self.id[:8]} {self.tool}: {len(self.hosts)} mục tiêu, "
+              f"{len(self.shards)} shard, song song {self.max_parallel} ---")
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="kali-batch") as pool:
+                list(pool.map(self._run_shard, range(len(self.shards))))
+        finally:
+            statuses = {self._shard_status(i) for i in range(len(self.shards))}
+            self.status = (CANCELLED if self.cancel_requested
+                           else SUCCEEDED if statuses == {SUCCEEDED} else FAILED)
+            self.finished_at = time.time()
+            self.done.set()
+            print(f"--- [Kali Listener] Batch {self.id[:8]} kết thúc với trạng thái: {self.status} ---")
+
+    def cancel(self):
+        """Hủy các shard chưa chạy và bỏ đăng ký khỏi các job shard đang chạy."""
+        self.cancel_requested = True
+        for entry in list(self.shard_jobs):
+            if entry is not None and entry[0] is not None:
+                job_manager.cancel(entry[0].id)
+
+    def _shard_status(self, index):
+        entry = self.shard_jobs[index]
+        if entry is None:
+            return QUEUED
+        job, source = entry
+        return source if job is None else job.status
+
+    def to_dict(self):
+        """
+        Kết quả gộp theo host. Mọi mục tiêu đều có mặt trong 'hosts' và 'host_status':
+        "up" (có kết quả), "down" (shard xong nhưng nmap không báo cáo host), "no_result" (shard lỗi,
+        bị hủy hoặc bị từ chối vì hàng đợi đầy), "pending" (shard chưa xong).
+        """
+        results = {}
+        host_status = {}
+        structured_hosts = []
+        shard_summaries = []
+        for index, shard in enumerate(self.shards):
+            status = self._shard_status(index)
+            job, source = self.shard_jobs[index] or (None, None)
+            summary = {"targets": shard, "status": status, "job_id": job.id if job else None, "source": source}
+            finished = job is not None and job.status in FINISHED_STATES
+            if finished:
+                summary["error_output"] = job.error_output
+                if job.result is not None:
+                    structured_hosts.extend(job.result.get("hosts", []))
+                if self.tool in MULTI_TARGET_TOOLS:
+                    results.update(match_nmap_sections(split_nmap_report(job.output), set(shard)))
+                else:
+                    results[shard[0]] = job.output
+            elif status == REJECTED:
+                summary["retry_after"] = self.retry_after
+            shard_summaries.append(summary)
+
+            for host in shard:
+                if host in results and (status == SUCCEEDED or self.tool in MULTI_TARGET_TOOLS):
+                    host_status[host] = "up"
+                elif status == SUCCEEDED:
+                    host_status[host] = "down"
+                    results[host] = "[Kali Listener] Host không phản hồi (nmap không báo cáo host này)"
+                elif status in (QUEUED, RUNNING):
+                    host_status[host] = "pending"
+                else:
+                    host_status[host] = "no_result"
+                    results[host] = f"[Kali Listener] Không có kết quả (shard: {status})"
+
+        merged_output = "\n\n".join(f"===== {host} =====\n{section}" for host, section in results.items())
+        response = {
+            "batch_id": self.id,
+            "status": self.status,
+            "success": self.status == SUCCEEDED,
+            "partial": self.status != RUNNING and "no_result" in host_status.values(),
+            "tool": self.tool,
+            "target_count": len(self.hosts),
+            "hosts": results,
+            "host_status": host_status,
+            "shards": shard_summaries,
+            "output": merged_output,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.structured:
+            response["structured"] = {"hosts": structured_hosts}
+        return response
+
+    def all_rejected(self):
+        return all(self._shard_status(i) == REJECTED for i in range(len(self.shards)))
+
+
+class BatchManager:
+    """Các batch đang chạy/đã xong (giữ JOB_RETENTION giây như job), mỗi batch chạy trong một thread nền."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def start(self, batch):
+        with self.lock:
+            cutoff = time.time() - JOB_RETENTION
+            for batch_id in [b.id for b in self.batches.values() if b.finished_at and b.finished_at < cutoff]:
+                del self.batches[batch_id]
+            self.batches[batch.id] = batch
+        threading.Thread(target=batch.run, name=f"kali-batch-{batch.id[:8]}", daemon=True).start()
+        return batch
+
+    def get(self, batch_id):
+        with self.lock:
+            return self.batches.get(batch_id)
+
+
+batch_manager = BatchManager()
+
+
+def _parse_batch_request():
+    """
+    Kiểm tra body của /execute_batch và POST /batches:
+    {"tool": "nmap", "params": ["-sV"], "targets": ["10.0.0.0/28", "scanme.nmap.org"],
+     "shard_size": 16, "max_parallel": 4, "cache": true, "structured": false}
+    Trả về (batch, error_response).
+    """
+    data = request.get_json(silent=True) or {}
+    tool = data.get("tool")
+    params = data.get("params", [])
+    targets = data.get("targets")
+
+    if not tool or not targets:
+        return None, (jsonify({"error": "Thiếu 'tool' hoặc 'targets'"}), 400)
+    if tool not in ALLOWED_TOOLS:
+        return None, (jsonify({"error": f"Công cụ '{tool}' không được phép"}), 403)
+    if not isinstance(params, list) or not all(isinstance(p, str) for p in params):
+        return None, (jsonify({"error": "'params' phải là một danh sách chuỗi"}), 400)
+    if isinstance(targets, str):
+        targets = targets.replace(",", " ").split()
+
+    try:
+        hosts = expand_targets(targets)
+        shard_size = max(1, int(data.get("shard_size", BATCH_SHARD_SIZE)))
+        max_parallel = max(1, min(int(data.get("max_parallel", BATCH_MAX_PARALLEL)), MAX_WORKERS))
+    except (TypeError, ValueError) as e:
+        return None, (jsonify({"error": str(e)}), 400)
+
+    batch = Batch(tool, params, hosts, shard_size, max_parallel,
+                  use_cache=data.get("cache", True) is not False, structured=data.get("structured") is True)
+    # Batch chỉ được nhận khi hàng đợi còn đủ chỗ cho các shard chạy song song đầu tiên
+    if job_manager.free_queue_slots() < batch.max_parallel:
+        return None, _queue_full_response(QueueFull(job_manager.retry_after(tool)))
+    return batch, None
+
+
+@app.route("/batches", methods=["POST"])
+def create_batch():
+    """
+    Tạo batch và trả về batch_id ngay lập tức (202 Accepted); hỏi tiến độ/kết quả qua GET /batches/<id>.
+    Body giống /execute_batch. Đây là cách nên dùng cho các batch lớn.
+    """
+    batch, error = _parse_batch_request()
+    if error:
+        return error
+    batch_manager.start(batch)
+    return jsonify(batch.to_dict()), 202
+
+
+@app.route("/batches/<batch_id>", methods=["GET"])
+def get_batch(batch_id):
+    """Trạng thái của batch và kết quả gộp theo host (một phần nếu batch chưa xong)."""
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        return jsonify({"error": f"Không tìm thấy batch '{batch_id}'"}), 404
+    return jsonify(batch.to_dict())
+
+
+@app.route("/batches/<batch_id>", methods=["DELETE"])
+def cancel_batch(batch_id):
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        return jsonify({"error": f"Không tìm thấy batch '{batch_id}'"}), 404
+    batch.cancel()
+    return jsonify(batch.to_dict())
+
+
+@app.route("/execute_batch", methods=["POST"])
+def execute_batch():
+    """
+    API đồng bộ (giữ tương thích ngược) của POST /batches: chờ batch xong tối đa BATCH_SYNC_WAIT giây.
+    - 200: batch đã xong (kể cả khi chỉ có kết quả một phần, xem 'partial' và 'host_status')
+    - 202: chưa xong, client hỏi tiếp qua GET /batches/<batch_id>
+    - 429: không shard nào được nhận vì hàng đợi đầy
+    """
+    batch, error = _parse_batch_request()
+    if error:
+        return error
+    batch_manager.start(batch)
+    if not batch.done.wait(BATCH_SYNC_WAIT):
+        return jsonify(batch.to_dict()), 202
+    if batch.all_rejected():
+        return _queue_full_response(QueueFull(batch.retry_after))
+    return jsonify(batch.to_dict())
+
+
+@app.route("/jobs/<job_id>/output", methods=["GET"])
+def get_job_output(job_id):
+    """
+    Lấy một khoảng byte của output đã spool ra đĩa:
+    ?stream=stdout|stderr&offset=0&length=65536, hoặc header 'Range: bytes=a-b'.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Không tìm thấy job '{job_id}'"}), 404
+
+    stream = request.args.get("stream", "stdout")
+    if stream not in job.spools:
+        return jsonify({"error": "'stream' phải là 'stdout' hoặc 'stderr'"}), 400
+    spool = job.spools[stream]
+
+    offset = request.args.get("offset", 0, type=int)
+    length = request.args.get("length", MAX_RANGE_BYTES, type=int)
+    range_header = request.headers.get("Range", "")
+    if range_header.startswith("bytes="):
+        try:
+            start, _, end = range_header[len("bytes="):].partition("-")
+            offset = int(start)
+            length = int(end) - offset + 1 if end else MAX_RANGE_BYTES
+        except ValueError:
+            return jsonify({"error": f"Header Range không hợp lệ: '{range_header}'"}), 416
+    if offset < 0 or length <= 0:
+        return jsonify({"error": "'offset' phải >= 0 và 'length' phải > 0"}), 400
+
+    with job.cond:
+        data = spool.read(offset, min(length, MAX_RANGE_BYTES))
+    # 206 chỉ khi client dùng header Range; request theo query string nhận 200 và được nén gzip
+    response = Response(data, status=206 if range_header else 200, mimetype="text/plain")
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/{spool.spooled}" if data else f"bytes */{spool.spooled}"
+    response.headers["X-Output-Size"] = str(spool.size)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Nén gzip các response lớn nếu client hỗ trợ. Bỏ qua stream SSE và response Range (206 / Content-Range):
+    Content-Range tính theo byte chưa nén, nén lại sẽ làm sai khoảng byte mà client ghép nối.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+            or "Content-Encoding" in response.headers
+            or response.status_code == 206 or "Content-Range" in response.headers
+            or not 200 <= response.status_code < 300):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Số liệu job/hàng đợi/tiến trình con theo định dạng text của Prometheus."""
+    return Response(metrics.render(job_manager.stats()), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    """Thống kê nhanh tình trạng worker pool."""
+    return jsonify(job_manager.stats())
+
 
 if __name__ == '__main__':
     # Chạy server trên tất cả các IP của máy Kali, port 5000
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # threaded=True để mỗi request có thread riêng; tắt reloader để không tạo 2 worker pool
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True, use_reloader=False)
@@ -1,77 +1,162 @@
 # File: main.py (Phiên bản A+ hoàn chỉnh, hiển thị kết quả RAG)
+# Các module core (model embedding, FAISS, LLM, Agent) được import/khởi động sau khi đọc tham số dòng lệnh
+# và trong luồng nền (core/warmup.py), nên `python main.py --help` và lời chào hiện ra ngay.
 
-from core.router import create_router
-from langchain_core.messages import AIMessage
+import argparse
+import os
 
 # Import các thành phần cần thiết từ thư viện rich
-from rich.console import Console
+from rich.console import Console, Group
+from rich.live import Live
 from rich.panel import Panel
 from rich.markdown import Markdown
 from rich.prompt import Prompt
+from rich.spinner import Spinner
+from rich.table import Table
 from rich.text import Text
 from rich.padding import Padding
 
 # --- KHỞI TẠO CÁC ĐỐI TƯỢNG GIAO DIỆN ---
 console = Console()
-agent_chain = create_router()
+
+# Tiêu đề Panel cho từng bước được stream (tên bước -> tiêu đề)
+STEP_TITLES = {
+    "recon_results": "BƯỚC 1: KẾT QUẢ THU THẬP THÔNG TIN",
+    "analysis_results": "BƯỚC 2: KẾT QUẢ PHÂN TÍCH LỖ HỔNG",
+    "exploitation_results": "BƯỚC 3: KẾT QUẢ LÊN KẾ HOẠCH KHAI THÁC",
+    "actionable_intelligence": "BƯỚC 4: PAYLOAD & HƯỚNG DẪN CHI TIẾT (TỪ RAG)",
+    "rag_answer": "🤖 Phản hồi từ Cyber-Mentor",
+    "agent": "🤖 Phản hồi từ Cyber-Mentor",
+}
+# Các bước là câu trả lời cuối cùng (viền xanh lá)
+FINAL_STEPS = {"actionable_intelligence", "rag_answer", "agent"}
+
+
+def output_text(output) -> str:
+    """Nội dung hiển thị của kết quả một bước (AIMessage, dict của Agent hoặc chuỗi)."""
+    from langchain_core.messages import AIMessage
+
+    if isinstance(output, AIMessage):
+        return output.content
+    if isinstance(output, dict) and "output" in output:
+        return str(output["output"])
+    return "" if output is None else str(output)
+
+
+def step_panel(step: str, text: str, streaming: bool = False) -> Panel:
+    color = "green" if step in FINAL_STEPS else "cyan"
+    title = STEP_TITLES[step] + (" ⏳" if streaming else "")
+    return Panel(
+        Padding(Markdown(text), (1, 2)),
+        title=f"[bold {color}]{title}[/bold {color}]",
+        border_style=color,
+        title_align="left"
+    )
+
+
+def trace_panel(trace: dict) -> Panel:
+    """Bảng thời gian xử lý theo từng bước của request (core/tracing.py)."""
+    from core.tracing import stage_rows
+
+    rows = stage_rows(trace)
+    table = Table(show_edge=False, header_style="bold magenta")
+    for column in rows[0] if rows else ["Bước"]:
+        table.add_column(column, justify="left" if column == "Bước" else "right")
+    for row in rows:
+        table.add_row(*(str(value) for value in row.values()))
+    return Panel(
+        table,
+        title=f"[bold magenta]⏱️ PHÂN TÍCH THỜI GIAN ({trace['total_seconds']:.2f}s)[/bold magenta]",
+        border_style="magenta",
+        title_align="left"
+    )
+
+
+def wait_for_router():
+    """Router đã khởi động xong (core/warmup.py); nếu chưa, hiện bước khởi động hiện tại trong lúc chờ."""
+    from core.warmup import get_router, start_warmup
+
+    readiness = start_warmup()  # không làm gì nếu đã khởi động (hoặc đang khởi động)
+    if not readiness.ready:
+        with Live(console=console, refresh_per_second=4, transient=True) as live:
+            while not readiness.done.wait(0.25):
+                snapshot = readiness.snapshot()
+                live.update(Spinner("dots8", text=f"[bold yellow]Đang khởi động: {snapshot['stage']} "
+                                                  f"({snapshot['elapsed']:.0f}s)..."))
+    return get_router()
+
 
 # --- HÀM CHÍNH ĐỂ CHẠY AGENT ---
 def run_agent(user_input: str):
-    with console.status("[bold cyan]Cyber-Mentor đang phân tích...", spinner="dots8"):
-        response = agent_chain.invoke({"user_input": user_input})
+    """Chạy router ở chế độ stream: token của từng bước hiện ngay trong Panel của bước đó."""
+    from core.streaming import stream_events
+    from core.tracing import get_trace
+
+    agent_chain = wait_for_router()
+    status = Spinner("dots8", text="[bold cyan]Cyber-Mentor đang phân tích...")
+    streaming = {}  # bước đang stream -> nội dung đã nhận
+    response, run_id, shown = None, None, False
 
     console.print()
+    with Live(status, console=console, refresh_per_second=8, transient=True) as live:
+        for event in stream_events(agent_chain, {"user_input": user_input}):
+            kind = event["type"]
+            if kind == "token" and event["step"] in STEP_TITLES:
+                streaming[event["step"]] = streaming.get(event["step"], "") + event["text"]
+            elif kind == "step_end" and event["step"] in STEP_TITLES:
+                streaming.pop(event["step"], None)
+                text = output_text(event["output"])
+                if text:
+                    # In Panel hoàn chỉnh phía trên vùng Live
+                    live.console.print(step_panel(event["step"], text))
+                    shown = True
+            elif kind == "tool_output":
+                # Output của tool (Nmap, SQLMap...) ngay khi máy Kali ghi ra
+                style = "dim red" if event.get("stream") == "stderr" else "dim"
+                live.console.print(Text(f"[{event.get('tool')}] {event.get('line', '')}", style=style))
+            elif kind == "final":
+                response, run_id = event["output"], event["run_id"]
+
+            live.update(Group(*(step_panel(step, text, streaming=True) for step, text in streaming.items()), status)
+                        if streaming else status)
 
-    if isinstance(response, dict) and 'final_report' in response:
-        console.print(Panel("[bold yellow]🔎 ĐANG QUAN SÁT CHUỖI TƯ DUY CỦA AI 🔎[/bold yellow]", border_style="yellow", expand=False))
-
-        # Hiển thị kết quả của từng bước trung gian
-        steps = {
-            "BƯỚC 1: KẾT QUẢ THU THẬP THÔNG TIN": response.get("recon_results"),
-            "BƯỚC 2: KẾT QUẢ PHÂN TÍCH LỖ HỔNG": response.get("analysis_results"),
-            "BƯỚC 3: KẾT QUẢ LÊN KẾ HOẠCH KHAI THÁC": response.get("exploitation_results"),
-            "BƯỚC 4: KẾT QUẢ HẬU KHAI THÁC & BÁO CÁO": response.get("post_exploitation_results"),
-            # <<< THÊM BƯỚC MỚI Ở ĐÂY >>>
-            "BƯỚC 5: PAYLOAD & HƯỚNG DẪN CHI TIẾT (TỪ RAG)": response.get("actionable_intelligence"),
-        }
-
-        for title, content in steps.items():
-            if content and isinstance(content, AIMessage):
-                panel = Panel(
-                    Padding(Markdown(content.content), (1, 2)),
-                    title=f"[bold cyan]{title}[/bold cyan]",
-                    border_style="cyan",
-                    title_align="left"
-                )
-                console.print(panel)
-
-        # Cuối cùng, hiển thị báo cáo tổng hợp
-        final_report_content = response['final_report'].content if isinstance(response['final_report'], AIMessage) else str(response['final_report'])
-        final_panel = Panel(
-            Markdown(final_report_content),
-            title="[bold green]✅ BÁO CÁO TỔNG HỢP CUỐI CÙNG ✅[/bold green]",
-            border_style="green",
-            title_align="left"
-        )
-        console.print(final_panel)
-
-    elif isinstance(response, AIMessage):
-        response_panel = Panel(
-            Markdown(response.content),
-            title="[bold green]🤖 Phản hồi từ Cyber-Mentor[/bold green]",
-            border_style="green",
-            title_align="left"
-        )
-        console.print(response_panel)
-    
-    else:
+    if not shown and isinstance(response, dict):
+        # Câu trả lời lấy từ cache ngữ nghĩa: các bước không được stream, in tất cả một lần
+        for step in STEP_TITLES:
+            text = output_text(response.get(step))
+            if text:
+                console.print(step_panel(step, text))
+                shown = True
+
+    if not shown:
         console.print(str(response))
 
+    trace = get_trace(run_id)
+    if trace:
+        console.print(trace_panel(trace))
+
     console.print()
 
 
-# --- VÒNG LẶP TƯƠNG TÁC VỚI NGƯỜI DÙNG (Không thay đổi) ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cyber-Mentor AI - trợ lý pentest trên dòng lệnh.")
+    parser.add_argument("--plan-mode", choices=["chain", "fast"],
+                        help="Chế độ lập kế hoạch (mặc định theo FULL_PLAN_MODE): 4 bước nối tiếp hoặc 1 lần gọi LLM.")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="Không khởi động nền; tải model và tạo router khi có yêu cầu đầu tiên.")
+    return parser.parse_args(argv)
+
+
+# --- VÒNG LẶP TƯƠNG TÁC VỚI NGƯỜI DÙNG ---
 if __name__ == "__main__":
+    args = parse_args()
+    if args.plan_mode:
+        os.environ["FULL_PLAN_MODE"] = args.plan_mode
+    if not args.no_warmup:
+        # Tải model embedding, FAISS index, LLM và Agent trong lúc người dùng gõ yêu cầu đầu tiên
+        from core.warmup import start_warmup
+        start_warmup()
+
     welcome_panel = Panel(
         Text("Chào mừng đến với AI Pentesting Agent.\nHãy bắt đầu bằng cách nhập yêu cầu của bạn bên dưới.\nNhập 'exit', 'quit' hoặc 'thoat' để kết thúc.", justify="center"),
         title="[bold blue]🚀 Cyber-Mentor AI 🚀[/bold blue]",
@@ -0,0 +1,9 @@
+# File: tests/conftest.py
+# Cho phép import các module của project (core, kali_listener) khi chạy pytest từ bất kỳ thư mục nào.
+
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
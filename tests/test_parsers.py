@@ -0,0 +1,86 @@
+# File: tests/test_parsers.py
+# Kiểm tra các parser output tool (core/tools/parsers.py, parse_nmap_xml / split_nmap_report của Listener)
+# trên output thật trong benchmarks/fixtures.
+
+import os
+
+from core.tools.parsers import (DIRSEARCH_JSON_HEADER, SQLMAP_JSON_HEADER, extract_summary,
+                                parse_dirsearch_output, parse_sqlmap_output, summarize_dirsearch, summarize_sqlmap)
+from kali_listener import match_nmap_sections, parse_nmap_xml, split_nmap_report
+
+# Output thật của các tool (dùng chung với benchmarks/replay_tool.py)
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parse_sqlmap_injection_points():
+    result = parse_sqlmap_output(read_fixture("sqlmap.txt"))
+
+    assert [(p["parameter"], p["place"]) for p in result["injectable"]] == [("cat", "GET")]
+    techniques = result["injectable"][0]["techniques"]
+    assert [t["type"] for t in techniques] == ["boolean-based blind", "error-based", "time-based blind", "UNION query"]
+    assert techniques[0]["payload"] == "cat=1 AND 7364=7364"
+    assert result["dbms"] == "MySQL >= 5.6"
+    assert result["web_server_os"] == "Linux Ubuntu"
+    assert result["databases"] == ["acuart", "information_schema"]
+
+
+def test_summarize_sqlmap_round_trip():
+    output = read_fixture("sqlmap.txt")
+    summary = summarize_sqlmap(output)
+
+    assert summary.startswith(SQLMAP_JSON_HEADER)
+    assert len(summary) < len(output)
+    assert extract_summary(SQLMAP_JSON_HEADER, summary) == parse_sqlmap_output(output)
+
+
+def test_parse_sqlmap_empty_output():
+    assert parse_sqlmap_output("")["injectable"] == []
+
+
+def test_parse_dirsearch_paths_by_status():
+    result = parse_dirsearch_output(read_fixture("dirsearch.txt"))
+
+    assert result["total"] == 8
+    assert result["by_status"] == {"200": 4, "301": 2, "302": 1, "403": 1}
+    assert "/login.php (5KB)" in result["paths"]["200"]
+    assert result["paths"]["301"][0] == "/admin (169B) -> http://testphp.vulnweb.com/admin/"
+    assert result["paths"]["302"] == ["/logout.php (14B) -> login.php"]
+    assert result["paths"]["403"] == ["/.htaccess (276B)"]
+
+
+def test_summarize_dirsearch_round_trip():
+    output = read_fixture("dirsearch.txt")
+    summary = summarize_dirsearch(output)
+
+    assert summary.startswith(DIRSEARCH_JSON_HEADER)
+    assert extract_summary(DIRSEARCH_JSON_HEADER, summary) == parse_dirsearch_output(output)
+
+
+def test_parse_nmap_xml_ports_and_services():
+    result = parse_nmap_xml(os.path.join(FIXTURES, "nmap.xml"))
+
+    assert (result["hosts_up"], result["hosts_down"]) == (1, 0)
+    host = result["hosts"][0]
+    assert host["address"] == "45.33.32.156"
+    assert host["hostnames"] == ["scanme.nmap.org"]
+    open_ports = [p["port"] for p in host["ports"] if p["state"] == "open"]
+    assert open_ports == [22, 80, 9929, 31337]
+    assert [p["port"] for p in host["ports"] if p["state"] == "filtered"] == [25, 135]
+    http = next(p for p in host["ports"] if p["port"] == 80)
+    assert (http["service"], http["product"], http["version"]) == ("http", "Apache httpd", "2.4.7")
+    assert http["scripts"]["http-title"] == "Go ahead and ScanMe!"
+    assert host["os"]["name"] == "Linux 4.15 - 5.8"
+
+
+def test_split_nmap_report_by_requested_host():
+    sections = split_nmap_report(read_fixture("nmap.txt"))
+
+    assert list(sections) == ["scanme.nmap.org (45.33.32.156)"]
+    assert "22/tcp    open     ssh" in sections["scanme.nmap.org (45.33.32.156)"]
+    assert list(match_nmap_sections(sections, {"scanme.nmap.org"})) == ["scanme.nmap.org"]
+    assert list(match_nmap_sections(sections, {"45.33.32.156"})) == ["45.33.32.156"]
@@ -0,0 +1,122 @@
+# File: tests/test_result_cache.py
+# Kiểm tra cache kết quả và single-flight của Kali Listener (ResultCache, JobManager.submit).
+
+import os
+import stat
+from types import SimpleNamespace
+
+import pytest
+
+import kali_listener
+from kali_listener import JobManager, ResultCache, normalize_command
+
+POLICY = {"nmap": {"ttl": 60, "max_entries": 2}}
+
+
+def cached_job(params):
+    return SimpleNamespace(tool="nmap", key=normalize_command("nmap", params))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Giả lập time.time() của Listener để kiểm tra TTL mà không phải chờ."""
+    now = [1000.0]
+    monkeypatch.setattr(kali_listener.time, "time", lambda: now[0])
+    return now
+
+
+def test_key_is_the_executed_argv():
+    # Khóa là đúng danh sách tham số được chạy, không chuẩn hóa
+    assert normalize_command("sqlmap", ["-u", "http://t/a.php?id=1'", "--prefix=')"]) == \
+        ("sqlmap", ("-u", "http://t/a.php?id=1'", "--prefix=')"), False)
+    assert normalize_command("nmap", ["-sV"], structured=True) != normalize_command("nmap", ["-sV"])
+    # Khoảng trắng trong một tham số là một phần của argv, nên khóa khác nhau
+    assert cached_job(["--user-agent=Mozilla/5.0 (X11;  Linux)"]).key != cached_job(["--user-agent=Mozilla/5.0 (X11; Linux)"]).key
+    assert cached_job(["-sV -p 80", "a.com"]).key != cached_job(["-sV", "-p", "80", "a.com"]).key
+
+
+def test_params_are_executed_as_given(slow_tool):
+    manager = JobManager(max_workers=1, tool_limits={"nmap": 1}, cache_policy=POLICY, max_queue=4)
+    params = ["--prefix=')", "--user-agent=Mozilla/5.0 (X11; Linux)", r"--regexp=\d+"]
+    job, _ = manager.submit("nmap", params)
+    assert job.done.wait(10)
+    assert job.status == kali_listener.SUCCEEDED
+    assert job.command[1:] == params
+    assert job.output.strip() == " ".join(params)
+    job.remove_files()
+
+
+def test_cache_hit_and_miss(clock):
+    cache = ResultCache(POLICY)
+    job = cached_job(["-sV", "a.com"])
+    assert cache.get(job.key) is None
+    cache.put(job)
+    assert cache.get(job.key) is job
+    assert cache.get(cached_job(["-sV", "b.com"]).key) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_ttl_expiry(clock):
+    cache = ResultCache(POLICY)
+    job = cached_job(["-sV", "a.com"])
+    cache.put(job)
+    clock[0] += 60
+    assert cache.get(job.key) is job
+    clock[0] += 1
+    assert cache.get(job.key) is None
+    assert cache.stats()["entries"]["nmap"] == 0
+
+
+def test_cache_lru_eviction(clock):
+    cache = ResultCache(POLICY)
+    a, b, c = (cached_job(["-sV", host]) for host in ("a.com", "b.com", "c.com"))
+    cache.put(a)
+    cache.put(b)
+    assert cache.get(a.key) is a  # a vừa được dùng -> b là mục lâu không dùng nhất
+    cache.put(c)
+    assert cache.get(b.key) is None
+    assert cache.get(a.key) is a
+    assert cache.get(c.key) is c
+
+
+def test_cache_ignores_tools_without_policy():
+    cache = ResultCache(POLICY)
+    job = SimpleNamespace(tool="sqlmap", key=normalize_command("sqlmap", ["-u", "http://a.com"]))
+    cache.put(job)
+    assert cache.get(job.key) is None
+
+
+@pytest.fixture
+def slow_tool(tmp_path, monkeypatch):
+    """Một 'nmap' giả chạy chậm, để request thứ hai đến khi job đầu vẫn đang chạy."""
+    script = tmp_path / "nmap"
+    script.write_text('#!/bin/sh\nsleep 0.3\necho "$@"\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setitem(kali_listener.ALLOWED_TOOLS, "nmap", str(script))
+    monkeypatch.setattr(kali_listener, "SPOOL_DIR", str(tmp_path))
+    return script
+
+
+def test_single_flight_coalesces_identical_commands(slow_tool):
+    manager = JobManager(max_workers=2, tool_limits={"nmap": 2}, cache_policy=POLICY, max_queue=4)
+
+    first, source = manager.submit("nmap", ["-sV", "a.com"])
+    assert source == "new"
+    second, source = manager.submit("nmap", ["-sV", "a.com"])
+    assert (second, source) == (first, "inflight")
+    assert first.subscribers == 2
+    other, source = manager.submit("nmap", ["-sV", "b.com"])
+    assert source == "new" and other is not first
+
+    assert first.done.wait(10) and other.done.wait(10)
+    assert first.status == kali_listener.SUCCEEDED
+    assert first.output.strip() == "-sV a.com"
+
+    cached, source = manager.submit("nmap", ["-sV", "a.com"])
+    assert (cached, source) == (first, "cache")
+    fresh, source = manager.submit("nmap", ["-sV", "a.com"], use_cache=False)
+    assert source == "new" and fresh is not first
+    assert fresh.done.wait(10)
+    for job in (first, other, fresh):
+        job.remove_files()
+    assert not os.path.exists(first.spools["stdout"].path)